@@ -0,0 +1,27 @@
+"""
+Django app configuration for django-pyfs.
+"""
+import os
+
+from django.apps import AppConfig
+
+
+class DjpyfsConfig(AppConfig):
+    """
+    Prewarms django-pyfs when Django starts, if `prewarm` is set in `DJFS`
+    to a list of namespaces, so the first requests of a new worker don't pay
+    for building S3 clients and filesystems. Forked children, e.g. the
+    workers of a preforking server, drop what they inherited and prewarm
+    again.
+    """
+    name = 'djpyfs'
+    verbose_name = 'django-pyfs'
+    default_auto_field = 'django.db.models.AutoField'
+
+    def ready(self):
+        from . import djpyfs  # pylint: disable=import-outside-toplevel
+
+        if djpyfs.DJFS_SETTINGS.get('prewarm'):
+            djpyfs.prewarm()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=djpyfs.reset_after_fork)
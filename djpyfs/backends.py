@@ -0,0 +1,321 @@
+"""
+Expiration tracking backends for django-pyfs.
+
+By default expirations are stored in the `FSExpirations` model in the main
+database. Sites with a high write rate can move them to a key-value store
+instead, by pointing the `expiration_backend` key in `DJFS` at another
+backend class:
+
+    DJFS = {...,
+            'expiration_backend': {
+                'class': 'djpyfs.backends.SortedSetExpirationBackend',
+                'options': {'url': 'redis://localhost:6379/0'}}}
+"""
+import json
+import sqlite3
+import threading
+from collections import defaultdict, namedtuple
+from datetime import datetime
+from datetime import timezone as dt_timezone
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from .models import FSExpirations
+
+# One tracked file. `key` is a backend-specific tie breaker; together with
+# `expiration` it forms a cursor which can be passed back to `expired`.
+Expiration = namedtuple('Expiration', ['module', 'filename', 'expiration', 'key'])
+
+
+class ExpirationBackend:
+    """
+    Interface for storing file expirations.
+    """
+
+    def expire(self, module, filename, seconds, days=0, expires=True):  # pylint: disable=too-many-positional-arguments
+        """
+        Create or update the expiration of a file.
+
+        Arguments are the same as `FSExpirations.create_expiration`.
+        """
+        raise NotImplementedError
+
+    def expire_many(self, entries):
+        """
+        Create or update many expirations at once.
+
+        Arguments:
+            entries (list): `(module, filename, expiration, expires)` tuples,
+                where `expiration` is an absolute datetime
+        """
+        now = timezone.now()
+        for module, filename, expiration, expires in entries:
+            self.expire(module, filename, (expiration - now).total_seconds(), expires=expires)
+
+    def expired(self, after=None, limit=None):
+        """
+        Return expired files, ordered by `(expiration, key)`.
+
+        Arguments:
+            after (tuple): (optional) An `(expiration, key)` cursor; only
+                entries after it are returned.
+            limit (int): (optional) Maximum number of entries to return.
+
+        Returns:
+            list: `Expiration` tuples
+        """
+        raise NotImplementedError
+
+    def remove(self, expiration):
+        """
+        Stop tracking a file previously returned by `expired` or `soonest`.
+        """
+        raise NotImplementedError
+
+    def remove_many(self, expirations):
+        """
+        Stop tracking several files at once.
+        """
+        for expiration in expirations:
+            self.remove(expiration)
+
+    def iter_filenames(self, module):
+        """
+        Yield every file tracked in a namespace, expiring or not, ordered by
+        filename.
+
+        Returns:
+            generator: `Expiration` tuples
+        """
+        raise NotImplementedError
+
+    def soonest(self, module, limit):
+        """
+        Return the files of a namespace which are due to expire soonest,
+        whether or not they have expired yet.
+
+        Arguments:
+            module (str): Namespace of the filesystem
+            limit (int): Maximum number of entries to return
+
+        Returns:
+            list: `Expiration` tuples, ordered by `(expiration, key)`
+        """
+        raise NotImplementedError
+
+
+class DatabaseExpirationBackend(ExpirationBackend):
+    """
+    The default backend, which stores expirations in `FSExpirations`.
+
+    Arguments:
+        filename_collation (str): (optional) Database collation used to sort
+            filenames in `iter_filenames`. Reconciliation needs this order to
+            match Python's (code point order); set it to e.g. "C" on
+            PostgreSQL or "utf8mb4_bin" on MySQL if the column's default
+            collation does not.
+    """
+
+    def __init__(self, filename_collation=None):
+        self.filename_collation = filename_collation
+
+    def expire(self, module, filename, seconds, days=0, expires=True):  # pylint: disable=too-many-positional-arguments
+        FSExpirations.create_expiration(module, filename, seconds, days=days, expires=expires)
+
+    def expire_many(self, entries):
+        FSExpirations.create_expirations(entries)
+
+    def expired(self, after=None, limit=None):
+        objects = FSExpirations.expired().order_by('expiration', 'id')
+        if after is not None:
+            objects = objects.filter(Q(expiration__gt=after[0]) | Q(expiration=after[0], id__gt=int(after[1])))
+        if limit is not None:
+            objects = objects[:limit]
+        return [Expiration(o.module, o.filename, o.expiration, str(o.id)) for o in objects]
+
+    def remove(self, expiration):
+        FSExpirations.objects.filter(id=int(expiration.key)).delete()
+
+    def remove_many(self, expirations):
+        FSExpirations.objects.filter(id__in=[int(e.key) for e in expirations]).delete()
+
+    def iter_filenames(self, module):
+        # Stream the rows in chunks rather than loading the namespace
+        ordering = Collate('filename', self.filename_collation) if self.filename_collation else 'filename'
+        rows = FSExpirations.objects.filter(module=module).order_by(ordering, 'id').values_list(
+            'filename', 'expiration', 'id'
+        )
+        for filename, expiration, pk in rows.iterator(chunk_size=2000):
+            yield Expiration(module, filename, expiration, str(pk))
+
+    def soonest(self, module, limit):
+        objects = FSExpirations.objects.filter(module=module, expires=True).order_by('expiration', 'id')[:limit]
+        return [Expiration(o.module, o.filename, o.expiration, str(o.id)) for o in objects]
+
+
+class SortedSetExpirationBackend(ExpirationBackend):
+    """
+    Stores expirations in a sorted set scored by expiry time.
+
+    Setting an expiration is a single `ZADD` and finding expired files is a
+    `ZRANGEBYSCORE`, neither of which touches the main database. Files which
+    never expire are scored `+inf`, so they are tracked but never returned.
+
+    Arguments:
+        url (str): (optional) `redis://...` to use Redis (requires the `redis`
+            package), or `sqlite:///path/to/file` to use the local
+            `SQLiteSortedSet` stand-in. Without a URL, an in-memory stand-in
+            is used, which is only useful for development and tests.
+        key (str): Name of the sorted set
+        client (obj): (optional) An already configured client with the Redis
+            sorted set API, used instead of `url`.
+    """
+
+    def __init__(self, url=None, key='djpyfs:expirations', client=None):
+        self.key = key
+        if client is None:
+            if url and url.startswith('redis'):
+                try:
+                    import redis  # pylint: disable=import-outside-toplevel
+                except ImportError as e:
+                    raise ImproperlyConfigured("The redis package is required for a redis:// URL") from e
+                client = redis.Redis.from_url(url)
+            else:
+                client = SQLiteSortedSet(url[len('sqlite://'):] if url else ':memory:')
+        self.client = client
+
+    def expire(self, module, filename, seconds, days=0, expires=True):  # pylint: disable=too-many-positional-arguments
+        expiration = timezone.now() + timezone.timedelta(days, seconds)
+        self.expire_many([(module, filename, expiration, expires)])
+
+    def expire_many(self, entries):
+        scores = {}
+        module_scores = defaultdict(dict)
+        for module, filename, expiration, expires in entries:
+            member = json.dumps([module, filename], ensure_ascii=False)
+            scores[member] = module_scores[module][member] = expiration.timestamp() if expires else float('inf')
+        for module, members in module_scores.items():
+            self.client.zadd(self._module_key(module), members)
+        if scores:
+            self.client.zadd(self.key, scores)
+
+    def expired(self, after=None, limit=None):
+        low = after[0].timestamp() if after is not None else '-inf'
+        page = {'start': 0, 'num': limit + 1} if limit is not None else {}
+        entries = self.client.zrangebyscore(self.key, low, timezone.now().timestamp(), withscores=True, **page)
+        result = [self._entry(member, score) for member, score in entries]
+        if after is not None:
+            result = [e for e in result if (e.expiration, e.key) > tuple(after)]
+        return result[:limit]
+
+    def remove(self, expiration):
+        self.remove_many([expiration])
+
+    def remove_many(self, expirations):
+        members = defaultdict(list)
+        for expiration in expirations:
+            members[expiration.module].append(expiration.key)
+        for module, module_members in members.items():
+            self.client.zrem(self.key, *module_members)
+            self.client.zrem(self._module_key(module), *module_members)
+
+    def soonest(self, module, limit):
+        entries = self.client.zrangebyscore(
+            self._module_key(module), '-inf', '+inf', start=0, num=limit, withscores=True
+        )
+        return [self._entry(member, score) for member, score in entries if score != float('inf')]
+
+    def iter_filenames(self, module):
+        # Sorted sets are ordered by score, so the namespace has to be
+        # fetched and sorted in memory.
+        entries = self.client.zrangebyscore(self._module_key(module), '-inf', '+inf', withscores=True)
+        yield from sorted((self._entry(member, score) for member, score in entries), key=lambda e: e.filename)
+
+    def _module_key(self, module):
+        return f"{self.key}:{module}"
+
+    @staticmethod
+    def _entry(member, score):
+        """
+        Build an `Expiration` from a sorted set member and its score.
+        """
+        if isinstance(member, bytes):
+            member = member.decode('utf-8')
+        module, filename = json.loads(member)
+        if score == float('inf'):
+            expiration = datetime.max.replace(tzinfo=dt_timezone.utc)
+        else:
+            expiration = datetime.fromtimestamp(score, tz=dt_timezone.utc)
+        return Expiration(module, filename, expiration, member)
+
+
+class SQLiteSortedSet:
+    """
+    A local stand-in for the subset of the Redis sorted set API used by
+    `SortedSetExpirationBackend`, stored in SQLite.
+    """
+
+    def __init__(self, path=':memory:'):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS zset (name TEXT, member TEXT, score REAL, PRIMARY KEY (name, member))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS zset_score ON zset (name, score, member)")
+
+    def zadd(self, name, mapping):
+        """
+        Add or update members with their scores.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO zset (name, member, score) VALUES (?, ?, ?) "
+                "ON CONFLICT (name, member) DO UPDATE SET score = excluded.score",
+                [(name, member, float(score)) for member, score in mapping.items()]
+            )
+        return len(mapping)
+
+    def zrangebyscore(self, name, min, max,  # pylint: disable=redefined-builtin,too-many-positional-arguments
+                      start=None, num=None, withscores=False):
+        """
+        Return members with `min <= score <= max`, lowest score first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT member, score FROM zset WHERE name = ? AND score >= ? AND score <= ? "
+                "ORDER BY score, member LIMIT ? OFFSET ?",
+                (name, float(min), float(max), -1 if num is None else num, start or 0)
+            ).fetchall()
+        if withscores:
+            return rows
+        return [member for member, _ in rows]
+
+    def zscore(self, name, member):
+        """
+        Return the score of a member, or None.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score FROM zset WHERE name = ? AND member = ?", (name, member)
+            ).fetchone()
+        return row[0] if row else None
+
+    def zrem(self, name, *members):
+        """
+        Remove members from the set.
+        """
+        with self._lock:
+            cursor = self._conn.executemany(
+                "DELETE FROM zset WHERE name = ? AND member = ?", [(name, member) for member in members]
+            )
+        return cursor.rowcount
+
+    def zcard(self, name):
+        """
+        Return the number of members in the set.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM zset WHERE name = ?", (name,)).fetchone()[0]
@@ -0,0 +1,190 @@
+"""
+Transparent compression of stored files.
+
+When `compression` is set in `DJFS`, files whose content type matches its
+rules are compressed as they are written and decompressed as they are read
+back through the filesystem:
+
+    DJFS = {...,
+            'compression': {'encoding': 'gzip',  # or 'zstd'
+                            'level': 6,
+                            'content_types': ['application/json', 'text/*']}}
+
+Compression is streamed, so large files are never held in memory. On S3 the
+objects are stored with a `Content-Encoding` header, so URLs from `get_url`
+are decompressed by browsers. On OSFS the web server serving `url_root`
+has to send that header itself. Sizes reported by the filesystem are those
+of the compressed data.
+
+The `zstd` encoding needs the `zstandard` package.
+"""
+import fnmatch
+import gzip
+import mimetypes
+import types
+
+from django.core.exceptions import ImproperlyConfigured
+from fs import errors
+from fs.base import FS
+from fs.iotools import RawWrapper
+from fs.mode import Mode
+from fs.tools import copy_file_data
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Content types compressed unless `content_types` is given. These are the
+# text formats we store which typically shrink 5-10x.
+DEFAULT_CONTENT_TYPES = (
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+    'text/*',
+)
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+class _StreamFile(RawWrapper):
+    """
+    Binary file which reads or writes through a (de)compressing stream, and
+    closes the underlying file along with it.
+    """
+
+    def __init__(self, stream, raw, mode, name):
+        super().__init__(stream, mode=mode, name=name)
+        self._raw = raw
+
+    def close(self):
+        if not self.closed:
+            try:
+                super().close()
+            finally:
+                self._raw.close()
+
+    def seekable(self):
+        return False
+
+    def fileno(self):
+        raise OSError("compressed files have no file descriptor")
+
+
+def _compressor(encoding, level, raw):
+    """
+    Returns a writable stream which compresses into `raw`.
+    """
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=False)
+    return gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=level, mtime=0)
+
+
+def _decompressor(raw):
+    """
+    Returns a readable stream which decompresses `raw`, or None if `raw` does
+    not start with a known compression header.
+    """
+    magic = raw.read(len(ZSTD_MAGIC))
+    raw.seek(0)
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=raw, mode='rb')
+    if magic == ZSTD_MAGIC and zstandard is not None:
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=False)
+    return None
+
+
+def decoding_reader(raw, content_encoding, name=None):
+    """
+    Returns a readable, unseekable stream which decodes `raw` according to
+    its `Content-Encoding`, and closes `raw` along with it.
+
+    Arguments:
+        raw (obj): Binary stream, such as the body of an S3 object
+        content_encoding (str): The `Content-Encoding` of the data, if any
+        name (str): (optional) Name of the file, for error messages
+    """
+    encoding = (content_encoding or '').split(',')[0].strip()
+    if encoding == 'gzip':
+        return _StreamFile(gzip.GzipFile(fileobj=raw, mode='rb'), raw, 'rb', name)
+    if encoding == 'zstd' and zstandard is not None:
+        return _StreamFile(zstandard.ZstdDecompressor().stream_reader(raw, closefd=False), raw, 'rb', name)
+    return raw
+
+
+def patch_compression(fs, config):
+    """
+    Patch a filesystem instance to compress matching files.
+
+    Arguments:
+        fs (obj): The pyfilesystem subclass instance to be patched.
+        config (dict): `encoding` ("gzip" or "zstd", default "gzip"),
+            `level` and `content_types`, a list of content types or
+            patterns such as "text/*".
+    Returns:
+        obj: Patched filesystem instance
+    """
+    encoding = config.get('encoding', 'gzip')
+    if encoding not in ('gzip', 'zstd'):
+        raise ImproperlyConfigured(f"Bad compression encoding: {encoding}")
+    if encoding == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured("The zstandard package is required for zstd compression")
+    level = config.get('level', 6 if encoding == 'gzip' else 3)
+    content_types = config.get('content_types', DEFAULT_CONTENT_TYPES)
+
+    def should_compress(path):
+        content_type, _ = mimetypes.guess_type(path)
+        return content_type is not None and any(fnmatch.fnmatch(content_type, rule) for rule in content_types)
+
+    openbin = fs.openbin
+
+    def compressing_openbin(self, path, mode="r", buffering=-1, **options):  # pylint: disable=unused-argument
+        _mode = Mode(mode)
+        if not should_compress(path):
+            return openbin(path, mode, buffering, **options)
+        if _mode.reading and _mode.writing:
+            raise errors.Unsupported(f"cannot open compressed file for reading and writing: '{path}'")
+        raw = openbin(path, mode, buffering, **options)
+        if _mode.writing:
+            # Appending adds a new compressed member, which both gzip and
+            # zstd decompress as one stream.
+            return _StreamFile(_compressor(encoding, level, raw), raw, mode, path)
+        stream = _decompressor(raw)
+        if stream is None:
+            # Written before compression was turned on
+            return raw
+        return _StreamFile(stream, raw, mode, path)
+
+    def compressing_writebytes(self, path, contents):
+        if not isinstance(contents, bytes):
+            raise TypeError("contents must be bytes")
+        with self.openbin(path, 'wb') as write_file:
+            write_file.write(contents)
+
+    def compressing_upload(self, path, file, chunk_size=None, **options):
+        with self.openbin(path, 'wb', **options) as dst_file:
+            copy_file_data(file, dst_file, chunk_size=chunk_size)
+
+    # Make every read and write go through `openbin`; OSFS implements text
+    # mode `open` and S3FS `writebytes`, `upload` and `readbytes` directly.
+    for name in ('open', 'readbytes', 'download'):
+        if getattr(type(fs), name) is not getattr(FS, name):
+            setattr(fs, name, types.MethodType(getattr(FS, name), fs))
+    fs.openbin = types.MethodType(compressing_openbin, fs)
+    fs.writebytes = types.MethodType(compressing_writebytes, fs)
+    fs.upload = types.MethodType(compressing_upload, fs)
+
+    if hasattr(fs, '_get_upload_args'):
+        get_upload_args = fs._get_upload_args  # pylint: disable=protected-access
+
+        def compressed_upload_args(self, key):  # pylint: disable=unused-argument
+            upload_args = get_upload_args(key)
+            if should_compress(key):
+                upload_args['ContentEncoding'] = encoding
+            return upload_args
+
+        fs._get_upload_args = types.MethodType(compressed_upload_args, fs)  # pylint: disable=protected-access
+
+    return fs
@@ -9,16 +9,39 @@ filesystem.
 task can garbage-collect those objects.
 """
 
+import contextlib
+import contextvars
 import os
 import os.path
+import threading
+import time
 import types
+import uuid
+from collections import namedtuple
 
-import boto3
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from fs.osfs import OSFS
-from fs_s3fs import S3FS
 
-from .models import FSExpirations
+from . import write_behind
+from .backends import DatabaseExpirationBackend
+from .compression import patch_compression
+from .export import namespace_entries, zip_stream
+from .listing import iter_osfs_entries, iter_s3_entries, normalize_prefix
+from .models import FSExpirations, FSSweepCheckpoint
+from .packing import batch_packing  # pylint: disable=unused-import
+from .packing import patch_packing
+from .profiling import profile  # pylint: disable=unused-import
+from .profiling import patch_profiling
+from .reconcile import reconcile_namespace
+from .resilience import ResilientS3FS, make_client
+from .url_policies import cloudfront_policy, get_url_policy, make_url_method
+from .usage import patch_usage
+from .write_behind import patch_write_behind, upload_pending
+from .zerocopy import patch_zerocopy
 
 if hasattr(settings, 'DJFS'):
     DJFS_SETTINGS = settings.DJFS  # pragma: no cover
@@ -31,6 +54,24 @@ else:
 # several times in a request. Connections are set up below in `get_s3_url`.
 S3CONN = None
 
+# The active expiration backend, and the settings it was built from. See
+# `get_expiration_backend`.
+EXPIRATION_BACKEND = None
+_EXPIRATION_BACKEND_CONFIG = None
+
+# The `ExpirationBuffer` collecting `expire` calls in the current block, if
+# any. See `defer_expirations`.
+_EXPIRATION_BUFFER = contextvars.ContextVar('djpyfs_expiration_buffer', default=None)
+
+# A slice of the expired set, planned by `plan_expiration_chunks`
+ExpirationChunk = namedtuple('ExpirationChunk', ['module', 'min_id', 'max_id', 'cutoff'])
+
+# Filesystems shared by `get_cached_filesystem`, keyed by namespace, and the
+# settings they were built from.
+FILESYSTEMS = {}
+_FILESYSTEMS_SETTINGS = None
+_FILESYSTEMS_LOCK = threading.Lock()
+
 
 def get_filesystem(namespace):
     """
@@ -49,31 +90,342 @@ def get_filesystem(namespace):
         raise AttributeError("Bad filesystem: " + str(DJFS_SETTINGS['type']))
 
 
+def get_cached_filesystem(namespace):
+    """
+    Returns a patched filesystem for a namespace, like `get_filesystem`, but
+    shared by every caller in the process instead of built afresh each time.
+
+    Building a filesystem is cheap on disk, but on S3 it sets up a client and
+    checks the bucket, which adds up when done per request or per file.
+    """
+    global _FILESYSTEMS_SETTINGS
+
+    fs = FILESYSTEMS.get(namespace)
+    if fs is None or _FILESYSTEMS_SETTINGS is not DJFS_SETTINGS:
+        with _FILESYSTEMS_LOCK:
+            if _FILESYSTEMS_SETTINGS is not DJFS_SETTINGS:
+                FILESYSTEMS.clear()
+                _FILESYSTEMS_SETTINGS = DJFS_SETTINGS
+            fs = FILESYSTEMS.get(namespace)
+            if fs is None:
+                fs = FILESYSTEMS[namespace] = get_filesystem(namespace)
+    return fs
+
+
+def get_expiration_backend():
+    """
+    Returns the backend which tracks file expirations.
+
+    This is configured by the `expiration_backend` key in `DJFS_SETTINGS`, a
+    dict with the dotted path of an `ExpirationBackend` subclass as `class`
+    and its keyword arguments as `options`. The default is the
+    `FSExpirations` model. See `djpyfs.backends` for the alternatives.
+    """
+    global EXPIRATION_BACKEND, _EXPIRATION_BACKEND_CONFIG
+
+    config = DJFS_SETTINGS.get('expiration_backend')
+    if EXPIRATION_BACKEND is None or config is not _EXPIRATION_BACKEND_CONFIG:
+        options = config or {}
+        backend_class = import_string(options.get('class', 'djpyfs.backends.DatabaseExpirationBackend'))
+        EXPIRATION_BACKEND = backend_class(**options.get('options', {}))
+        _EXPIRATION_BACKEND_CONFIG = config
+    return EXPIRATION_BACKEND
+
+
+class ExpirationBuffer:
+    """
+    Collects `expire` calls so they can be written in one bulk upsert.
+
+    Calls for the same file are deduplicated; the last one wins.
+    """
+
+    def __init__(self):
+        self.entries = {}
+
+    def add(self, module, filename, seconds, days=0, expires=True):  # pylint: disable=too-many-positional-arguments
+        """
+        Record an expiration. The expiration time is computed now, not when
+        the buffer is flushed.
+        """
+        expiration = timezone.now() + timezone.timedelta(days, seconds)
+        self.entries[(module, filename)] = (expiration, expires)
+
+    def flush(self):
+        """
+        Write all recorded expirations to the expiration backend.
+        """
+        entries, self.entries = self.entries, {}
+        if entries:
+            get_expiration_backend().expire_many([
+                (module, filename, expiration, expires)
+                for (module, filename), (expiration, expires) in entries.items()
+            ])
+
+
+@contextlib.contextmanager
+def defer_expirations():
+    """
+    Context manager which collects `expire` calls made in its block and
+    writes them in one bulk upsert, instead of one query per call.
+
+    If the block ends inside a transaction, the expirations are written when
+    it commits (and dropped if it rolls back, along with whatever else the
+    block did). Otherwise they are written as the block exits, whether or
+    not it raised, so files which were written are still tracked. Nested
+    blocks join the outermost one.
+
+    Yields:
+        ExpirationBuffer: The buffer collecting the expirations
+    """
+    buffer = _EXPIRATION_BUFFER.get()
+    if buffer is not None:
+        yield buffer
+        return
+
+    buffer = ExpirationBuffer()
+    token = _EXPIRATION_BUFFER.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _EXPIRATION_BUFFER.reset(token)
+        transaction.on_commit(buffer.flush)
+
+
 def expire_objects():
     """
     Remove all obsolete objects from the file systems.
     """
-    objects = sorted(FSExpirations.expired(), key=lambda x: x.module)
+    backend = get_expiration_backend()
+    objects = sorted(backend.expired(), key=lambda x: x.module)
     fs = None
     module = None
+    filesystems = []
     for o in objects:
         if module != o.module:
             module = o.module
             fs = get_filesystem(module)
+            filesystems.append(fs)
         if fs.exists(o.filename):
             fs.remove(o.filename)
-        o.delete()
+        backend.remove(o)
+    _compact_packs(filesystems)
+
+
+def _compact_packs(filesystems):
+    """
+    Reclaim the space of removed packed files in the given filesystems, if
+    they pack small files.
+    """
+    for fs in filesystems:
+        if hasattr(fs, 'compactpacks'):
+            fs.compactpacks()
 
 
-def patch_fs(fs, namespace, url_method):
+def sweep_expired_objects(name='default', max_rows=None, max_seconds=None, batch_size=500):
     """
-    Patch a filesystem instance to add the `get_url` and `expire` methods.
+    Remove obsolete objects in a bounded, resumable pass.
+
+    Unlike `expire_objects`, this walks the expired set in `(expiration, key)`
+    order, records its progress in a `FSSweepCheckpoint` after every batch
+    and stops once it has used up its budget. The next call picks up where
+    the previous one stopped, so it is suited to short, frequent runs from
+    cron or a task queue. Only one sweeper with a given `name` runs at a
+    time, across all hosts sharing the database.
+
+    Budgets default to the `sweep_max_rows` and `sweep_max_seconds` keys in
+    `DJFS_SETTINGS`; if neither is set the sweep runs until the expired set is
+    exhausted. The lock is a lease, renewed after every batch;
+    `sweep_lock_timeout` overrides how long it lasts without renewal.
+
+    Arguments:
+        name (str): Name of the sweep, used for the checkpoint and lock
+        max_rows (int): (optional) Maximum number of expirations to process
+        max_seconds (int): (optional) Stop after roughly this many seconds
+        batch_size (int): Number of rows to fetch and checkpoint at once
+
+    Returns:
+        int: Number of expirations processed, or None if another sweeper
+            currently holds the lock.
+    """
+    if max_rows is None:
+        max_rows = DJFS_SETTINGS.get('sweep_max_rows')
+    if max_seconds is None:
+        max_seconds = DJFS_SETTINGS.get('sweep_max_seconds')
+    lock_timeout = DJFS_SETTINGS.get('sweep_lock_timeout', (max_seconds or 3540) + 60)
+
+    checkpoint = FSSweepCheckpoint.acquire(name, uuid.uuid4().hex, lock_timeout)
+    if checkpoint is None:
+        return None
+
+    backend = get_expiration_backend()
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    last = (checkpoint.last_expiration, checkpoint.last_key)
+    filesystems = {}
+    processed = 0
+    try:
+        while max_rows is None or processed < max_rows:
+            limit = batch_size if max_rows is None else min(batch_size, max_rows - processed)
+            objects = backend.expired(after=last if last[0] is not None else None, limit=limit)
+
+            for o in objects:
+                if o.module not in filesystems:
+                    filesystems[o.module] = get_filesystem(o.module)
+                fs = filesystems[o.module]
+                if fs.exists(o.filename):
+                    fs.remove(o.filename)
+                backend.remove(o)
+                last = (o.expiration, o.key)
+                processed += 1
+                if deadline is not None and time.monotonic() >= deadline:
+                    return processed
+
+            if len(objects) < limit:
+                # We have reached the end of the expired set; the next pass
+                # starts from the top.
+                last = (None, None)
+                break
+            if not checkpoint.record(*last):
+                # Our lease lapsed and another sweeper took over
+                return processed
+    finally:
+        checkpoint.record(*last)
+        checkpoint.release()
+        _compact_packs(filesystems.values())
+    return processed
+
+
+def plan_expiration_chunks(chunk_size=1000, cutoff=None):
+    """
+    Split the expired set into chunks which can be processed independently,
+    e.g. by many task queue workers, with `process_expiration_chunk`.
+
+    Each chunk covers up to `chunk_size` expired rows of one namespace, as
+    an id range. The plan is a snapshot as of `cutoff`: rows expiring later,
+    or whose expiration is pushed back meanwhile, are left alone by the
+    chunks. Ids are streamed from the database, so planning takes constant
+    memory.
+
+    This works on the `FSExpirations` model, so it needs the default
+    expiration backend.
+
+    Arguments:
+        chunk_size (int): Maximum number of rows per chunk
+        cutoff (datetime): (optional) Plan files expired at this time;
+            defaults to now
+
+    Returns:
+        generator: `ExpirationChunk` tuples
+    """
+    if not isinstance(get_expiration_backend(), DatabaseExpirationBackend):
+        raise ImproperlyConfigured("Expiration chunks need the FSExpirations backend")
+    if cutoff is None:
+        cutoff = timezone.now()
+
+    expired = FSExpirations.objects.filter(expires=True, expiration__lte=cutoff)
+    for module in expired.order_by('module').values_list('module', flat=True).distinct():
+        ids = expired.filter(module=module).order_by('id').values_list('id', flat=True)
+        first = last = None
+        count = 0
+        for row_id in ids.iterator(chunk_size=2000):
+            if first is None:
+                first = row_id
+            last = row_id
+            count += 1
+            if count == chunk_size:
+                yield ExpirationChunk(module, first, last, cutoff)
+                first, count = None, 0
+        if first is not None:
+            yield ExpirationChunk(module, first, last, cutoff)
+
+
+def process_expiration_chunk(module, min_id, max_id, cutoff):
+    """
+    Remove the expired files of one chunk from `plan_expiration_chunks`.
+
+    Safe to run more than once, or at the same time as other sweeps: rows
+    already removed are skipped, and a row whose expiration changed since it
+    was read is kept.
+
+    Arguments:
+        module (str): Namespace of the chunk
+        min_id (int): First row id of the chunk
+        max_id (int): Last row id of the chunk
+        cutoff (datetime): Time the chunk was planned for
+
+    Returns:
+        int: Number of expirations removed
+    """
+    rows = FSExpirations.objects.filter(
+        module=module, id__gte=min_id, id__lte=max_id, expires=True, expiration__lte=cutoff
+    ).order_by('id')
+    fs = get_filesystem(module)
+    removed = 0
+    for o in rows:
+        if fs.exists(o.filename):
+            fs.remove(o.filename)
+        removed += FSExpirations.objects.filter(id=o.id, expiration=o.expiration).delete()[0]
+    _compact_packs([fs])
+    return removed
+
+
+def reconcile_orphans(namespace, untracked='report', missing='report', **kwargs):
+    """
+    Find, and optionally clean up, files in a namespace which have no
+    expiration and expirations whose file is gone. See
+    `djpyfs.reconcile.reconcile_namespace` for the arguments.
+
+    Returns:
+        ReconcileResult: Counts of files, tracked files, and orphans found
+    """
+    return reconcile_namespace(
+        get_filesystem(namespace), namespace, get_expiration_backend(),
+        untracked=untracked, missing=missing, **kwargs
+    )
+
+
+def export_zip(namespace, prefix='', **kwargs):
+    """
+    Stream a zip archive of the files in a namespace, without temporary
+    files. See `djpyfs.export.zip_stream` for the keyword arguments.
+
+    Arguments:
+        namespace (str): Namespace to export
+        prefix (str): Only export files whose names start with this string
+
+    Returns:
+        generator: Chunks of the archive, as bytes
+
+    Raises:
+        fs.errors.IllegalBackReference: If `prefix` leads out of the
+            namespace
+    """
+    # Checked here rather than once the archive has started streaming
+    prefix = normalize_prefix(prefix)
+    fs = get_filesystem(namespace)
+    return zip_stream(fs, namespace_entries(fs, namespace, prefix), **kwargs)
+
+
+def patch_fs(fs, namespace, url_method, iter_method=None):
+    """
+    Patch a filesystem instance to add the `get_url`, `expire` and
+    `iter_entries` methods, and `open_mmap` and `copy_to_socket` (see
+    `djpyfs.zerocopy`).
+
+    If `usage_accounting` is set in `DJFS_SETTINGS`, or the namespace has a
+    quota (the `quotas` dict, keyed by namespace, or `default_quota`), writes
+    and removes also keep the usage totals of the namespace up to date. See
+    `djpyfs.usage`. If `compression` is set, matching files are compressed
+    transparently; see `djpyfs.compression`. If `packing` is set, small files
+    written with `writepacked` are packed together; see `djpyfs.packing`.
 
     Arguments:
         fs (obj): The pyfilesystem subclass instance to be patched.
         namespace (str): Namespace of the filesystem, used in `expire`
         url_method (func): Function to patch into the filesyste instance as
             `get_url`. Allows filesystem independent implementation.
+        iter_method (func): (optional) Function to patch into the filesystem
+            instance as `iter_entries`, a streaming listing of the
+            namespace. See `djpyfs.listing`.
     Returns:
         obj: Patched filesystem instance
     """
@@ -82,6 +434,9 @@ def patch_fs(fs, namespace, url_method):
         """
         Set the lifespan of a file on the filesystem.
 
+        Inside a `defer_expirations` block the expiration is not written
+        until the block ends.
+
         Arguments:
             filename (str): Name of file
             expires (bool): False means the file will never be removed seconds
@@ -95,11 +450,29 @@ def patch_fs(fs, namespace, url_method):
         Returns:
             None
         """
-        FSExpirations.create_expiration(namespace, filename, seconds, days=days, expires=expires)
+        buffer = _EXPIRATION_BUFFER.get()
+        if buffer is not None:
+            buffer.add(namespace, filename, seconds, days=days, expires=expires)
+        else:
+            get_expiration_backend().expire(namespace, filename, seconds, days=days, expires=expires)
 
     fs.expire = types.MethodType(expire, fs)
     fs.get_url = types.MethodType(url_method, fs)
-    return fs
+    if iter_method is not None:
+        fs.iter_entries = types.MethodType(iter_method, fs)
+    fs = patch_zerocopy(fs)
+
+    quota = DJFS_SETTINGS.get('quotas', {}).get(namespace, DJFS_SETTINGS.get('default_quota'))
+    if DJFS_SETTINGS.get('usage_accounting') or quota:
+        fs = patch_usage(fs, namespace, get_expiration_backend, quota)
+
+    # Applied after usage accounting, so that counts the compressed size
+    if DJFS_SETTINGS.get('compression'):
+        fs = patch_compression(fs, DJFS_SETTINGS['compression'])
+    if DJFS_SETTINGS.get('packing'):
+        fs = patch_packing(fs, namespace, DJFS_SETTINGS['packing'])
+    # Outermost, so calls are timed as the caller sees them
+    return patch_profiling(fs, namespace)
 
 
 def get_osfs(namespace):
@@ -115,7 +488,8 @@ def get_osfs(namespace):
         namespace,
         # This is the OSFS implementation of `get_url`, note that it ignores
         # the timeout param so all OSFS file urls have no time limits.
-        lambda self, filename, timeout=0: os.path.join(DJFS_SETTINGS['url_root'], namespace, filename)
+        lambda self, filename, timeout=0: os.path.join(DJFS_SETTINGS['url_root'], namespace, filename),
+        iter_osfs_entries
     )
     return osfs
 
@@ -124,18 +498,12 @@ def get_s3fs(namespace):
     """
     Helper method to get_filesystem for a file system on S3
     """
-    key_id = DJFS_SETTINGS.get('aws_access_key_id', None)
-    key_secret = DJFS_SETTINGS.get('aws_secret_access_key', None)
-    region = DJFS_SETTINGS.get('region', None)
-
     fullpath = namespace
 
     if 'prefix' in DJFS_SETTINGS:
         fullpath = os.path.join(DJFS_SETTINGS['prefix'], fullpath)
 
-    s3fs = S3FS(DJFS_SETTINGS['bucket'], fullpath,
-                aws_access_key_id=key_id, aws_secret_access_key=key_secret,
-                region=region)
+    s3fs = ResilientS3FS(DJFS_SETTINGS, fullpath)
 
     def get_s3_url(self, filename, timeout=60):  # pylint: disable=unused-argument
         """
@@ -155,36 +523,146 @@ def get_s3fs(namespace):
         """
         global S3CONN
 
-        try:
-            if not S3CONN:
-                S3CONN = boto3.client('s3', aws_access_key_id=key_id,
-                                      aws_secret_access_key=key_secret,
-                                      region_name=region)
-
-            return S3CONN.generate_presigned_url(
-                "get_object",
-                Params={
-                    "Bucket": DJFS_SETTINGS['bucket'],
-                    "Key": os.path.join(fullpath, filename),
-                },
-                ExpiresIn=timeout
-            )
-
-        except Exception:  # pylint: disable=broad-except
-            # Retry on error; typically, if the connection has timed out, but
-            # the broad except covers all errors.
-            S3CONN = boto3.client('s3', aws_access_key_id=key_id,
-                                  aws_secret_access_key=key_secret,
-                                  region_name=region)
-
-            return S3CONN.generate_presigned_url(
-                "get_object",
-                Params={
-                    "Bucket": DJFS_SETTINGS['bucket'],
-                    "Key": os.path.join(fullpath, filename),
-                },
-                ExpiresIn=timeout
-            )
-
-    s3fs = patch_fs(s3fs, namespace, get_s3_url)
+        # Presigning happens locally, without a request to S3, so there is
+        # nothing to retry.
+        if not S3CONN:
+            S3CONN = make_client(DJFS_SETTINGS)
+
+        return S3CONN.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": DJFS_SETTINGS['bucket'],
+                "Key": os.path.join(fullpath, filename),
+            },
+            ExpiresIn=timeout
+        )
+
+    # Namespaces with a public, CDN or CloudFront URL policy don't need to
+    # presign each URL.
+    url_method = make_url_method(get_url_policy(DJFS_SETTINGS, namespace), DJFS_SETTINGS, fullpath) or get_s3_url
+
+    if 'write_behind' in DJFS_SETTINGS:
+        s3fs, url_method = patch_write_behind(s3fs, namespace, DJFS_SETTINGS['write_behind'], url_method)
+
+    s3fs = patch_fs(s3fs, namespace, url_method, iter_s3_entries)
     return s3fs
+
+
+def prewarm(namespaces=None):
+    """
+    Build and cache what the first use of django-pyfs in a process would
+    otherwise pay for: the filesystems of `namespaces` (see
+    `get_cached_filesystem`), their S3 clients, the client `get_url`
+    presigns with, and the expiration backend.
+
+    Arguments:
+        namespaces (list): (optional) Namespaces to prewarm; defaults to the
+            `prewarm` list in `DJFS_SETTINGS`
+    """
+    global S3CONN
+
+    if namespaces is None:
+        namespaces = DJFS_SETTINGS.get('prewarm') or []
+    get_expiration_backend()
+    for namespace in namespaces:
+        fs = get_cached_filesystem(namespace)
+        if hasattr(fs, 'client'):
+            fs.client  # pylint: disable=pointless-statement
+    if DJFS_SETTINGS['type'] == 's3fs' and not S3CONN:
+        S3CONN = make_client(DJFS_SETTINGS)
+
+
+def reset_after_fork():
+    """
+    Drop clients, filesystems and threads inherited from the parent process,
+    which must not be shared with it, and prewarm again if configured.
+    `djpyfs.apps.DjpyfsConfig` runs this in every forked child.
+    """
+    global S3CONN, EXPIRATION_BACKEND, _FILESYSTEMS_SETTINGS
+
+    S3CONN = None
+    EXPIRATION_BACKEND = None
+    FILESYSTEMS.clear()
+    _FILESYSTEMS_SETTINGS = None
+    write_behind.reset_after_fork()
+    if DJFS_SETTINGS.get('prewarm'):
+        prewarm()
+
+
+def health_check(namespaces=None):
+    """
+    Check that the storage and the expiration backend can be reached.
+
+    Arguments:
+        namespaces (list): (optional) Namespaces whose storage to check;
+            defaults to the `prewarm` list in `DJFS_SETTINGS`. The bucket or
+            directory root is always checked. On OSFS, checking a namespace
+            creates its directory if it does not exist yet.
+
+    Returns:
+        dict: `"ok"` or an error message, by check; `storage`,
+            `expiration_backend`, and `storage:<namespace>` for each
+            namespace
+    """
+    if namespaces is None:
+        namespaces = DJFS_SETTINGS.get('prewarm') or []
+    checks = {}
+
+    def check(name, func):
+        try:
+            func()
+        except Exception as e:  # pylint: disable=broad-except
+            checks[name] = f"{type(e).__name__}: {e}"
+        else:
+            checks[name] = 'ok'
+
+    def check_storage():
+        if DJFS_SETTINGS['type'] == 's3fs':
+            make_client(DJFS_SETTINGS).head_bucket(Bucket=DJFS_SETTINGS['bucket'])
+        elif not os.access(DJFS_SETTINGS['directory_root'], os.W_OK):
+            raise OSError(f"{DJFS_SETTINGS['directory_root']} is not writable")
+
+    check('storage', check_storage)
+    check('expiration_backend', lambda: get_expiration_backend().expired(limit=1))
+    for namespace in namespaces:
+        check(f'storage:{namespace}', lambda namespace=namespace: get_cached_filesystem(namespace).exists('/'))
+    return checks
+
+
+def upload_write_behind(limit=None):
+    """
+    Upload the due files queued by S3 namespaces in write-behind mode. See
+    `djpyfs.write_behind.upload_pending`.
+
+    Arguments:
+        limit (int): (optional) Maximum number of files to attempt
+
+    Returns:
+        int: Number of files uploaded
+    """
+    return upload_pending(get_filesystem, limit=limit)
+
+
+def get_signed_cookies(namespace, timeout=0):
+    """
+    Returns CloudFront signed cookies granting access to a namespace.
+
+    Only meaningful for namespaces with a `cloudfront` URL policy; set
+    `cookies` in the policy to have `get_url` return bare URLs which rely on
+    these cookies. The cookies are signed once and reused until they are
+    about to expire.
+
+    Arguments:
+        namespace (str): Namespace of the filesystem
+        timeout (int): Minimum number of seconds the cookies must stay valid
+
+    Returns:
+        dict: Cookie names and values
+    """
+    policy = get_url_policy(DJFS_SETTINGS, namespace)
+    if policy.get('type') != 'cloudfront':
+        raise AttributeError("Namespace does not use a CloudFront URL policy: " + namespace)
+    fullpath = namespace
+    if 'prefix' in DJFS_SETTINGS:
+        fullpath = os.path.join(DJFS_SETTINGS['prefix'], fullpath)
+    return cloudfront_policy(policy, fullpath.strip('/')).cookies(timeout)
@@ -0,0 +1,220 @@
+"""
+Streaming zip export of a namespace.
+
+`zip_stream` builds a zip archive on the fly while it is being sent, so
+nothing is copied to a temporary directory and the first bytes go out as
+soon as the first file starts downloading. Memory use is bounded by the
+prefetch window, not by the size of the namespace or of any one file:
+
+* The next `prefetch` files are opened by a thread pool while the current
+  one is being sent, each reading at most `head_size` bytes ahead. Small
+  files, the common case, are then already in memory when their turn comes.
+* The rest of a larger file is streamed through `chunk_size` bytes at a
+  time. On S3 it is read straight from the `GetObject` response body, since
+  `S3FS.openbin` downloads whole objects into temporary files.
+
+The archive is written with data descriptors, since sizes are only known
+once a member has been written, so it cannot carry a `Content-Length`.
+"""
+import time
+import zipfile
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+from fs import errors
+
+from .compression import decoding_reader
+from .listing import normalize_prefix
+from .models import FSPackedFile
+from .packing import PACK_DIRECTORY, read_range
+
+# Members larger than this may need zip64 headers once written; it has to be
+# decided before writing, and compressed files on S3 may expand on the way.
+ZIP64_THRESHOLD = zipfile.ZIP64_LIMIT // 20
+
+
+# A file packed with others by `djpyfs.packing`, which does not show up in
+# listings, and where it is stored.
+PackedEntry = namedtuple('PackedEntry', ['name', 'size', 'mtime', 'pack', 'offset'])
+
+
+def namespace_entries(fs, namespace, prefix=''):
+    """
+    Yield every file in a namespace, including packed files but not the
+    packs holding them.
+
+    Arguments:
+        fs (obj): Patched filesystem of the namespace
+        namespace (str): Namespace of the filesystem
+        prefix (str): Only yield names starting with this string
+
+    Returns:
+        generator: `Entry` and `PackedEntry` tuples
+    """
+    prefix = normalize_prefix(prefix)
+    for entry in fs.iter_entries(prefix=prefix):
+        if not entry.name.startswith(f"{PACK_DIRECTORY}/"):
+            yield entry
+    if hasattr(fs, 'readpacked'):
+        packed = FSPackedFile.objects.filter(
+            module=namespace, filename__startswith=prefix
+        ).order_by('filename').values_list('filename', 'length', 'pack', 'offset')
+        for filename, length, pack, offset in packed.iterator(chunk_size=2000):
+            yield PackedEntry(filename, length, None, pack, offset)
+
+
+class _ZipBuffer:
+    """
+    Write-only, unseekable file collecting what `zipfile` writes until it is
+    handed on to the client.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """
+        Returns everything written since the last call.
+        """
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def open_stream(fs, name):
+    """
+    Open a file for streaming, as cheaply as the backend allows.
+    """
+    if hasattr(fs, '_path_to_key'):
+        try:
+            response = fs.client.get_object(
+                Bucket=fs._bucket_name,  # pylint: disable=protected-access
+                Key=fs._path_to_key(name),  # pylint: disable=protected-access
+            )
+        except ClientError:
+            # Possibly still staged on local disk in write-behind mode
+            return fs.openbin(name)
+        return decoding_reader(response['Body'], response.get('ContentEncoding'), name)
+    return fs.openbin(name)
+
+
+def _prefetch(fs, entry, head_size):
+    """
+    Open a member and read its first `head_size` bytes. Runs in a worker
+    thread, so must not use the database.
+
+    Returns:
+        tuple: The first bytes, and the open stream for the rest or None if
+            the whole file has been read; or None if the file is gone.
+    """
+    if isinstance(entry, PackedEntry):
+        try:
+            return read_range(fs, entry.pack, entry.offset, entry.size), None
+        except errors.ResourceNotFound:
+            return None
+    try:
+        stream = open_stream(fs, entry.name)
+    except errors.ResourceNotFound:
+        return None
+    try:
+        head = stream.read(head_size)
+        if len(head) < head_size:
+            stream.close()
+            return head, None
+    except BaseException:
+        stream.close()
+        raise
+    return head, stream
+
+
+def _zip_info(entry, compression):
+    """
+    Build the `ZipInfo` of a member.
+    """
+    mtime = entry.mtime if entry.mtime is not None else time.time()
+    date_time = max(time.localtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+    info = zipfile.ZipInfo(entry.name, date_time=date_time)
+    info.compress_type = compression
+    info.external_attr = 0o644 << 16
+    return info
+
+
+def zip_stream(fs, entries, prefetch=4,  # pylint: disable=too-many-positional-arguments
+               head_size=1024 * 1024, chunk_size=64 * 1024, compression=zipfile.ZIP_STORED):
+    """
+    Yield a zip archive of files in a filesystem, as it is built.
+
+    Files which disappear before they are read, e.g. because they expired,
+    are left out.
+
+    Arguments:
+        fs (obj): Patched filesystem to read from
+        entries (iterable): `djpyfs.listing.Entry` tuples of the files to
+            add, such as from `namespace_entries`; consumed lazily
+        prefetch (int): Number of files to open ahead of the current one
+        head_size (int): Bytes to read ahead from each prefetched file
+        chunk_size (int): Bytes to read at a time from larger files
+        compression (int): `zipfile.ZIP_STORED` or `zipfile.ZIP_DEFLATED`
+
+    Returns:
+        generator: Chunks of the archive, as bytes
+    """
+    buffer = _ZipBuffer()
+    executor = ThreadPoolExecutor(max_workers=max(prefetch, 1), thread_name_prefix='djpyfs-export')
+    pending = deque()
+    entries = iter(entries)
+
+    def flush():
+        data = buffer.drain()
+        if data:
+            yield data
+
+    def fill():
+        while len(pending) < max(prefetch, 1):
+            entry = next(entries, None)
+            if entry is None:
+                return
+            pending.append((entry, executor.submit(_prefetch, fs, entry, head_size)))
+
+    try:
+        with zipfile.ZipFile(buffer, 'w', compression=compression, allowZip64=True) as archive:
+            fill()
+            while pending:
+                entry, future = pending.popleft()
+                fill()
+                fetched = future.result()
+                if fetched is None:
+                    continue
+                head, stream = fetched
+                force_zip64 = stream is not None and (entry.size is None or entry.size > ZIP64_THRESHOLD)
+                try:
+                    with archive.open(_zip_info(entry, compression), 'w', force_zip64=force_zip64) as member:
+                        member.write(head)
+                        yield from flush()
+                        while stream is not None:
+                            chunk = stream.read(chunk_size)
+                            if not chunk:
+                                break
+                            member.write(chunk)
+                            yield from flush()
+                finally:
+                    if stream is not None:
+                        stream.close()
+                yield from flush()
+        yield from flush()
+    finally:
+        # The client may have gone away; don't leave files open behind us
+        for _, future in pending:
+            if not future.cancel() and future.exception() is None:
+                fetched = future.result()
+                if fetched is not None and fetched[1] is not None:
+                    fetched[1].close()
+        executor.shutdown(wait=False)
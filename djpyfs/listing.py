@@ -0,0 +1,129 @@
+"""
+Streaming, resumable listings of a namespace.
+
+`fs.iter_entries()` yields every file in a namespace, in key order, without
+building the full listing in memory. Names are relative to the namespace
+and use `/` separators on every backend, so a name can be handed back as
+`start_after` to resume a listing where it stopped.
+
+Prefixes and `start_after` are normalized relative to the namespace, so a
+listing never leaves it; `..` past the namespace root raises
+`fs.errors.IllegalBackReference` when the listing is requested.
+"""
+import os
+from collections import namedtuple
+
+from fs.path import normpath, relpath
+
+# One file in a listing. `mtime` is seconds since the epoch.
+Entry = namedtuple('Entry', ['name', 'size', 'mtime'])
+
+
+def normalize_prefix(prefix):
+    """
+    Returns `prefix` relative to the namespace root, keeping a trailing `/`
+    since "a/" and "a" match different names.
+
+    Raises:
+        fs.errors.IllegalBackReference: If `prefix` leads out of the
+            namespace
+    """
+    if not prefix:
+        return prefix
+    normalized = relpath(normpath(prefix))
+    if normalized and prefix.endswith('/'):
+        normalized += '/'
+    return normalized
+
+
+def iter_osfs_entries(self, prefix='', page_size=1000, start_after=None):  # pylint: disable=unused-argument
+    """
+    Patch method to yield the files of an OSFS namespace, in key order.
+
+    Directories are read with `os.scandir` one at a time, so memory use is
+    bounded by the largest directory rather than the whole namespace.
+
+    Arguments:
+        self (obj): OSFS instance that this function has been patched onto
+        prefix (str): Only yield names starting with this string
+        page_size (int): Ignored; for compatibility with S3
+        start_after (str): Only yield names after this one
+
+    Returns:
+        generator: `Entry` tuples
+    """
+    prefix = normalize_prefix(prefix)
+    start_after = normalize_prefix(start_after)
+    root = self.getsyspath('/')
+    # Start at the deepest directory which contains the whole prefix
+    directory = prefix[:prefix.rfind('/') + 1]
+    return _scan_directory(root, directory, prefix, start_after)
+
+
+def _scan_directory(root, directory, prefix, start_after):
+    """
+    Yield the files below `directory` (relative to `root`, ending in `/` or
+    empty) in key order.
+    """
+    try:
+        scanner = os.scandir(os.path.join(root, directory))
+    except (FileNotFoundError, NotADirectoryError):
+        return
+    with scanner:
+        # Sorting subdirectories as "name/" puts their contents in the
+        # same position as in a flat listing of keys.
+        children = sorted(
+            (entry.name + '/' if entry.is_dir(follow_symlinks=False) else entry.name, entry) for entry in scanner
+        )
+
+    for sort_name, entry in children:
+        name = directory + sort_name
+        if name.endswith('/'):
+            if not (name.startswith(prefix) or prefix.startswith(name)):
+                continue
+            if start_after is not None and name < start_after and not start_after.startswith(name):
+                continue
+            yield from _scan_directory(root, name, prefix, start_after)
+        elif name.startswith(prefix) and (start_after is None or name > start_after):
+            stat = entry.stat(follow_symlinks=False)
+            yield Entry(name, stat.st_size, stat.st_mtime)
+
+
+def iter_s3_entries(self, prefix='', page_size=1000, start_after=None):
+    """
+    Patch method to yield the files of an S3 namespace, in key order.
+
+    Pages through `list_objects_v2`, fetching `page_size` keys at a time.
+
+    Arguments:
+        self (obj): S3FS instance that this function has been patched onto
+        prefix (str): Only yield names starting with this string
+        page_size (int): Number of keys to request per page
+        start_after (str): Only yield names after this one
+
+    Returns:
+        generator: `Entry` tuples
+    """
+    prefix = normalize_prefix(prefix)
+    start_after = normalize_prefix(start_after)
+    base = self._prefix + '/' if self._prefix else ''  # pylint: disable=protected-access
+    params = {
+        'Bucket': self._bucket_name,  # pylint: disable=protected-access
+        'Prefix': base + prefix,
+        'PaginationConfig': {'PageSize': page_size},
+    }
+    if start_after:
+        params['StartAfter'] = base + start_after
+    return _iter_s3_pages(self, base, params)
+
+
+def _iter_s3_pages(self, base, params):
+    """
+    Yield the files in the pages of a `list_objects_v2` listing.
+    """
+    for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+        for obj in page.get('Contents', ()):
+            name = obj['Key'][len(base):]
+            # Skip directory markers
+            if name and not name.endswith('/'):
+                yield Entry(name, obj['Size'], obj['LastModified'].timestamp())
@@ -0,0 +1,319 @@
+"""
+Load testing against a local S3 stand-in.
+
+`run_load_test` points django-pyfs at an S3-compatible stand-in, slows down
+and fails its requests with a `FaultInjector` (see `djpyfs.resilience`), and
+drives a mix of operations from many threads, and optionally processes, for
+a while. It returns the throughput and latency percentiles of each kind of
+operation. The `djpyfs_loadtest` management command wraps it.
+
+The stand-in is one of:
+
+    server:     moto's `ThreadedMotoServer`, needing `moto[server]`; shared
+                by every process.
+    inprocess:  moto's in-process mock; needs no server, but only works with
+                one process.
+    endpoint:   Any other S3-compatible service, at `endpoint_url`.
+
+Expirations are written to the configured expiration backend, so run this
+against a disposable database. They are removed again at the end, as are
+the objects written to an `endpoint`. Since
+sweeps are not limited to one namespace, a mix with `sweep` refuses to run
+while the backend holds expired objects from elsewhere.
+"""
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import boto3
+from django.db import connections
+
+from . import djpyfs, resilience
+from .models import FSSweepCheckpoint
+
+# Operations and how often each is picked, relative to the others
+DEFAULT_MIX = {'write': 4, 'expire': 3, 'get_url': 8, 'read': 2, 'sweep': 1, 'get_filesystem': 1}
+
+LOADTEST_BUCKET = 'djpyfs-loadtest'
+
+
+def parse_mix(mix):
+    """
+    Parse a mix such as "write=4,get_url=8" into a dict.
+    """
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation: {name}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of sorted `values`.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+class _Worker:
+    """
+    One thread of the load test, and the latencies it has measured.
+    """
+
+    def __init__(self, namespace, mix, size, ttl, seed):  # pylint: disable=too-many-positional-arguments
+        self.namespace = namespace
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.payload = b'x' * size
+        self.ttl = ttl
+        self.random = random.Random(seed)
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.files = []
+        self.fs = None
+
+    def run(self, deadline, operations):
+        """
+        Run operations until the deadline, or until `operations` are done.
+        """
+        try:
+            self.fs = djpyfs.get_filesystem(self.namespace)
+            done = 0
+            while (deadline is None or time.monotonic() < deadline) and (operations is None or done < operations):
+                name = self.random.choices(self.operations, self.weights)[0]
+                start = time.perf_counter()
+                try:
+                    getattr(self, name)()
+                except Exception:  # pylint: disable=broad-except
+                    self.errors[name] += 1
+                else:
+                    self.latencies[name].append(time.perf_counter() - start)
+                done += 1
+        finally:
+            connections.close_all()
+
+    def pick(self):
+        if not self.files:
+            self.write()
+        return self.random.choice(self.files)
+
+    def write(self):
+        filename = f"{uuid.uuid4().hex}.bin"
+        self.fs.writebytes(filename, self.payload)
+        self.files.append(filename)
+
+    def expire(self):
+        self.fs.expire(self.pick(), self.random.randint(0, self.ttl))
+
+    def get_url(self):
+        self.fs.get_url(self.pick())
+
+    def read(self):
+        filename = self.pick()
+        if self.fs.exists(filename):
+            self.fs.readbytes(filename)
+
+    def sweep(self):
+        djpyfs.sweep_expired_objects(name=f'loadtest-{self.namespace}', max_rows=100)
+
+    def get_filesystem(self):
+        djpyfs.get_filesystem(self.namespace)
+
+
+def _run_threads(namespace, options, seed):
+    """
+    Run the worker threads of one process.
+
+    Returns:
+        tuple: Latencies and error counts by operation
+    """
+    deadline = time.monotonic() + options['duration'] if options['duration'] else None
+    workers = [
+        _Worker(namespace, options['mix'], options['size'], options['ttl'], seed * 1000 + i)
+        for i in range(options['threads'])
+    ]
+    threads = [
+        threading.Thread(target=worker.run, args=(deadline, options['operations']), name=f'djpyfs-loadtest-{i}')
+        for i, worker in enumerate(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    for worker in workers:
+        for name, values in worker.latencies.items():
+            latencies[name].extend(values)
+        for name, count in worker.errors.items():
+            errors[name] += count
+    return dict(latencies), dict(errors)
+
+
+def _free_port():
+    """
+    Returns a local TCP port which is currently free.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_stand_in(stand_in, endpoint_url):
+    """
+    Start the S3 stand-in.
+
+    Returns:
+        tuple: The endpoint URL to use, and a function stopping the stand-in
+    """
+    if stand_in == 'server':
+        from moto.server import \
+            ThreadedMotoServer  # pylint: disable=import-outside-toplevel
+        port = _free_port()
+        server = ThreadedMotoServer(ip_address='127.0.0.1', port=port, verbose=False)
+        server.start()
+        return f"http://127.0.0.1:{port}", server.stop
+    if stand_in == 'inprocess':
+        from moto import mock_s3  # pylint: disable=import-outside-toplevel
+        mock = mock_s3()
+        mock.start()
+        return None, mock.stop
+    if stand_in != 'endpoint':
+        raise ValueError(f"Bad stand-in: {stand_in}")
+    return endpoint_url, lambda: None
+
+
+def _remove_objects(client, prefix):
+    """
+    Delete every object under `prefix` in the load test bucket.
+    """
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=LOADTEST_BUCKET, Prefix=prefix):
+        keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+        if keys:
+            client.delete_objects(Bucket=LOADTEST_BUCKET, Delete={'Objects': keys, 'Quiet': True})
+
+
+def _run_process(namespace, options, seed, results):
+    resilience.reset()
+    results.put(_run_threads(namespace, options, seed))
+
+
+def run_load_test(threads=8, processes=1, duration=10,  # pylint: disable=too-many-positional-arguments
+                  operations=None, mix=None, size=1024, ttl=5, stand_in='server', endpoint_url=None,
+                  latency=0.0, jitter=0.0, error_rate=0.0, fault='throttle', seed=0):
+    """
+    Run a load test. See the module documentation.
+
+    Arguments:
+        threads (int): Worker threads per process
+        processes (int): Worker processes
+        duration (float): Seconds to run for, or None to run `operations`
+        operations (int): (optional) Operations per thread
+        mix (dict): Relative weights of the operations; see `DEFAULT_MIX`
+        size (int): Size of written files, in bytes
+        ttl (int): Expirations are set up to this many seconds ahead
+        stand_in (str): "server", "inprocess" or "endpoint"
+        endpoint_url (str): URL of the S3 service, with `stand_in="endpoint"`
+        latency (float): Seconds added to every S3 request
+        jitter (float): Up to this many more seconds added at random
+        error_rate (float): Fraction of S3 requests which fail
+        fault (str): How requests fail; see `djpyfs.resilience.FaultInjector`
+        seed (int): Seed for the random choices
+
+    Returns:
+        dict: `elapsed` seconds, `throughput` in operations per second, and
+            `operations`, a dict giving for each operation its `count`,
+            `errors`, and `p50`, `p95`, `p99` and `max` latency in seconds
+    """
+    if processes > 1 and stand_in == 'inprocess':
+        raise ValueError("The in-process stand-in only works with one process")
+    if 'sweep' in (mix or DEFAULT_MIX) and djpyfs.get_expiration_backend().expired(limit=1):
+        raise ValueError("Sweeps would remove expired objects of other namespaces; use a disposable database")
+    options = {
+        'threads': threads, 'duration': duration, 'operations': operations,
+        'mix': mix or DEFAULT_MIX, 'size': size, 'ttl': ttl,
+    }
+    namespace = f"loadtest-{uuid.uuid4().hex[:8]}"
+
+    endpoint_url, stop_stand_in = _start_stand_in(stand_in, endpoint_url)
+    orig_settings = djpyfs.DJFS_SETTINGS
+    djpyfs.DJFS_SETTINGS = dict(
+        orig_settings, type='s3fs', bucket=LOADTEST_BUCKET, endpoint_url=endpoint_url,
+        aws_access_key_id=orig_settings.get('aws_access_key_id', 'loadtest'),
+        aws_secret_access_key=orig_settings.get('aws_secret_access_key', 'loadtest'),
+        resilience=dict(orig_settings.get('resilience', {}), fault_injection={
+            'latency': latency, 'jitter': jitter, 'error_rate': error_rate, 'fault': fault, 'seed': seed,
+        }),
+    )
+    djpyfs.S3CONN = None
+    resilience.reset()
+    client = boto3.client(
+        's3', endpoint_url=endpoint_url, region_name=orig_settings.get('region') or 'us-east-1',
+        aws_access_key_id=djpyfs.DJFS_SETTINGS['aws_access_key_id'],
+        aws_secret_access_key=djpyfs.DJFS_SETTINGS['aws_secret_access_key'],
+    )
+    try:
+        client.create_bucket(Bucket=LOADTEST_BUCKET)
+
+        start = time.monotonic()
+        if processes == 1:
+            latencies, errors = _run_threads(namespace, options, seed)
+        else:
+            latencies, errors = defaultdict(list), defaultdict(int)
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            # Children must open their own database connections
+            connections.close_all()
+            children = [
+                context.Process(target=_run_process, args=(namespace, options, seed + i, results))
+                for i in range(processes)
+            ]
+            for child in children:
+                child.start()
+            for _ in children:
+                child_latencies, child_errors = results.get()
+                for name, values in child_latencies.items():
+                    latencies[name].extend(values)
+                for name, count in child_errors.items():
+                    errors[name] += count
+            for child in children:
+                child.join()
+        elapsed = time.monotonic() - start
+    finally:
+        backend = djpyfs.get_expiration_backend()
+        backend.remove_many(list(backend.iter_filenames(namespace)))
+        FSSweepCheckpoint.objects.filter(name=f'loadtest-{namespace}').delete()
+        if stand_in == 'endpoint':
+            # The stand-ins are thrown away; a real service keeps the objects
+            _remove_objects(client, os.path.join(orig_settings.get('prefix', ''), namespace).strip('/') + '/')
+        djpyfs.DJFS_SETTINGS = orig_settings
+        djpyfs.S3CONN = None
+        resilience.reset()
+        stop_stand_in()
+
+    report = {'elapsed': elapsed, 'operations': {}}
+    total = 0
+    for name in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies.get(name, []))
+        total += len(values) + errors.get(name, 0)
+        report['operations'][name] = {
+            'count': len(values),
+            'errors': errors.get(name, 0),
+            'p50': percentile(values, 0.50),
+            'p95': percentile(values, 0.95),
+            'p99': percentile(values, 0.99),
+            'max': values[-1] if values else None,
+        }
+    report['throughput'] = total / elapsed if elapsed else 0.0
+    return report
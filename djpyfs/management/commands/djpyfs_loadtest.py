@@ -0,0 +1,62 @@
+"""
+Management command to load test django-pyfs against a local S3 stand-in.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from djpyfs.loadtest import DEFAULT_MIX, parse_mix, run_load_test
+
+
+class Command(BaseCommand):
+    """
+    Drive a mix of django-pyfs operations against a local S3 stand-in with
+    injected latency and errors, and report throughput and tail latency.
+
+    Writes expirations to the configured database; run it against a
+    disposable one.
+    """
+    help = "Load test django-pyfs against a local S3 stand-in."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Worker threads per process.")
+        parser.add_argument('--processes', type=int, default=1, help="Worker processes.")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds to run for.")
+        parser.add_argument('--operations', type=int, default=None,
+                            help="Operations per thread; runs until done instead of for --duration.")
+        parser.add_argument('--mix', default=','.join(f"{name}={weight}" for name, weight in DEFAULT_MIX.items()),
+                            help="Relative weights of the operations, e.g. write=4,get_url=8.")
+        parser.add_argument('--size', type=int, default=1024, help="Size of written files, in bytes.")
+        parser.add_argument('--ttl', type=int, default=5, help="Expirations are up to this many seconds ahead.")
+        parser.add_argument('--stand-in', choices=['server', 'inprocess', 'endpoint'], default='server',
+                            help="moto server, in-process moto mock, or the S3 service at --endpoint-url.")
+        parser.add_argument('--endpoint-url', default=None, help="URL of the S3 service, with --stand-in endpoint.")
+        parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every S3 request.")
+        parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many more seconds, at random.")
+        parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of S3 requests which fail.")
+        parser.add_argument('--fault', choices=['throttle', 'error', 'timeout'], default='throttle',
+                            help="How injected failures fail.")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the random choices.")
+
+    def handle(self, *args, **options):
+        try:
+            report = run_load_test(
+                threads=options['threads'], processes=options['processes'],
+                duration=None if options['operations'] else options['duration'],
+                operations=options['operations'], mix=parse_mix(options['mix']), size=options['size'],
+                ttl=options['ttl'], stand_in=options['stand_in'], endpoint_url=options['endpoint_url'],
+                latency=options['latency'], jitter=options['jitter'], error_rate=options['error_rate'],
+                fault=options['fault'], seed=options['seed'],
+            )
+        except (ImportError, ValueError) as e:
+            raise CommandError(str(e)) from e
+
+        def ms(seconds):
+            return '-' if seconds is None else f"{seconds * 1000:.1f}"
+
+        self.stdout.write(f"{'operation':<16}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'max ms':>10}")
+        for name, stats in report['operations'].items():
+            self.stdout.write(
+                f"{name:<16}{stats['count']:>8}{stats['errors']:>8}{ms(stats['p50']):>10}{ms(stats['p95']):>10}"
+                f"{ms(stats['p99']):>10}{ms(stats['max']):>10}"
+            )
+        self.stdout.write(f"{report['throughput']:.1f} operations/second over {report['elapsed']:.1f} seconds")
@@ -0,0 +1,46 @@
+"""
+Management command to find and clean up orphaned files and expirations.
+"""
+from django.core.management.base import BaseCommand
+
+from djpyfs import djpyfs
+
+
+class Command(BaseCommand):
+    """
+    Reconcile the expirations of namespaces against the files they hold.
+
+    By default orphans are only reported; pass `--untracked` and `--missing`
+    to clean them up.
+    """
+    help = "Find django-pyfs files without expirations, and expirations without files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('namespaces', nargs='+', help="Namespaces to reconcile.")
+        parser.add_argument(
+            '--untracked', choices=['report', 'expire', 'delete'], default='report',
+            help="What to do with files which have no expiration."
+        )
+        parser.add_argument(
+            '--missing', choices=['report', 'delete'], default='report',
+            help="What to do with expirations whose file does not exist."
+        )
+        parser.add_argument(
+            '--untracked-ttl', type=int, default=24 * 60 * 60,
+            help="Seconds until untracked files expire, with --untracked=expire."
+        )
+        parser.add_argument(
+            '--grace', type=int, default=60 * 60,
+            help="Ignore files modified less than this many seconds ago."
+        )
+
+    def handle(self, *args, **options):
+        for namespace in options['namespaces']:
+            result = djpyfs.reconcile_orphans(
+                namespace, untracked=options['untracked'], missing=options['missing'],
+                untracked_ttl=options['untracked_ttl'], grace=options['grace'],
+            )
+            self.stdout.write(
+                f"{namespace}: {result.files} files, {result.tracked} tracked, "
+                f"{result.untracked} untracked, {result.missing} missing"
+            )
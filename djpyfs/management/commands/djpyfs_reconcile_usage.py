@@ -0,0 +1,29 @@
+"""
+Management command to recompute namespace usage totals.
+"""
+from django.core.management.base import BaseCommand
+
+from djpyfs import djpyfs
+from djpyfs.models import FSNamespaceUsage
+from djpyfs.usage import reconcile_usage
+
+
+class Command(BaseCommand):
+    """
+    Reset the usage totals of namespaces to what is actually stored.
+
+    Incremental accounting only sees writes made through django-pyfs, so this
+    should be run periodically to correct any drift.
+    """
+    help = "Recompute django-pyfs namespace usage totals by walking the filesystem."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'namespaces', nargs='*', help="Namespaces to reconcile. Defaults to all namespaces with usage totals."
+        )
+
+    def handle(self, *args, **options):
+        namespaces = options['namespaces'] or FSNamespaceUsage.objects.values_list('module', flat=True)
+        for namespace in namespaces:
+            size, files = reconcile_usage(djpyfs.get_filesystem(namespace), namespace)
+            self.stdout.write(f"{namespace}: {size} bytes in {files} files")
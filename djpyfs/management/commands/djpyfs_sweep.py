@@ -0,0 +1,30 @@
+"""
+Management command to run a bounded, resumable expiration sweep.
+"""
+from django.core.management.base import BaseCommand
+
+from djpyfs import djpyfs
+
+
+class Command(BaseCommand):
+    """
+    Remove expired djpyfs objects, resuming from the last checkpoint.
+
+    Intended to be run frequently (e.g. every few minutes from cron) with a
+    small budget, rather than as one large nightly job.
+    """
+    help = "Remove expired django-pyfs objects in a bounded, resumable pass."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', default='default', help="Name of the sweep checkpoint and lock.")
+        parser.add_argument('--max-rows', type=int, default=None, help="Maximum number of expirations to process.")
+        parser.add_argument('--max-seconds', type=int, default=None, help="Stop after this many seconds.")
+
+    def handle(self, *args, **options):
+        processed = djpyfs.sweep_expired_objects(
+            name=options['name'], max_rows=options['max_rows'], max_seconds=options['max_seconds']
+        )
+        if processed is None:
+            self.stdout.write("Another sweep is already running; nothing done.")
+        else:
+            self.stdout.write(f"Processed {processed} expired objects.")
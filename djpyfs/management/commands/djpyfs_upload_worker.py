@@ -0,0 +1,36 @@
+"""
+Management command to upload files queued by write-behind S3 namespaces.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from djpyfs import djpyfs
+
+
+class Command(BaseCommand):
+    """
+    Upload files which were written locally in write-behind mode to S3.
+
+    By default this runs forever, polling the queue; with `--once` it drains
+    the queue and exits. Uploads which fail are retried later, and given up
+    on after `max_attempts`; see `djpyfs.write_behind`.
+    """
+    help = "Upload django-pyfs files queued in write-behind mode."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit.")
+        parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when the queue is empty.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of files to attempt per pass.")
+
+    def handle(self, *args, **options):
+        while True:
+            uploaded = djpyfs.upload_write_behind(limit=options['batch_size'])
+            if uploaded:
+                self.stdout.write(f"Uploaded {uploaded} files.")
+            elif options['once']:
+                return
+            else:
+                close_old_connections()
+                time.sleep(options['interval'])
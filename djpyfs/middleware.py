@@ -0,0 +1,38 @@
+"""
+Django middleware for django-pyfs.
+"""
+from . import djpyfs
+from .packing import batch_packing
+
+
+class DeferredExpirationMiddleware:
+    """
+    Collects the `expire` calls made while handling a request and writes them
+    in one bulk upsert once the view has returned, instead of one query per
+    call in the middle of the view. See `djpyfs.defer_expirations`.
+
+    With `ATOMIC_REQUESTS`, the request transaction has committed by the time
+    this runs, so the expirations are written straight away.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with djpyfs.defer_expirations():
+            return self.get_response(request)
+
+
+class BatchPackingMiddleware:
+    """
+    Buffers the small files written with `writepacked` while handling a
+    request, and writes them out as packs once the view has returned. See
+    `djpyfs.packing.batch_packing`.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with batch_packing():
+            return self.get_response(request)
@@ -3,7 +3,8 @@ Database models for django-pyfs
 """
 import os
 
-from django.db import models
+from django.db import connection, models
+from django.db.models import F
 from django.utils import timezone
 
 
@@ -55,6 +56,37 @@ class FSExpirations(models.Model):
         f.expiration = expiration_time
         f.save()
 
+    @classmethod
+    def create_expirations(cls, entries):
+        """
+        Create or update many expirations at once.
+
+        Uses a single bulk upsert where the database supports it.
+
+        Arguments:
+            cls (classtype): Class this method is attached to
+            entries (list): `(module, filename, expiration, expires)` tuples,
+                where `expiration` is an absolute datetime
+        """
+        objects = [
+            cls(module=module, filename=filename, expiration=expiration, expires=expires)
+            for module, filename, expiration, expires in entries
+        ]
+        features = connection.features
+        if not features.supports_update_conflicts:
+            for f in objects:
+                cls.objects.update_or_create(
+                    module=f.module, filename=f.filename,
+                    defaults={'expiration': f.expiration, 'expires': f.expires}
+                )
+            return
+        cls.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=['module', 'filename'] if features.supports_update_conflicts_with_target else None,
+            update_fields=['expires', 'expiration'],
+        )
+
     @classmethod
     def expired(cls):
         """
@@ -79,3 +111,255 @@ class FSExpirations(models.Model):
             return f"{os.path.join(self.module, self.filename)} Expires {str(self.expiration)}"
         else:
             return f"{os.path.join(self.module, self.filename)} Permanent ({str(self.expiration)})"
+
+
+class FSSweepCheckpoint(models.Model):
+    """
+    Progress and lock for resumable expiration sweeps.
+
+    A sweep walks expired files in `(expiration, key)` order, where `key` is
+    the tie breaker of the expiration backend (the row id for
+    `FSExpirations`). After each batch it records the last file it processed
+    here, so a sweep
+    which is killed or runs out of budget resumes where it stopped instead of
+    starting over. The `lock_owner` / `locked_until` pair is a lease which
+    keeps two hosts from sweeping at the same time. Recording progress
+    renews it, so a long sweep keeps the lock as long as each batch takes
+    less than the lease; a lease which is not released (e.g. the process was
+    killed) simply lapses.
+    """
+    name = models.CharField(max_length=100, unique=True)  # Which sweep this is
+    last_expiration = models.DateTimeField(null=True, blank=True)  # Cursor: expiration of last processed row
+    last_key = models.TextField(null=True, blank=True)  # Cursor: key of last processed row, which may be long
+    lock_owner = models.CharField(max_length=64, blank=True, default='')  # Token of the sweeper holding the lock
+    locked_until = models.DateTimeField(null=True, blank=True)  # When the lock lapses
+
+    timeout = None  # Seconds the lock lasts, set by acquire()
+
+    @classmethod
+    def acquire(cls, name, owner, timeout):
+        """
+        Try to take the lock for a sweep.
+
+        The lock is taken with a single conditional UPDATE, so it is safe
+        across processes and hosts sharing the database.
+
+        Arguments:
+            name (str): Name of the sweep
+            owner (str): Unique token identifying this sweeper
+            timeout (int): Number of seconds before the lock lapses
+
+        Returns:
+            FSSweepCheckpoint: The locked checkpoint, or None if another
+                sweeper holds the lock.
+        """
+        now = timezone.now()
+        cls.objects.get_or_create(name=name)
+        acquired = cls.objects.filter(
+            models.Q(locked_until__isnull=True) | models.Q(locked_until__lt=now),
+            name=name,
+        ).update(lock_owner=owner, locked_until=now + timezone.timedelta(seconds=timeout))
+        if not acquired:
+            return None
+        checkpoint = cls.objects.get(name=name)
+        checkpoint.timeout = timeout
+        return checkpoint
+
+    def record(self, last_expiration, last_key):
+        """
+        Save the sweep cursor, as long as we still hold the lock.
+
+        Passing `None` for both values resets the cursor so the next sweep
+        starts from the beginning. The lock is renewed for the `timeout` it
+        was acquired with.
+
+        Returns:
+            bool: Whether we still held the lock; if not, another sweeper
+                has taken it over and this one should stop.
+        """
+        self.last_expiration = last_expiration
+        self.last_key = last_key
+        self.locked_until = timezone.now() + timezone.timedelta(seconds=self.timeout)
+        return bool(type(self).objects.filter(pk=self.pk, lock_owner=self.lock_owner).update(
+            last_expiration=last_expiration, last_key=last_key, locked_until=self.locked_until
+        ))
+
+    def release(self):
+        """
+        Release the lock, if we still hold it.
+        """
+        type(self).objects.filter(pk=self.pk, lock_owner=self.lock_owner).update(
+            lock_owner='', locked_until=None
+        )
+
+    class Meta:
+        app_label = 'djpyfs'
+
+    def __str__(self):
+        return f"Sweep {self.name} at ({self.last_expiration}, {self.last_key})"
+
+
+class FSNamespaceUsage(models.Model):
+    """
+    Running totals of the bytes and files stored in each namespace.
+
+    These are kept up to date incrementally by filesystems with usage
+    accounting enabled (see `djpyfs.usage`), and periodically reset to the
+    true values by walking the filesystem, since writes made outside of
+    django-pyfs are not seen.
+    """
+    module = models.CharField(max_length=382, unique=True)  # Defines the namespace
+    bytes = models.BigIntegerField(default=0)  # Total size of files
+    files = models.BigIntegerField(default=0)  # Number of files
+    reconciled = models.DateTimeField(null=True, blank=True)  # When totals were last recomputed
+
+    @classmethod
+    def adjust(cls, module, size, files=0):
+        """
+        Atomically add to the totals of a namespace.
+
+        Arguments:
+            module (str): Namespace of the filesystem
+            size (int): Change in bytes, may be negative
+            files (int): Change in number of files, may be negative
+        """
+        if not cls.objects.filter(module=module).update(bytes=F('bytes') + size, files=F('files') + files):
+            cls.objects.get_or_create(module=module)
+            cls.objects.filter(module=module).update(bytes=F('bytes') + size, files=F('files') + files)
+
+    @classmethod
+    def get_usage(cls, module):
+        """
+        Returns the `(bytes, files)` totals of a namespace.
+        """
+        usage = cls.objects.filter(module=module).values_list('bytes', 'files').first()
+        return usage or (0, 0)
+
+    class Meta:
+        app_label = 'djpyfs'
+
+    def __str__(self):
+        return f"{self.module}: {self.bytes} bytes in {self.files} files"
+
+
+class FSPendingUpload(models.Model):
+    """
+    Durable queue of files written locally which still have to be uploaded
+    to S3, for namespaces in write-behind mode (see `djpyfs.write_behind`).
+
+    Rewriting a file which is already queued bumps `created`, which tells a
+    worker uploading the older contents not to dequeue it, and starts its
+    attempts afresh. Failed uploads are retried from `next_attempt` on;
+    uploads which can't succeed are kept as dead letters for inspection.
+    """
+    module = models.CharField(max_length=382)  # Defines the namespace
+    filename = models.CharField(max_length=382)  # Filename within namespace
+    created = models.DateTimeField(db_index=True)  # When the file was (last) written
+    attempts = models.IntegerField(default=0)  # Number of upload attempts
+    claimed_until = models.DateTimeField(null=True, blank=True)  # Lease of the worker uploading it
+    last_error = models.TextField(blank=True, default='')  # Error from the last failed attempt
+    next_attempt = models.DateTimeField(null=True, blank=True, db_index=True)  # Not retried before this
+    dead_letter = models.BooleanField(default=False, db_index=True)  # Given up on; see `last_error`
+
+    @classmethod
+    def enqueue(cls, module, filename):
+        """
+        Queue a file for upload, or mark an already queued file as rewritten.
+        """
+        cls.objects.update_or_create(module=module, filename=filename, defaults={
+            'created': timezone.now(), 'attempts': 0, 'next_attempt': None, 'dead_letter': False, 'last_error': '',
+        })
+
+    def claim(self, timeout):
+        """
+        Try to take this upload, so no other worker does it at the same time.
+
+        Arguments:
+            timeout (int): Number of seconds before the claim lapses
+
+        Returns:
+            bool: True if the upload is ours
+        """
+        now = timezone.now()
+        self.claimed_until = now + timezone.timedelta(seconds=timeout)
+        claimed = bool(type(self).objects.filter(
+            models.Q(claimed_until__isnull=True) | models.Q(claimed_until__lt=now),
+            pk=self.pk,
+        ).update(claimed_until=self.claimed_until, attempts=F('attempts') + 1))
+        if claimed:
+            self.attempts += 1
+        return claimed
+
+    def record_failure(self, error, retry_in=None):
+        """
+        Release a failed upload, to be retried after `retry_in` seconds, or
+        with `retry_in=None` never again. Does nothing if the file has been
+        rewritten since it was claimed.
+        """
+        type(self).objects.filter(pk=self.pk, created=self.created).update(
+            claimed_until=None,
+            last_error=str(error),
+            next_attempt=None if retry_in is None else timezone.now() + timezone.timedelta(seconds=retry_in),
+            dead_letter=retry_in is None,
+        )
+
+    class Meta:
+        app_label = 'djpyfs'
+        unique_together = (("module", "filename"),)
+
+    def __str__(self):
+        return f"{os.path.join(self.module, self.filename)} pending since {str(self.created)}"
+
+
+class FSPackedFile(models.Model):
+    """
+    Index of small files packed into larger pack objects (see
+    `djpyfs.packing`).
+
+    Each row says where in which pack the contents of a file are. Removing a
+    row leaves its bytes in the pack as dead space, which is reclaimed when
+    the pack is compacted.
+    """
+    module = models.CharField(max_length=382)  # Defines the namespace
+    filename = models.CharField(max_length=382)  # Filename within namespace
+    pack = models.CharField(max_length=382, db_index=True)  # Path of the pack within the namespace
+    offset = models.BigIntegerField()  # Start of the file within the pack
+    length = models.BigIntegerField()  # Size of the file
+
+    @classmethod
+    def add_pack(cls, module, pack, entries):
+        """
+        Index the files of a newly written pack, replacing any earlier
+        packed versions of them.
+
+        Arguments:
+            cls (classtype): Class this method is attached to
+            module (str): Namespace of the filesystem
+            pack (str): Path of the pack within the namespace
+            entries (list): `(filename, offset, length)` tuples
+        """
+        objects = [
+            cls(module=module, filename=filename, pack=pack, offset=offset, length=length)
+            for filename, offset, length in entries
+        ]
+        features = connection.features
+        if not features.supports_update_conflicts:
+            for f in objects:
+                cls.objects.update_or_create(
+                    module=module, filename=f.filename,
+                    defaults={'pack': pack, 'offset': f.offset, 'length': f.length}
+                )
+            return
+        cls.objects.bulk_create(
+            objects,
+            update_conflicts=True,
+            unique_fields=['module', 'filename'] if features.supports_update_conflicts_with_target else None,
+            update_fields=['pack', 'offset', 'length'],
+        )
+
+    class Meta:
+        app_label = 'djpyfs'
+        unique_together = (("module", "filename"),)
+
+    def __str__(self):
+        return f"{os.path.join(self.module, self.filename)} in {self.pack} at {self.offset}+{self.length}"
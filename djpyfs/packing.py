@@ -0,0 +1,314 @@
+"""
+Packing of small files into larger pack objects.
+
+Namespaces holding huge numbers of tiny files pay per-object costs for each
+of them, such as one S3 PUT per file. With `packing` set in `DJFS`, the
+patched filesystem gains `writepacked`, which buffers small files and writes
+them out together as one pack object under `.packs/`, with an index of
+offsets in `FSPackedFile`:
+
+    DJFS = {...,
+            'packing': {'max_file_size': 64 * 1024,
+                        'pack_size': 4 * 1024 * 1024,
+                        'min_live_ratio': 0.5,
+                        'compact_grace': 60 * 60}}
+
+Outside of a `batch_packing()` block, `writepacked` writes each file as a
+pack of its own straight away. Inside one, small files are buffered and
+written out together when the buffer of their namespace reaches
+`pack_size`, on `fs.flushpacks()`, and when the block exits:
+
+    with djpyfs.batch_packing():
+        for name, data in thumbnails:
+            fs.writepacked(name, data)
+
+Buffered files are only visible to `readpacked`, `exists` and `remove`
+within the block, and are lost if the process dies before it exits, so keep
+blocks short, e.g. one request (see `BatchPackingMiddleware`).
+
+`readpacked` reads a file back with a byte-range GET on S3, or through
+`mmap` on local disk. `exists` and `remove` know about packed files, so
+`expire` and the expiration sweeps work on them as usual; removing a packed
+file only drops its index entry, and `compactpacks` later rewrites packs
+which are mostly dead space. Sweeps compact the namespaces they touch.
+A pack is written before its index entries, so packs younger than
+`compact_grace` seconds are left alone while their writer indexes them.
+"""
+import contextlib
+import contextvars
+import io
+import mmap
+import types
+import uuid
+
+from botocore.exceptions import ClientError
+from django.utils import timezone
+from fs import errors
+from fs.path import normpath, relpath
+
+from .models import FSPackedFile
+
+# Directory within the namespace holding pack objects
+PACK_DIRECTORY = '.packs'
+
+# The `PackBuffer` collecting small files in the current block, if any. See
+# `batch_packing`.
+_PACK_BUFFER = contextvars.ContextVar('djpyfs_pack_buffer', default=None)
+
+
+class PackBuffer:
+    """
+    Small files written with `writepacked` in a `batch_packing` block, by
+    namespace.
+    """
+
+    def __init__(self):
+        self.namespaces = {}  # namespace -> (write_pack, {filename: bytes})
+
+    def files(self, namespace):
+        """
+        Returns the buffered files of a namespace, by name, in the order
+        written.
+        """
+        return self.namespaces.get(namespace, (None, {}))[1]
+
+    def add(self, namespace, write_pack, filename, contents):
+        """
+        Buffer a file. `write_pack` writes a dict of files of the namespace
+        as a pack.
+
+        Returns:
+            int: Bytes buffered for the namespace
+        """
+        files = self.namespaces.setdefault(namespace, (write_pack, {}))[1]
+        files.pop(filename, None)
+        files[filename] = contents
+        return sum(len(data) for data in files.values())
+
+    def take(self, namespace):
+        """
+        Remove and return the buffered files of a namespace.
+        """
+        return self.namespaces.pop(namespace, (None, {}))[1]
+
+    def flush(self):
+        """
+        Write out the buffered files of every namespace.
+        """
+        while self.namespaces:
+            _, (write_pack, files) = self.namespaces.popitem()
+            if files:
+                write_pack(files)
+
+
+@contextlib.contextmanager
+def batch_packing():
+    """
+    Context manager which buffers the small files written with `writepacked`
+    in its block, and writes them out as packs as it exits, whether or not
+    the block raised. Nested blocks join the outermost one.
+
+    Yields:
+        PackBuffer: The buffer collecting the files
+    """
+    buffer = _PACK_BUFFER.get()
+    if buffer is not None:
+        yield buffer
+        return
+
+    buffer = PackBuffer()
+    token = _PACK_BUFFER.set(buffer)
+    try:
+        yield buffer
+    finally:
+        _PACK_BUFFER.reset(token)
+        buffer.flush()
+
+
+def read_range(fs, path, offset, length):
+    """
+    Read `length` bytes at `offset` of a file, as cheaply as the backend
+    allows.
+    """
+    if length == 0:
+        return b''
+    if hasattr(fs, '_path_to_key'):
+        # S3: fetch just the range we need
+        try:
+            response = fs.client.get_object(
+                Bucket=fs._bucket_name,  # pylint: disable=protected-access
+                Key=fs._path_to_key(path),  # pylint: disable=protected-access
+                Range=f"bytes={offset}-{offset + length - 1}",
+            )
+            return response['Body'].read()
+        except ClientError:
+            # Possibly still staged on local disk in write-behind mode
+            pass
+    try:
+        sys_path = fs.getsyspath(path)
+    except errors.NoSysPath:
+        with fs.openbin(path) as f:
+            f.seek(offset)
+            return f.read(length)
+    with open(sys_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return m[offset:offset + length]
+
+
+def patch_packing(fs, namespace, config):  # pylint: disable=too-many-statements
+    """
+    Patch a filesystem instance to pack small files.
+
+    Arguments:
+        fs (obj): The pyfilesystem subclass instance to be patched.
+        namespace (str): Namespace of the filesystem
+        config (dict): `max_file_size`, the largest file to pack (larger
+            files are written normally), `pack_size`, the size at which a
+            pack is written out, and `min_live_ratio`, below which
+            `compactpacks` rewrites a pack, and `compact_grace`, the age in
+            seconds a pack must reach before it is compacted.
+    Returns:
+        obj: Patched filesystem instance
+    """
+    max_file_size = config.get('max_file_size', 64 * 1024)
+    pack_size = config.get('pack_size', 4 * 1024 * 1024)
+    min_live_ratio = config.get('min_live_ratio', 0.5)
+    compact_grace = config.get('compact_grace', 60 * 60)
+
+    exists = fs.exists
+    remove = fs.remove
+
+    def packed_name(path):
+        return relpath(normpath(path))
+
+    def write_pack_object(files):
+        """
+        Write `files`, a dict of filename to contents, into a new pack.
+
+        Returns:
+            tuple: Path of the pack, and its `(filename, offset, length)`
+                entries
+        """
+        buffer = io.BytesIO()
+        entries = []
+        for filename, contents in files.items():
+            entries.append((filename, buffer.tell(), len(contents)))
+            buffer.write(contents)
+        pack = f"{PACK_DIRECTORY}/{uuid.uuid4().hex}.pack"
+        fs.makedir(PACK_DIRECTORY, recreate=True)
+        fs.writebytes(pack, buffer.getvalue())
+        return pack, entries
+
+    def write_pack(files):
+        pack, entries = write_pack_object(files)
+        FSPackedFile.add_pack(namespace, pack, entries)
+
+    def buffered(name):
+        buffer = _PACK_BUFFER.get()
+        return buffer is not None and name in buffer.files(namespace)
+
+    def writepacked(self, path, contents):
+        """
+        Write a file, packing it with others if it is small enough and this
+        is inside a `batch_packing` block.
+
+        Arguments:
+            path (str): Name of file
+            contents (bytes): Data to be written
+        """
+        if len(contents) > max_file_size:
+            self.writebytes(path, contents)
+            return
+        name = packed_name(path)
+        buffer = _PACK_BUFFER.get()
+        if buffer is None:
+            write_pack({name: bytes(contents)})
+        elif buffer.add(namespace, write_pack, name, bytes(contents)) >= pack_size:
+            self.flushpacks()
+
+    def flushpacks(self):  # pylint: disable=unused-argument
+        """
+        Write out the small files buffered for this namespace in the current
+        `batch_packing` block as a pack.
+
+        Returns:
+            int: Number of files written
+        """
+        buffer = _PACK_BUFFER.get()
+        files = buffer.take(namespace) if buffer is not None else {}
+        if files:
+            write_pack(files)
+        return len(files)
+
+    def readpacked(self, path):
+        """
+        Read a file written with `writepacked`, whether or not it ended up
+        in a pack.
+
+        Returns:
+            bytes: Contents of the file
+        """
+        name = packed_name(path)
+        if buffered(name):
+            return _PACK_BUFFER.get().files(namespace)[name]
+        entry = FSPackedFile.objects.filter(module=namespace, filename=name).first()
+        if entry is None:
+            return self.readbytes(path)
+        return read_range(self, entry.pack, entry.offset, entry.length)
+
+    def packing_exists(self, path):  # pylint: disable=unused-argument
+        name = packed_name(path)
+        return (
+            buffered(name) or exists(path) or FSPackedFile.objects.filter(module=namespace, filename=name).exists()
+        )
+
+    def packing_remove(self, path):  # pylint: disable=unused-argument
+        name = packed_name(path)
+        was_buffered = buffered(name)
+        if was_buffered:
+            del _PACK_BUFFER.get().files(namespace)[name]
+        unpacked = FSPackedFile.objects.filter(module=namespace, filename=name).delete()[0]
+        if not (was_buffered or unpacked):
+            remove(path)
+
+    def compactpacks(self):
+        """
+        Delete packs with no live files, and rewrite packs whose live files
+        take up less than `min_live_ratio` of them. Packs written less than
+        `compact_grace` seconds ago may not be indexed yet, so are skipped.
+
+        Returns:
+            int: Number of packs deleted or rewritten
+        """
+        if not exists(PACK_DIRECTORY):
+            return 0
+        cutoff = timezone.now() - timezone.timedelta(seconds=compact_grace)
+        compacted = 0
+        for info in self.scandir(PACK_DIRECTORY, namespaces=['details']):
+            if info.modified is not None and info.modified > cutoff:
+                continue
+            pack = f"{PACK_DIRECTORY}/{info.name}"
+            entries = list(FSPackedFile.objects.filter(module=namespace, pack=pack))
+            live = sum(entry.length for entry in entries)
+            if entries and live >= min_live_ratio * info.size:
+                continue
+            if entries:
+                files = {entry.filename: read_range(self, pack, entry.offset, entry.length) for entry in entries}
+                new_pack, new_entries = write_pack_object(files)
+                old = {entry.filename: entry for entry in entries}
+                for filename, offset, length in new_entries:
+                    # Only move rows still pointing at the old copy; a file
+                    # repacked or removed meanwhile keeps its newer state.
+                    FSPackedFile.objects.filter(
+                        pk=old[filename].pk, pack=pack, offset=old[filename].offset
+                    ).update(pack=new_pack, offset=offset, length=length)
+            remove(pack)
+            compacted += 1
+        return compacted
+
+    fs.writepacked = types.MethodType(writepacked, fs)
+    fs.flushpacks = types.MethodType(flushpacks, fs)
+    fs.readpacked = types.MethodType(readpacked, fs)
+    fs.compactpacks = types.MethodType(compactpacks, fs)
+    fs.exists = types.MethodType(packing_exists, fs)
+    fs.remove = types.MethodType(packing_remove, fs)
+    return fs
@@ -0,0 +1,89 @@
+"""
+django-debug-toolbar panel showing what django-pyfs did in a request.
+
+    DEBUG_TOOLBAR_PANELS = [
+        ...,
+        'djpyfs.panels.DjpyfsPanel',
+    ]
+
+The panel records the request with `djpyfs.profile()`, and lists every
+django-pyfs call, database query and S3 request, with calls repeated on the
+same file flagged at the top.
+"""
+from debug_toolbar.panels import Panel
+from django.utils.html import format_html, format_html_join
+
+from .profiling import profile
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:.2f}"
+
+
+class DjpyfsPanel(Panel):
+    """
+    Debug toolbar panel for django-pyfs.
+    """
+    title = "django-pyfs"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._profile_block = None
+        self._profile = None
+
+    @property
+    def nav_subtitle(self):
+        """
+        Counts of calls and S3 requests, shown under the title.
+        """
+        stats = self.get_stats()
+        if not stats:
+            return ""
+        subtitle = f"{len(stats['calls'])} calls, {len(stats['s3_requests'])} S3 requests"
+        if stats['repeated']:
+            subtitle += f", {len(stats['repeated'])} repeated"
+        return subtitle
+
+    def enable_instrumentation(self):
+        self._profile_block = profile()
+        self._profile = self._profile_block.__enter__()  # pylint: disable=unnecessary-dunder-call
+
+    def disable_instrumentation(self):
+        if self._profile_block is not None:
+            self._profile_block.__exit__(None, None, None)
+            self._profile_block = None
+
+    def generate_stats(self, request, response):  # pylint: disable=unused-argument
+        current = self._profile
+        if current is None:
+            return
+        self.record_stats({
+            'calls': [tuple(c) for c in current.calls],
+            'queries': [tuple(q) for q in current.queries],
+            's3_requests': [tuple(r) for r in current.s3_requests],
+            'repeated': [(list(call), count) for call, count in current.repeated()],
+            'bytes_transferred': current.bytes_transferred,
+        })
+
+    @property
+    def content(self):
+        stats = self.get_stats()
+        return format_html(
+            "<p>{} bytes transferred</p>"
+            "<h4>Repeated calls</h4><table><tr><th>Namespace</th><th>Call</th><th>File</th>"
+            "<th>Count</th></tr>{}</table>"
+            "<h4>Calls</h4><table><tr><th>Namespace</th><th>Call</th><th>File</th><th>ms</th>"
+            "<th>Bytes</th></tr>{}</table>"
+            "<h4>Queries</h4><table><tr><th>SQL</th><th>ms</th></tr>{}</table>"
+            "<h4>S3 requests</h4><table><tr><th>Operation</th><th>Status</th><th>ms</th>"
+            "<th>Sent</th><th>Received</th></tr>{}</table>",
+            stats['bytes_transferred'],
+            format_html_join('', "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>",
+                             ((n, m, f, count) for (n, m, f), count in stats['repeated'])),
+            format_html_join('', "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>",
+                             ((n, m, f or '', _ms(d), '' if b is None else b) for n, m, f, d, b in stats['calls'])),
+            format_html_join('', "<tr><td><code>{}</code></td><td>{}</td></tr>",
+                             ((sql, _ms(d)) for sql, d in stats['queries'])),
+            format_html_join('', "<tr><td>{}</td><td>{}</td><td>{}</td><td>{}</td><td>{}</td></tr>",
+                             ((o, s, _ms(d), sent, received) for o, s, d, sent, received in stats['s3_requests'])),
+        )
@@ -0,0 +1,239 @@
+"""
+Profiling of django-pyfs calls.
+
+Inside a `profile()` block, or a request shown with the django-debug-toolbar
+panel in `djpyfs.panels`, django-pyfs records:
+
+* every call made on a filesystem from `get_filesystem`, with its timing
+  and, for reads and writes of whole files, the bytes transferred,
+* every database query on the django-pyfs tables, such as `FSExpirations`,
+* every S3 request, with its timing and bytes sent and received.
+
+    with djpyfs.profile() as p:
+        render_report(...)
+    print(p.summary())
+
+Calls repeated on the same file, e.g. `get_url` for the same image in a
+template loop, are listed by `repeated()`; they usually point at work which
+could be done once or batched (see `defer_expirations`).
+
+Only the outermost call is recorded when filesystem methods call each other,
+e.g. `writetext` calling `writebytes`. S3 requests made from threads started
+inside the block, like the parts of a multipart upload, are recorded by
+every active profile.
+"""
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+import types
+from collections import Counter, namedtuple
+
+from django.db import connections
+
+# Filesystem methods which are timed
+PROFILED_METHODS = (
+    'get_url', 'expire', 'exists', 'remove', 'getinfo', 'getsize', 'openbin', 'open',
+    'readbytes', 'writebytes', 'readtext', 'writetext', 'upload', 'download',
+    'iter_entries', 'writepacked', 'readpacked', 'open_mmap', 'copy_to_socket',
+)
+
+# Prefix of the database tables of django-pyfs
+TABLE_PREFIX = 'djpyfs_'
+
+Call = namedtuple('Call', ['namespace', 'method', 'filename', 'duration', 'bytes'])
+Query = namedtuple('Query', ['sql', 'duration'])
+S3Request = namedtuple('S3Request', ['operation', 'status', 'duration', 'bytes_sent', 'bytes_received'])
+
+# The innermost active profile in this context, and whether a profiled
+# filesystem call is already in progress.
+_PROFILE = contextvars.ContextVar('djpyfs_profile', default=None)
+_IN_CALL = contextvars.ContextVar('djpyfs_profile_in_call', default=False)
+
+# Every active profile, for S3 requests made from other threads
+_ACTIVE = []
+_ACTIVE_LOCK = threading.Lock()
+
+
+class Profile:
+    """
+    What django-pyfs did during one `profile()` block.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.calls = []
+        self.queries = []
+        self.s3_requests = []
+        self._lock = threading.Lock()
+
+    def _record(self, attribute, item):
+        """
+        Append `item` to `attribute` of this profile and its parents.
+        """
+        current = self
+        while current is not None:
+            with current._lock:  # pylint: disable=protected-access
+                getattr(current, attribute).append(item)
+            current = current.parent
+
+    @property
+    def bytes_transferred(self):
+        """
+        Bytes sent to and received from S3, or read and written by whole
+        file calls on other filesystems.
+        """
+        if self.s3_requests:
+            return sum(r.bytes_sent + r.bytes_received for r in self.s3_requests)
+        return sum(c.bytes for c in self.calls if c.bytes)
+
+    def repeated(self):
+        """
+        Returns the `(namespace, method, filename)` calls made more than
+        once, with their counts, most frequent first.
+        """
+        counts = Counter((c.namespace, c.method, c.filename) for c in self.calls if c.filename is not None)
+        return [(call, count) for call, count in counts.most_common() if count > 1]
+
+    def summary(self):
+        """
+        Returns a short, human readable summary.
+        """
+        lines = [
+            f"{len(self.calls)} django-pyfs calls in {sum(c.duration for c in self.calls) * 1000:.1f} ms, "
+            f"{len(self.queries)} queries, {len(self.s3_requests)} S3 requests, "
+            f"{self.bytes_transferred} bytes transferred"
+        ]
+        for (namespace, method, filename), count in self.repeated():
+            lines.append(f"  repeated {count}x: {namespace}: {method}({filename!r})")
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile():
+    """
+    Record what django-pyfs does inside the block.
+
+    Returns:
+        Profile: The record, filled in as the block runs
+    """
+    current = Profile(_PROFILE.get())
+    token = _PROFILE.set(current)
+    with _ACTIVE_LOCK:
+        _ACTIVE.append(current)
+    try:
+        with contextlib.ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(functools.partial(_record_query, current)))
+            yield current
+    finally:
+        _PROFILE.reset(token)
+        with _ACTIVE_LOCK:
+            _ACTIVE.remove(current)
+
+
+def _record_query(current, execute, sql, params, many, context):  # pylint: disable=too-many-positional-arguments
+    """
+    Database execute wrapper recording queries on the django-pyfs tables.
+    Every active profile installs its own, so this records into `current`
+    only, not its parents.
+    """
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        if TABLE_PREFIX in sql:
+            with current._lock:  # pylint: disable=protected-access
+                current.queries.append(Query(sql, time.perf_counter() - start))
+
+
+def patch_profiling(fs, namespace):
+    """
+    Patch a filesystem instance so its calls are recorded by `profile()`.
+    Outside of a profile, this costs one context variable lookup per call.
+
+    Arguments:
+        fs (obj): The pyfilesystem subclass instance to be patched.
+        namespace (str): Namespace of the filesystem
+    Returns:
+        obj: Patched filesystem instance
+    """
+    def wrap(name, method):
+        @functools.wraps(method)
+        def profiled(self, *args, **kwargs):  # pylint: disable=unused-argument
+            current = _PROFILE.get()
+            if current is None or _IN_CALL.get():
+                return method(*args, **kwargs)
+            token = _IN_CALL.set(True)
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            finally:
+                _IN_CALL.reset(token)
+            size = None
+            if name in ('writebytes', 'writepacked') and len(args) > 1:
+                size = len(args[1])
+            elif name in ('readbytes', 'readpacked'):
+                size = len(result)
+            filename = args[0] if args and isinstance(args[0], str) else None
+            current._record(  # pylint: disable=protected-access
+                'calls', Call(namespace, name, filename, time.perf_counter() - start, size)
+            )
+            return result
+        return profiled
+
+    for name in PROFILED_METHODS:
+        method = getattr(fs, name, None)
+        if method is not None:
+            setattr(fs, name, types.MethodType(wrap(name, method), fs))
+    return fs
+
+
+def _body_size(body):
+    """
+    Returns how many bytes of a request body are left to send.
+    """
+    if body is None:
+        return 0
+    if hasattr(body, '__len__'):
+        return len(body)
+    try:
+        position = body.tell()
+        body.seek(0, 2)
+        size = body.tell()
+        body.seek(position)
+        return size - position
+    except (AttributeError, OSError, ValueError):
+        return 0
+
+
+def register_s3_hooks(events):
+    """
+    Record the S3 requests of a botocore client in the active profiles.
+    """
+    def before_call(params, context, **kwargs):
+        if _ACTIVE:
+            context['djpyfs_profile_start'] = time.perf_counter()
+            context['djpyfs_profile_sent'] = _body_size(params.get('body'))
+
+    def after_call(http_response, model, context, **kwargs):
+        start = context.pop('djpyfs_profile_start', None)
+        if start is None:
+            return
+        received = int(http_response.headers.get('Content-Length') or 0)
+        request = S3Request(
+            model.name, http_response.status_code, time.perf_counter() - start,
+            context.pop('djpyfs_profile_sent', 0), received
+        )
+        current = _PROFILE.get()
+        if current is not None:
+            current._record('s3_requests', request)  # pylint: disable=protected-access
+            return
+        with _ACTIVE_LOCK:
+            active = [p for p in _ACTIVE if p.parent is None]
+        for p in active:
+            p._record('s3_requests', request)  # pylint: disable=protected-access
+
+    events.register('before-call.s3', before_call)
+    events.register('after-call.s3', after_call)
@@ -0,0 +1,172 @@
+"""
+Reconciliation of tracked expirations against stored files.
+
+Over time the expiration backend and the storage drift apart: a crash in the
+middle of a sweep leaves expirations whose file is gone ("missing"), and
+files written without `expire` are never collected ("untracked").
+`reconcile_namespace` finds both by merge-joining a sorted listing of the
+namespace (`fs.iter_entries`) with the sorted expirations of the namespace,
+so memory use stays constant however large the namespace is.
+
+Expirations are matched to files by their name relative to the namespace,
+so one stored as "/a/b.txt" tracks "a/b.txt". Names stored in another form,
+e.g. with a leading "/", sort apart from the listing, so those are read in a
+separate pass and sorted in memory; only they cost memory.
+
+Pack objects of namespaces which pack small files are not themselves
+orphans; packed files do not appear in the listing, so an expiration is only
+treated as missing once `fs.exists` agrees.
+"""
+import heapq
+import logging
+import time
+from collections import namedtuple
+
+from django.utils import timezone
+from fs.path import normpath, relpath
+
+from .packing import PACK_DIRECTORY
+
+log = logging.getLogger(__name__)
+
+ReconcileResult = namedtuple('ReconcileResult', ['files', 'tracked', 'untracked', 'missing'])
+
+
+def _sorted_stream(items, key, description):
+    """
+    Pass `items` through, checking they really are in ascending `key`
+    order, since the merge silently gives wrong answers otherwise.
+    """
+    last = None
+    for item in items:
+        current = key(item)
+        if last is not None and current < last:
+            raise ValueError(
+                f"{description} are not sorted consistently ({last!r} before {current!r}); "
+                "check the collation of FSExpirations.filename"
+            )
+        last = current
+        yield item
+
+
+def _tracked_name(expiration):
+    return relpath(normpath(expiration.filename))
+
+
+def _iter_expirations(backend, namespace):
+    """
+    Yield the expirations of a namespace ordered by `_tracked_name`.
+
+    The backend orders them by stored name; those stored in normalized form
+    keep that order, and the rest are merged in from a sorted list.
+    """
+    others = sorted(
+        (e for e in backend.iter_filenames(namespace) if _tracked_name(e) != e.filename), key=_tracked_name
+    )
+    normalized = _sorted_stream(
+        (e for e in backend.iter_filenames(namespace) if _tracked_name(e) == e.filename), _tracked_name,
+        "Expirations"
+    )
+    return heapq.merge(normalized, others, key=_tracked_name)
+
+
+def _check_actions(untracked, missing):
+    if untracked not in ('report', 'expire', 'delete'):
+        raise ValueError(f"Bad untracked action: {untracked}")
+    if missing not in ('report', 'delete'):
+        raise ValueError(f"Bad missing action: {missing}")
+
+
+def reconcile_namespace(fs, namespace, backend,  # pylint: disable=too-many-positional-arguments
+                        untracked='report', missing='report', untracked_ttl=24 * 60 * 60, grace=60 * 60,
+                        batch_size=1000):
+    """
+    Find, and optionally clean up, orphans in one namespace.
+
+    Arguments:
+        fs (obj): Patched filesystem of the namespace
+        namespace (str): Namespace of the filesystem
+        backend (obj): The expiration backend
+        untracked (str): What to do with files which have no expiration:
+            "report" only logs them, "expire" starts tracking them with
+            `untracked_ttl`, and "delete" removes them.
+        missing (str): What to do with expirations whose file does not
+            exist: "report" only logs them, and "delete" removes them.
+        untracked_ttl (int): Seconds until untracked files expire, with
+            `untracked="expire"`
+        grace (int): Files modified less than this many seconds ago are
+            never treated as untracked, since their `expire` call may not
+            have been made yet.
+        batch_size (int): Number of orphans to clean up at once
+
+    Returns:
+        ReconcileResult: Counts of files, tracked files, and orphans found
+    """
+    _check_actions(untracked, missing)
+    cutoff = time.time() - grace
+    files = _sorted_stream(
+        (e for e in fs.iter_entries() if not e.name.startswith(f"{PACK_DIRECTORY}/")), lambda e: e.name,
+        "Stored files"
+    )
+    expirations = _iter_expirations(backend, namespace)
+    counts = {'files': 0, 'tracked': 0, 'untracked': 0, 'missing': 0}
+    untracked_batch = []
+    missing_batch = []
+
+    def flush_untracked():
+        if untracked == 'expire':
+            expiration = timezone.now() + timezone.timedelta(seconds=untracked_ttl)
+            backend.expire_many([(namespace, entry.name, expiration, True) for entry in untracked_batch])
+        elif untracked == 'delete':
+            for entry in untracked_batch:
+                fs.remove(entry.name)
+        del untracked_batch[:]
+
+    def flush_missing():
+        if missing == 'delete':
+            backend.remove_many(missing_batch)
+        del missing_batch[:]
+
+    def on_untracked(entry):
+        if entry.mtime > cutoff:
+            return
+        counts['untracked'] += 1
+        log.info("Untracked file in %s: %s", namespace, entry.name)
+        untracked_batch.append(entry)
+        if len(untracked_batch) >= batch_size:
+            flush_untracked()
+
+    def on_missing(expiration):
+        if fs.exists(expiration.filename):
+            # Packed, so not in the listing
+            counts['files'] += 1
+            counts['tracked'] += 1
+            return
+        counts['missing'] += 1
+        log.info("Expiration without a file in %s: %s", namespace, expiration.filename)
+        missing_batch.append(expiration)
+        if len(missing_batch) >= batch_size:
+            flush_missing()
+
+    entry = next(files, None)
+    expiration = next(expirations, None)
+    while entry is not None or expiration is not None:
+        tracked_name = _tracked_name(expiration) if expiration is not None else None
+        if expiration is None or (entry is not None and entry.name < tracked_name):
+            counts['files'] += 1
+            on_untracked(entry)
+            entry = next(files, None)
+        elif entry is None or tracked_name < entry.name:
+            on_missing(expiration)
+            expiration = next(expirations, None)
+        else:
+            counts['files'] += 1
+            counts['tracked'] += 1
+            # The same file may be tracked under more than one stored name
+            while expiration is not None and _tracked_name(expiration) == entry.name:
+                expiration = next(expirations, None)
+            entry = next(files, None)
+
+    flush_untracked()
+    flush_missing()
+    return ReconcileResult(**counts)
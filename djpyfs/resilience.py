@@ -0,0 +1,341 @@
+"""
+Resilience layer for S3 namespaces.
+
+S3 filesystems are built as `ResilientS3FS`, whose boto3 clients are set up
+from the `resilience` key in `DJFS`:
+
+    DJFS = {'type': 's3fs',
+            ...,
+            'resilience': {'retry_mode': 'adaptive',
+                           'max_attempts': 5,
+                           'connect_timeout': 2,
+                           'read_timeout': 10,
+                           'timeouts': {'GetObject': 30, 'PutObject': 120},
+                           'failure_threshold': 5,
+                           'reset_timeout': 30,
+                           'metrics_hook': 'myapp.metrics.record'}}
+
+* Retries are botocore's, and `max_attempts` includes the first attempt.
+  `adaptive` mode backs off exponentially with full
+  jitter and also slows down the client when S3 throttles.
+* `connect_timeout` and `read_timeout` bound each request attempt, so a
+  hung connection is given up on and retried instead of blocking a worker.
+  `timeouts` overrides the read timeout of single operations, e.g. for
+  large uploads; it needs a botocore which honours per-request read
+  timeouts, and older releases use `read_timeout` for every operation.
+* A circuit breaker, shared by every client for the same bucket, opens
+  after `failure_threshold` consecutive failed calls (server errors,
+  throttling, timeouts, connection errors; not e.g. 404s). While it is open,
+  calls fail immediately with `CircuitOpenError` instead of piling up
+  behind a struggling S3. After `reset_timeout` seconds one trial call is
+  let through, which closes the breaker again if it succeeds.
+* Every call is counted in `METRICS`, by operation and outcome, and passed
+  to `metrics_hook`, if set, as `hook(name, value, tags)`.
+
+With `fault_injection` set to a `FaultInjector`, or a dict of its arguments,
+requests fail or slow down before they are sent, to exercise all of this
+against a local S3 stand-in such as moto. It is meant for tests and load
+tests only.
+"""
+import logging
+import random
+import threading
+import time
+from collections import Counter
+
+import boto3
+from botocore.awsrequest import AWSResponse
+from botocore.config import Config
+from botocore.exceptions import ReadTimeoutError
+from django.utils.module_loading import import_string
+from fs import errors
+from fs_s3fs import S3FS
+
+from .profiling import register_s3_hooks
+
+log = logging.getLogger(__name__)
+
+# Counts of S3 calls, keyed by "<operation>.<outcome>", where the outcome is
+# one of "success", "failure", "retry" or "short_circuit".
+METRICS = Counter()
+_METRICS_LOCK = threading.Lock()
+
+# Circuit breakers and fault injectors, keyed by endpoint and bucket
+_BREAKERS = {}
+_INJECTORS = {}
+_BREAKERS_LOCK = threading.Lock()
+
+# Error codes S3 uses for throttling; they say S3 is struggling, so they
+# count against the breaker.
+THROTTLING_CODES = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestTimeout')
+
+
+class CircuitOpenError(errors.RemoteConnectionError):
+    """
+    Raised instead of calling S3 while its circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast after repeated failures, until a trial call succeeds.
+
+    Arguments:
+        name (str): Name for logging
+        failure_threshold (int): Consecutive failures which open the breaker
+        reset_timeout (float): Seconds until an open breaker lets a trial
+            call through
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Returns whether a call may go ahead. While half-open, only one call
+        at a time is let through.
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # Also covers a trial call which never reported back
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        """
+        Closes the breaker after a successful call.
+        """
+        with self._lock:
+            if self.state != self.CLOSED:
+                log.info("Circuit breaker for %s closed", self.name)
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """
+        Counts a failed call, opening the breaker at the threshold or when
+        a trial call fails.
+        """
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                log.warning("Circuit breaker for %s opened after %d failures", self.name, self.failures)
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+def get_breaker(name, config):
+    """
+    Returns the shared circuit breaker called `name`.
+    """
+    with _BREAKERS_LOCK:
+        if name not in _BREAKERS:
+            _BREAKERS[name] = CircuitBreaker(
+                name, config.get('failure_threshold', 5), config.get('reset_timeout', 30)
+            )
+        return _BREAKERS[name]
+
+
+def reset():
+    """
+    Forget all circuit breakers and metrics.
+    """
+    with _BREAKERS_LOCK:
+        _BREAKERS.clear()
+        _INJECTORS.clear()
+    with _METRICS_LOCK:
+        METRICS.clear()
+
+
+class _Body:
+    """
+    Raw HTTP body of an injected response.
+    """
+
+    def __init__(self, content):
+        self._content = content
+
+    def stream(self, **kwargs):
+        yield self._content
+
+
+class FaultInjector:
+    """
+    botocore `before-send` handler which delays requests and fails some of
+    them without sending them.
+
+    Arguments:
+        error_rate (float): Fraction of requests which fail
+        latency (float): Seconds to delay every request by
+        jitter (float): Up to this many more seconds of random delay
+        fault (str): How requests fail: "throttle" (503 SlowDown), "error"
+            (500 InternalError) or "timeout" (a read timeout)
+        seed (int): (optional) Seed for the random choices
+    """
+
+    def __init__(self, error_rate=0.0, latency=0.0, jitter=0.0, fault='throttle',  # pylint: disable=too-many-positional-arguments
+                 seed=None):
+        self.error_rate = error_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.fault = fault
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.injected = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, request, **kwargs):
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            fail = self.random.random() < self.error_rate
+            if fail:
+                self.injected += 1
+        if delay:
+            time.sleep(delay)
+        if not fail:
+            return None
+        if self.fault == 'timeout':
+            raise ReadTimeoutError(endpoint_url=request.url)
+        status, code = (500, 'InternalError') if self.fault == 'error' else (503, 'SlowDown')
+        body = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f'<Error><Code>{code}</Code><Message>Injected fault</Message></Error>'
+        )
+        return AWSResponse(request.url, status, {'Content-Type': 'application/xml'}, _Body(body.encode('utf-8')))
+
+
+def _register_hooks(events, breaker, config):
+    """
+    Wire the circuit breaker, metrics and any fault injection into the
+    events of a client.
+    """
+    hook = config.get('metrics_hook')
+    if isinstance(hook, str):
+        hook = import_string(hook)
+    timeouts = config.get('timeouts', {})
+
+    def count(operation, outcome, value=1):
+        with _METRICS_LOCK:
+            METRICS[f"{operation}.{outcome}"] += value
+        if hook is not None:
+            hook(f"djpyfs.s3.{outcome}", value, {'operation': operation, 'breaker': breaker.name})
+
+    def before_call(model, context, **kwargs):
+        if not breaker.allow():
+            count(model.name, 'short_circuit')
+            raise CircuitOpenError(msg=f"S3 circuit breaker for {breaker.name} is open")
+        if model.name in timeouts:
+            # Read by botocore for every attempt of this call
+            context['read_timeout'] = timeouts[model.name]
+
+    def after_call(http_response, parsed, model, **kwargs):
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        if retries:
+            count(model.name, 'retry', retries)
+        code = parsed.get('Error', {}).get('Code')
+        if http_response.status_code >= 500 or code in THROTTLING_CODES:
+            count(model.name, 'failure')
+            breaker.record_failure()
+        else:
+            count(model.name, 'success')
+            breaker.record_success()
+
+    def after_call_error(event_name, **kwargs):
+        count(event_name.rsplit('.', 1)[-1], 'failure')
+        breaker.record_failure()
+
+    events.register('before-call.s3', before_call)
+    events.register('after-call.s3', after_call)
+    events.register('after-call-error.s3', after_call_error)
+    if config.get('fault_injection') is not None:
+        injector = config['fault_injection']
+        if isinstance(injector, dict):
+            with _BREAKERS_LOCK:
+                if breaker.name not in _INJECTORS:
+                    _INJECTORS[breaker.name] = FaultInjector(**injector)
+                injector = _INJECTORS[breaker.name]
+        events.register_first('before-send.s3', injector)
+
+
+def client_config(config):
+    """
+    Returns the botocore `Config` for the `resilience` settings.
+    """
+    return Config(
+        retries={'mode': config.get('retry_mode', 'adaptive'), 'total_max_attempts': config.get('max_attempts', 5)},
+        connect_timeout=config.get('connect_timeout', 60),
+        read_timeout=config.get('read_timeout', 60),
+    )
+
+
+def make_client(djfs_settings, service='s3'):
+    """
+    Build a boto3 client (or, with `service='resource'`, an S3 resource) as
+    configured by `DJFS_SETTINGS`, with the resilience layer wired in if
+    `resilience` is set.
+    """
+    config = djfs_settings.get('resilience')
+    kwargs = {
+        'aws_access_key_id': djfs_settings.get('aws_access_key_id'),
+        'aws_secret_access_key': djfs_settings.get('aws_secret_access_key'),
+        'region_name': djfs_settings.get('region'),
+        'endpoint_url': djfs_settings.get('endpoint_url'),
+    }
+    if config is not None:
+        kwargs['config'] = client_config(config)
+    if service == 'resource':
+        resource = boto3.resource('s3', **kwargs)
+        client = resource.meta.client
+    else:
+        resource = client = boto3.client('s3', **kwargs)
+    if config is not None:
+        name = f"{djfs_settings.get('endpoint_url') or 's3'}/{djfs_settings['bucket']}"
+        _register_hooks(client.meta.events, get_breaker(name, config), config)
+    register_s3_hooks(client.meta.events)
+    return resource
+
+
+class ResilientS3FS(S3FS):
+    """
+    S3FS whose boto3 clients are built by `make_client`.
+
+    Arguments:
+        djfs_settings (dict): `DJFS_SETTINGS`
+        dir_path (str): Directory within the bucket
+    """
+
+    def __init__(self, djfs_settings, dir_path="/"):
+        super().__init__(
+            djfs_settings['bucket'], dir_path,
+            aws_access_key_id=djfs_settings.get('aws_access_key_id'),
+            aws_secret_access_key=djfs_settings.get('aws_secret_access_key'),
+            endpoint_url=djfs_settings.get('endpoint_url'),
+            region=djfs_settings.get('region'),
+        )
+        self._djfs_settings = djfs_settings
+
+    @property
+    def s3(self):
+        if not hasattr(self._tlocal, 's3'):
+            self._tlocal.s3 = make_client(self._djfs_settings, 'resource')
+        return self._tlocal.s3
+
+    @property
+    def client(self):
+        if not hasattr(self._tlocal, 'client'):
+            self._tlocal.client = make_client(self._djfs_settings)
+        return self._tlocal.client
@@ -0,0 +1,128 @@
+"""
+Django storage backed by a django-pyfs namespace.
+
+`PyFSStorage` lets `FileField`s and other users of the Django storage API
+keep their files in a django-pyfs namespace:
+
+    STORAGES = {
+        'default': {
+            'BACKEND': 'djpyfs.storage.PyFSStorage',
+            'OPTIONS': {'namespace': 'uploads', 'ttl': 7 * 24 * 60 * 60},
+        },
+    }
+
+All storages for a namespace share one filesystem from
+`get_cached_filesystem`. `url()` memoizes the URLs it hands out, so calling
+it for the same file over and over, e.g. in a template loop, only signs a
+URL once every `url_timeout - url_min_validity` seconds.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import Storage
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from fs import errors
+from fs.path import dirname
+
+from . import djpyfs
+
+# Number of URLs each storage remembers
+URL_CACHE_SIZE = 10000
+
+
+@deconstructible(path='djpyfs.storage.PyFSStorage')
+class PyFSStorage(Storage):  # pylint: disable=abstract-method
+    """
+    Django storage for a django-pyfs namespace. Like other remote storages,
+    it has no `path()`, nor created or accessed times.
+
+    Arguments:
+        namespace (str): Namespace to store files in
+        ttl (int): (optional) Seconds until saved files expire; by default
+            they are kept forever
+        url_timeout (int): How long URLs from `url()` are valid for, in
+            seconds
+        url_min_validity (int): A memoized URL is reused while it is valid
+            for at least this many more seconds; defaults to half of
+            `url_timeout`
+    """
+
+    def __init__(self, namespace='storage', ttl=None, url_timeout=3600, url_min_validity=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.url_timeout = url_timeout
+        self.url_min_validity = url_timeout // 2 if url_min_validity is None else url_min_validity
+        self._urls = OrderedDict()  # name -> (reuse until, url)
+        self._urls_lock = threading.Lock()
+
+    @property
+    def fs(self):
+        """
+        The shared filesystem of the namespace.
+        """
+        return djpyfs.get_cached_filesystem(self.namespace)
+
+    def _open(self, name, mode='rb'):
+        if 'b' in mode:
+            return File(self.fs.openbin(name, mode.replace('b', '')), name)
+        return File(self.fs.open(name, mode), name)
+
+    def _save(self, name, content):
+        """
+        Write the file, and set it to expire if `ttl` is set.
+        """
+        fs = self.fs
+        fs.makedirs(dirname(name), recreate=True)
+        with fs.openbin(name, 'w') as f:
+            for chunk in content.chunks():
+                f.write(chunk)
+        if self.ttl is not None:
+            fs.expire(name, self.ttl)
+        self._forget_url(name)
+        return name
+
+    def delete(self, name):
+        try:
+            self.fs.remove(name)
+        except errors.ResourceNotFound:
+            pass
+        self._forget_url(name)
+
+    def exists(self, name):
+        return self.fs.exists(name)
+
+    def size(self, name):
+        return self.fs.getsize(name)
+
+    def listdir(self, path):
+        directories, files = [], []
+        for info in self.fs.scandir(path):
+            (directories if info.is_dir else files).append(info.name)
+        return directories, files
+
+    def get_modified_time(self, name):
+        modified = self.fs.getinfo(name, namespaces=['details']).modified
+        return modified if settings.USE_TZ else timezone.make_naive(modified)
+
+    def url(self, name):
+        now = time.monotonic()
+        with self._urls_lock:
+            cached = self._urls.get(name)
+            if cached is not None and cached[0] > now:
+                self._urls.move_to_end(name)
+                return cached[1]
+        url = self.fs.get_url(name, timeout=self.url_timeout)
+        with self._urls_lock:
+            self._urls[name] = (now + self.url_timeout - self.url_min_validity, url)
+            self._urls.move_to_end(name)
+            while len(self._urls) > URL_CACHE_SIZE:
+                self._urls.popitem(last=False)
+        return url
+
+    def _forget_url(self, name):
+        with self._urls_lock:
+            self._urls.pop(name, None)
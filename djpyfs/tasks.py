@@ -0,0 +1,57 @@
+"""
+Celery tasks for django-pyfs.
+
+These fan the removal of expired files out across Celery workers: the
+`sweep_expired_objects_fanout` task plans the expired set into chunks (see
+`djpyfs.plan_expiration_chunks`), runs one `process_expiration_chunk` task
+per chunk, and totals the results in `sum_removed`. Chunks can be retried
+independently, so a failed worker only costs its own chunk. Schedule it
+with Celery beat, e.g.:
+
+    CELERY_BEAT_SCHEDULE = {
+        'djpyfs-sweep': {'task': 'djpyfs.tasks.sweep_expired_objects_fanout', 'schedule': 300},
+    }
+
+This module needs `celery`; django-pyfs itself does not.
+"""
+from celery import chord, shared_task
+from django.utils.dateparse import parse_datetime
+
+from . import djpyfs
+
+
+@shared_task(acks_late=True, autoretry_for=(Exception,), retry_backoff=True, retry_kwargs={'max_retries': 5})
+def process_expiration_chunk(module, min_id, max_id, cutoff):
+    """
+    Remove the expired files of one chunk. `cutoff` is an ISO 8601 string.
+
+    Returns:
+        int: Number of expirations removed
+    """
+    return djpyfs.process_expiration_chunk(module, min_id, max_id, parse_datetime(cutoff))
+
+
+@shared_task
+def sum_removed(results):
+    """
+    Total the results of the chunk tasks.
+    """
+    return sum(results)
+
+
+@shared_task
+def sweep_expired_objects_fanout(chunk_size=1000):
+    """
+    Plan the expired set into chunks and process them in parallel.
+
+    Returns:
+        str: Id of the result of `sum_removed`, or None if nothing has
+            expired
+    """
+    chunks = [
+        process_expiration_chunk.si(chunk.module, chunk.min_id, chunk.max_id, chunk.cutoff.isoformat())
+        for chunk in djpyfs.plan_expiration_chunks(chunk_size)
+    ]
+    if not chunks:
+        return None
+    return chord(chunks)(sum_removed.s()).id
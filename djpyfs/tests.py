@@ -3,19 +3,49 @@ Database models for django-pyfs
 """
 
 
+import json
 import os
 import shutil
+import socket
+import time
 import unittest
-from unittest.mock import patch
+import zipfile
+from io import BytesIO, StringIO
+from unittest.mock import Mock, patch
 
 import boto3
-from django.test import TestCase
+from botocore.exceptions import ClientError, ReadTimeoutError
+from django.apps import apps
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, TransactionTestCase
 from django.utils import timezone
+from fs import errors as fs_errors
 from fs.memoryfs import MemoryFS
 from moto import mock_s3
 
-from . import djpyfs
-from .models import FSExpirations
+try:
+    import celery
+except ImportError:  # pragma: no cover
+    celery = None
+
+try:
+    import debug_toolbar
+except ImportError:  # pragma: no cover
+    debug_toolbar = None
+
+from . import djpyfs, resilience
+from .backends import Expiration, SortedSetExpirationBackend, SQLiteSortedSet
+from .loadtest import LOADTEST_BUCKET, parse_mix, percentile, run_load_test
+from .middleware import BatchPackingMiddleware, DeferredExpirationMiddleware
+from .models import (FSExpirations, FSNamespaceUsage, FSPackedFile,
+                     FSPendingUpload, FSSweepCheckpoint)
+from .reconcile import ReconcileResult
+from .resilience import CircuitOpenError, FaultInjector
+from .storage import PyFSStorage
+from .usage import QuotaExceeded
+from .views import NamespaceZipView, file_response
 
 
 class FSExpirationsTest(TestCase):
@@ -203,6 +233,17 @@ class _BaseFs(TestCase):
 
         self.assertEqual(FSExpirations.objects.all().count(), 0)
 
+    def test_sweep_expired_objects(self):
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.makedir(self.test_dir_name)
+        fs.writetext(self.relative_path_to_test_file, 'foo')
+        fs.expire(self.relative_path_to_test_file, 0, 0)  # pylint: disable=no-member
+        fs.expire(self.relative_path_to_uncreated_test_file, 0, 0)  # pylint: disable=no-member
+
+        self.assertEqual(djpyfs.sweep_expired_objects(), 2)
+        self.assertFalse(fs.exists(self.relative_path_to_test_file))
+        self.assertEqual(FSExpirations.objects.all().count(), 0)
+
     def test_get_url(self):
         fs = djpyfs.get_filesystem(self.namespace)
         fs.makedir(self.test_dir_name)
@@ -227,6 +268,41 @@ class _BaseFs(TestCase):
         fs = djpyfs.get_filesystem(self.namespace)
         self.assertTrue(callable(getattr(fs, 'expire')))   # pylint: disable=literal-used-as-attribute
         self.assertTrue(callable(getattr(fs, 'get_url')))  # pylint: disable=literal-used-as-attribute
+        self.assertTrue(callable(getattr(fs, 'iter_entries')))  # pylint: disable=literal-used-as-attribute
+
+    def test_iter_entries(self):
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.makedirs('a/b')
+        for name in ('a-c', 'a/b/d', 'a/e', 'z'):
+            fs.writetext(name, name)
+
+        entries = list(fs.iter_entries(page_size=1))  # pylint: disable=no-member
+        self.assertEqual([e.name for e in entries], ['a-c', 'a/b/d', 'a/e', 'z'])
+        self.assertEqual(entries[1].size, 5)
+        self.assertGreater(entries[1].mtime, 0)
+
+        # Listings can be resumed, and filtered by prefix
+        names = [e.name for e in fs.iter_entries(start_after='a/b/d')]  # pylint: disable=no-member
+        self.assertEqual(names, ['a/e', 'z'])
+        names = [e.name for e in fs.iter_entries(prefix='a/')]  # pylint: disable=no-member
+        self.assertEqual(names, ['a/b/d', 'a/e'])
+        names = [e.name for e in fs.iter_entries(prefix='a/b', start_after='a/b/d')]  # pylint: disable=no-member
+        self.assertEqual(names, [])
+
+        # Prefixes can't leave the namespace
+        other = djpyfs.get_filesystem(self.namespace + '_other')
+        other.writetext('secret.txt', 'secret')
+        with self.assertRaises(fs_errors.IllegalBackReference):
+            fs.iter_entries(prefix='../')  # pylint: disable=no-member
+        with self.assertRaises(fs_errors.IllegalBackReference):
+            fs.iter_entries(start_after='../z')  # pylint: disable=no-member
+        names = [e.name for e in fs.iter_entries(prefix='/a/')]  # pylint: disable=no-member
+        self.assertEqual(names, ['a/b/d', 'a/e'])
+        names = [e.name for e in fs.iter_entries(prefix='/tm')]  # pylint: disable=no-member
+        self.assertEqual(names, [])
+        names = [e.name for e in fs.iter_entries(prefix='a/../z')]  # pylint: disable=no-member
+        self.assertEqual(names, ['z'])
+        other.remove('secret.txt')
 
 
 # pylint: disable=test-inherits-tests; literal-used-as-attribute
@@ -249,6 +325,14 @@ class BadFileSystemTestInh(_BaseFs):
         with self.assertRaises(AttributeError):
             super().test_expire_objects()
 
+    def test_sweep_expired_objects(self):
+        with self.assertRaises(AttributeError):
+            super().test_sweep_expired_objects()
+
+    def test_iter_entries(self):
+        with self.assertRaises(AttributeError):
+            super().test_iter_entries()
+
     def test_get_url(self):
         with self.assertRaises(AttributeError):
             super().test_get_url()
@@ -274,9 +358,14 @@ class OsfsTest(_BaseFs):
     }
 
     def _cleanDirs(self):
-        # If anything is left from last run, try to clean it
+        """
+        Removes the test namespaces' directories, including any left from
+        the last run.
+        """
         shutil.rmtree(self.full_test_path, ignore_errors=True)
         shutil.rmtree(self.secondary_full_test_path, ignore_errors=True)
+        # Made by test_iter_entries
+        shutil.rmtree(f"{self.full_test_path}_other", ignore_errors=True)
 
     def setUp(self):
         super().setUp()
@@ -287,7 +376,873 @@ class OsfsTest(_BaseFs):
         self._cleanDirs()
 
 
+class SweepTest(TestCase):
+    """
+    Tests for the budgeted, checkpointed sweep.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = OsfsTest.djfs_settings
+        self.namespace = 'unittest_sweep'
+        self.fs = djpyfs.get_filesystem(self.namespace)
+        for i in range(5):
+            self.fs.writetext(f'file_{i}', 'foo')
+            self.fs.expire(f'file_{i}', 0, 0)  # pylint: disable=no-member
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_max_rows_resumes(self):
+        self.assertEqual(djpyfs.sweep_expired_objects(max_rows=2, batch_size=1), 2)
+        self.assertEqual(FSExpirations.objects.count(), 3)
+
+        checkpoint = FSSweepCheckpoint.objects.get(name='default')
+        self.assertIsNotNone(checkpoint.last_key)
+        self.assertIsNone(checkpoint.locked_until)
+
+        # The rest of the set is processed by the next run, which resets the
+        # cursor once it reaches the end.
+        self.assertEqual(djpyfs.sweep_expired_objects(), 3)
+        self.assertEqual(FSExpirations.objects.count(), 0)
+        self.assertEqual(self.fs.listdir('/'), [])
+        self.assertIsNone(FSSweepCheckpoint.objects.get(name='default').last_key)
+
+    def test_max_seconds(self):
+        with patch('djpyfs.djpyfs.time.monotonic', side_effect=[0, 0, 100]):
+            self.assertEqual(djpyfs.sweep_expired_objects(max_seconds=10), 2)
+        self.assertEqual(FSExpirations.objects.count(), 3)
+
+    def test_locked(self):
+        self.assertIsNotNone(FSSweepCheckpoint.acquire('default', 'other-host', 60))
+        self.assertIsNone(djpyfs.sweep_expired_objects())
+        self.assertEqual(FSExpirations.objects.count(), 5)
+
+        # A lapsed lock can be taken over
+        FSSweepCheckpoint.objects.update(locked_until=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertEqual(djpyfs.sweep_expired_objects(), 5)
+
+    def test_lease_renewed(self):
+        checkpoint = FSSweepCheckpoint.acquire('default', 'this-host', 60)
+        FSSweepCheckpoint.objects.update(locked_until=timezone.now() + timezone.timedelta(seconds=1))
+        self.assertTrue(checkpoint.record(None, None))
+        renewed = FSSweepCheckpoint.objects.get().locked_until
+        self.assertGreater(renewed, timezone.now() + timezone.timedelta(seconds=50))
+        self.assertIsNone(FSSweepCheckpoint.acquire('default', 'other-host', 60))
+
+        # Once taken over, progress is no longer recorded
+        FSSweepCheckpoint.objects.update(locked_until=timezone.now() - timezone.timedelta(seconds=1))
+        self.assertIsNotNone(FSSweepCheckpoint.acquire('default', 'other-host', 60))
+        self.assertFalse(checkpoint.record(timezone.now(), 'key'))
+        self.assertIsNone(FSSweepCheckpoint.objects.get().last_key)
+
+    def test_lease_lost(self):
+        with patch.object(FSSweepCheckpoint, 'record', return_value=False):
+            self.assertEqual(djpyfs.sweep_expired_objects(batch_size=2), 2)
+        self.assertEqual(FSExpirations.objects.count(), 3)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('djpyfs_sweep', '--max-rows', '1', stdout=out)
+        self.assertIn('Processed 1', out.getvalue())
+
+    def test_expiration_chunks(self):
+        other = djpyfs.get_filesystem('unittest_sweep_other')
+        self.addCleanup(shutil.rmtree, other.getsyspath('/'), ignore_errors=True)
+        other.writetext('file', 'foo')
+        other.expire('file', 0)  # pylint: disable=no-member
+        self.fs.writetext('later', 'foo')
+        self.fs.expire('later', 30)  # pylint: disable=no-member
+
+        chunks = list(djpyfs.plan_expiration_chunks(chunk_size=2))
+        self.assertEqual([(c.module, c.max_id - c.min_id) for c in chunks], [
+            (self.namespace, 1), (self.namespace, 1), (self.namespace, 0), ('unittest_sweep_other', 0),
+        ])
+
+        # A file whose expiration moves after planning is kept
+        self.fs.expire('file_0', 30)  # pylint: disable=no-member
+        self.assertEqual(sum(djpyfs.process_expiration_chunk(*chunk) for chunk in chunks), 5)
+        self.assertTrue(self.fs.exists('file_0'))
+        self.assertFalse(self.fs.exists('file_1'))
+        self.assertFalse(other.exists('file'))
+        self.assertEqual(FSExpirations.objects.count(), 2)
+
+        # Processing a chunk again does nothing
+        self.assertEqual(djpyfs.process_expiration_chunk(*chunks[0]), 0)
+
+    @unittest.skipIf(celery is None, "Celery is not installed")
+    def test_celery_tasks(self):  # pragma: no cover
+        from . import tasks  # pylint: disable=import-outside-toplevel
+        with patch.object(tasks, 'chord') as chord:
+            tasks.sweep_expired_objects_fanout.apply(kwargs={'chunk_size': 2})
+        self.assertEqual(len(chord.call_args[0][0]), 3)
+
+        results = [
+            tasks.process_expiration_chunk.apply(args=(c.module, c.min_id, c.max_id, c.cutoff.isoformat())).get()
+            for c in djpyfs.plan_expiration_chunks(chunk_size=2)
+        ]
+        self.assertEqual(tasks.sum_removed.apply(args=(results,)).get(), 5)
+        self.assertIsNone(tasks.sweep_expired_objects_fanout.apply().get())
+
+
+class SortedSetExpirationBackendTest(TestCase):
+    """
+    Tests for the sorted set expiration backend and its SQLite stand-in.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, expiration_backend={
+            'class': 'djpyfs.backends.SortedSetExpirationBackend',
+            'options': {'key': 'unittest'},
+        })
+        self.backend = djpyfs.get_expiration_backend()
+        self.fs = djpyfs.get_filesystem('unittest_sorted_set')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_get_expiration_backend(self):
+        self.assertIsInstance(self.backend, SortedSetExpirationBackend)
+        self.assertIs(djpyfs.get_expiration_backend(), self.backend)
+
+    def test_expire_objects(self):
+        self.fs.writetext('foo', 'foo')
+        self.fs.writetext('bar', 'bar')
+        self.fs.writetext('baz', 'baz')
+        self.fs.expire('foo', 0)  # pylint: disable=no-member
+        self.fs.expire('bar', 30)  # pylint: disable=no-member
+        self.fs.expire('baz', 0, expires=False)  # pylint: disable=no-member
+
+        # Nothing goes to the database
+        self.assertEqual(FSExpirations.objects.count(), 0)
+        self.assertEqual(self.backend.client.zcard('unittest'), 3)
+
+        djpyfs.expire_objects()
+        self.assertEqual(sorted(self.fs.listdir('/')), ['bar', 'baz'])
+        self.assertEqual(self.backend.client.zcard('unittest'), 2)
+
+    def test_expired_after(self):
+        for name in ('a', 'b', 'c'):
+            self.backend.expire('ns', name, -10)
+        entries = self.backend.expired()
+        self.assertEqual([e.filename for e in entries], ['a', 'b', 'c'])
+        self.assertTrue(all(isinstance(e, Expiration) for e in entries))
+
+        first = entries[0]
+        after = self.backend.expired(after=(first.expiration, first.key), limit=1)
+        self.assertEqual([e.filename for e in after], ['b'])
+
+        self.backend.expire('ns', 'a', 0, expires=False)
+        self.assertEqual([e.filename for e in self.backend.soonest('ns', 5)], ['b', 'c'])
+
+    def test_sweep(self):
+        for i in range(3):
+            self.fs.writetext(f'file_{i}', 'foo')
+            self.fs.expire(f'file_{i}', 0)  # pylint: disable=no-member
+        self.assertEqual(djpyfs.sweep_expired_objects(max_rows=2, batch_size=1), 2)
+        self.assertEqual(djpyfs.sweep_expired_objects(), 1)
+        self.assertEqual(self.fs.listdir('/'), [])
+
+    def test_sweep_long_name(self):
+        # Far longer than 800 characters if non-ASCII were escaped in the key
+        names = ['/'.join(['é' * 100] * 3), '/'.join(['ü' * 100] * 3)]
+        for name in names:
+            self.fs.makedirs(name.rsplit('/', 1)[0], recreate=True)
+            self.fs.writetext(name, 'foo')
+            self.backend.expire('unittest_sorted_set', name, -10)
+        self.assertEqual(djpyfs.sweep_expired_objects(max_rows=1, batch_size=1), 1)
+        checkpoint = FSSweepCheckpoint.objects.get(name='default')
+        self.assertEqual(checkpoint.last_key, json.dumps(['unittest_sorted_set', names[0]], ensure_ascii=False))
+        self.assertEqual(djpyfs.sweep_expired_objects(), 1)
+        self.assertEqual(self.backend.client.zcard('unittest'), 0)
+
+    def test_sqlite_sorted_set(self):
+        zset = SQLiteSortedSet()
+        zset.zadd('s', {'a': 1, 'b': 2, 'c': float('inf')})
+        zset.zadd('s', {'a': 3})
+        self.assertEqual(zset.zrangebyscore('s', '-inf', 10), ['b', 'a'])
+        self.assertEqual(zset.zrangebyscore('s', 0, 10, start=1, num=1, withscores=True), [('a', 3.0)])
+        self.assertEqual(zset.zscore('s', 'c'), float('inf'))
+        self.assertIsNone(zset.zscore('s', 'd'))
+        self.assertEqual(zset.zrem('s', 'a', 'd'), 1)
+        self.assertEqual(zset.zcard('s'), 2)
+
+
+class UsageTest(TestCase):
+    """
+    Tests for namespace usage accounting and quotas.
+    """
+    namespace = 'unittest_usage'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, usage_accounting=True)
+        self.fs = djpyfs.get_filesystem(self.namespace)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_accounting(self):
+        self.fs.writetext('foo', 'foo')
+        with self.fs.open('bar', 'wb') as f:
+            f.write(b'barbar')
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (9, 2))
+
+        # Overwriting only changes the size
+        self.fs.writebytes('foo', b'foofoofoo')
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (15, 2))
+
+        self.fs.remove('bar')
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (9, 1))
+
+        # Writes made behind our back are picked up by reconciliation
+        with open(self.fs.getsyspath('baz'), 'w') as f:
+            f.write('baz')
+        out = StringIO()
+        call_command('djpyfs_reconcile_usage', stdout=out)
+        self.assertIn('12 bytes in 2 files', out.getvalue())
+        self.assertIsNotNone(FSNamespaceUsage.objects.get(module=self.namespace).reconciled)
+
+    def test_soft_quota_evicts_soonest(self):
+        djpyfs.DJFS_SETTINGS['quotas'] = {self.namespace: {'soft_files': 2}}
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writetext('first', 'x')
+        fs.expire('first', 30)  # pylint: disable=no-member
+        fs.writetext('second', 'x')
+        fs.expire('second', 10)  # pylint: disable=no-member
+        fs.writetext('permanent', 'x')
+
+        self.assertEqual(sorted(fs.listdir('/')), ['first', 'permanent'])
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (2, 2))
+        self.assertEqual(FSExpirations.objects.count(), 1)
+
+    def test_hard_quota(self):
+        djpyfs.DJFS_SETTINGS['default_quota'] = {'hard_bytes': 2}
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writetext('foo', 'foo')
+        with self.assertRaises(QuotaExceeded):
+            fs.writetext('bar', 'bar')
+
+        # Once the expiring file is evicted there is room again
+        fs.expire('foo', 30)  # pylint: disable=no-member
+        fs.writetext('bar', 'b')
+        self.assertEqual(fs.listdir('/'), ['bar'])
+
+
+class CompressionTest(TestCase):
+    """
+    Tests for transparent compression on OSFS.
+    """
+    namespace = 'unittest_compression'
+    data = '{"values": [' + ', '.join(['1'] * 1000) + ']}'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, usage_accounting=True, compression={'encoding': 'gzip'})
+        self.fs = djpyfs.get_filesystem(self.namespace)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_round_trip(self):
+        self.fs.writetext('data.json', self.data)
+        with self.fs.open('stream.json', 'w') as f:
+            f.write(self.data)
+        self.fs.upload('upload.json', BytesIO(self.data.encode('utf-8')))
+
+        for name in ('data.json', 'stream.json', 'upload.json'):
+            self.assertEqual(self.fs.readtext(name), self.data)
+            with open(self.fs.getsyspath(name), 'rb') as f:
+                stored = f.read()
+            self.assertTrue(stored.startswith(b'\x1f\x8b'))
+            self.assertLess(len(stored), len(self.data) // 5)
+
+        # Usage accounting sees the compressed size
+        stored_size = sum(self.fs.getsize(name) for name in ('data.json', 'stream.json', 'upload.json'))
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (stored_size, 3))
+
+    def test_uncompressed_types(self):
+        self.fs.writebytes('image.png', b'png')
+        with open(self.fs.getsyspath('image.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'png')
+
+    def test_written_before_compression(self):
+        with open(self.fs.getsyspath('old.json'), 'w') as f:
+            f.write(self.data)
+        self.assertEqual(self.fs.readtext('old.json'), self.data)
+
+    def test_read_write_unsupported(self):
+        with self.assertRaises(fs_errors.Unsupported):
+            self.fs.openbin('data.json', 'r+')
+
+
+class DeferredExpirationTest(TestCase):
+    """
+    Tests for collecting `expire` calls into one bulk write.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = OsfsTest.djfs_settings
+        self.fs = djpyfs.get_filesystem('unittest_deferred')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_defer_expirations(self):
+        FSExpirations.create_expiration('unittest_deferred', 'foo', 30)
+        with self.captureOnCommitCallbacks(execute=True):
+            with djpyfs.defer_expirations():
+                self.fs.expire('foo', 0)  # pylint: disable=no-member
+                with djpyfs.defer_expirations() as inner:
+                    self.fs.expire('bar', 0)  # pylint: disable=no-member
+                    self.fs.expire('bar', 60, expires=False)  # pylint: disable=no-member
+                self.assertEqual(len(inner.entries), 2)
+                self.assertEqual(FSExpirations.objects.count(), 1)
+
+            # Nothing is written until the transaction commits
+            self.assertEqual(FSExpirations.objects.count(), 1)
+
+        self.assertEqual(FSExpirations.objects.count(), 2)
+        self.assertEqual(len(FSExpirations.expired()), 1)
+        self.assertFalse(FSExpirations.objects.get(filename='bar').expires)
+
+    def test_sorted_set_backend(self):
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, expiration_backend={
+            'class': 'djpyfs.backends.SortedSetExpirationBackend',
+        })
+        backend = djpyfs.get_expiration_backend()
+        fs = djpyfs.get_filesystem('unittest_deferred')
+        with self.captureOnCommitCallbacks(execute=True):
+            with djpyfs.defer_expirations():
+                fs.expire('foo', 0)  # pylint: disable=no-member
+                fs.expire('bar', 0, expires=False)  # pylint: disable=no-member
+        self.assertEqual(backend.client.zcard(backend.key), 2)
+        self.assertEqual([e.filename for e in backend.expired()], ['foo'])
+
+    def test_middleware(self):
+        def view(request):  # pylint: disable=unused-argument
+            self.fs.expire('foo', 0)  # pylint: disable=no-member
+            self.fs.expire('bar', 0)  # pylint: disable=no-member
+            self.assertEqual(FSExpirations.objects.count(), 0)
+            return 'response'
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(DeferredExpirationMiddleware(view)(None), 'response')
+        self.assertEqual(FSExpirations.objects.count(), 2)
+
+
+class ReconcileTest(TestCase):
+    """
+    Tests for reconciling expirations against stored files.
+    """
+    namespace = 'unittest_reconcile'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = OsfsTest.djfs_settings
+        self.fs = djpyfs.get_filesystem(self.namespace)
+        self.fs.makedir('dir')
+        for name in ('a', 'b', 'dir/c', 'dir/d'):
+            self.fs.writetext(name, name)
+        for name in ('a', 'dir/c', 'dir/missing', 'z_missing'):
+            self.fs.expire(name, 30)  # pylint: disable=no-member
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_report(self):
+        result = djpyfs.reconcile_orphans(self.namespace, grace=0)
+        self.assertEqual(result, ReconcileResult(files=4, tracked=2, untracked=2, missing=2))
+        self.assertEqual(FSExpirations.objects.count(), 4)
+        self.assertEqual(len(list(self.fs.iter_entries())), 4)  # pylint: disable=no-member
+
+        # Recently written files are left alone
+        self.assertEqual(djpyfs.reconcile_orphans(self.namespace).untracked, 0)
+
+    def test_absolute_names(self):
+        # Rows stored with a leading '/', e.g. by earlier versions
+        for name in ('/b', '/dir/c', '/gone'):
+            FSExpirations.create_expiration(self.namespace, name, 30)
+        result = djpyfs.reconcile_orphans(self.namespace, grace=0)
+        self.assertEqual(result, ReconcileResult(files=4, tracked=3, untracked=1, missing=3))
+
+        # expire() keeps updating the stored row rather than adding another
+        FSExpirations.objects.filter(filename='/b').update(expiration=timezone.now())
+        self.fs.expire('/b', 0, expires=False)  # pylint: disable=no-member
+        self.assertEqual(FSExpirations.objects.filter(module=self.namespace).count(), 7)
+        djpyfs.expire_objects()
+        self.assertTrue(self.fs.exists('b'))
+
+    def test_clean_up(self):
+        result = djpyfs.reconcile_orphans(self.namespace, untracked='expire', missing='delete', grace=0, batch_size=1)
+        self.assertEqual(result, ReconcileResult(files=4, tracked=2, untracked=2, missing=2))
+        self.assertEqual(
+            sorted(FSExpirations.objects.values_list('filename', flat=True)), ['a', 'b', 'dir/c', 'dir/d']
+        )
+
+        result = djpyfs.reconcile_orphans(self.namespace, grace=0)
+        self.assertEqual(result, ReconcileResult(files=4, tracked=4, untracked=0, missing=0))
+
+    def test_delete_untracked(self):
+        out = StringIO()
+        call_command('djpyfs_reconcile', self.namespace, '--untracked', 'delete', '--grace', '0', stdout=out)
+        self.assertIn('4 files, 2 tracked, 2 untracked, 2 missing', out.getvalue())
+        self.assertEqual([e.name for e in self.fs.iter_entries()], ['a', 'dir/c'])  # pylint: disable=no-member
+
+    def test_sorted_set_backend(self):
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, expiration_backend={
+            'class': 'djpyfs.backends.SortedSetExpirationBackend',
+        })
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.expire('b', 30)  # pylint: disable=no-member
+        fs.expire('dir/gone', 30, expires=False)  # pylint: disable=no-member
+        result = djpyfs.reconcile_orphans(self.namespace, missing='delete', grace=0)
+        self.assertEqual(result, ReconcileResult(files=4, tracked=1, untracked=3, missing=1))
+        self.assertEqual([e.filename for e in djpyfs.get_expiration_backend().iter_filenames(self.namespace)], ['b'])
+
+    def test_unsorted(self):
+        with patch('djpyfs.backends.DatabaseExpirationBackend.iter_filenames') as mock_iter:
+            unsorted = [Expiration(self.namespace, name, None, '1') for name in ('b', 'a')]
+            mock_iter.side_effect = lambda module: iter(unsorted)
+            with self.assertRaises(ValueError):
+                djpyfs.reconcile_orphans(self.namespace)
+
+
 # pylint: disable=test-inherits-tests
+class PackingTest(TestCase):
+    """
+    Tests for packing small files on OSFS.
+    """
+    namespace = 'unittest_packing'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, packing={'max_file_size': 10, 'pack_size': 20})
+        self.fs = djpyfs.get_filesystem(self.namespace)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_write_read(self):
+        with djpyfs.batch_packing():
+            self.fs.writepacked('a', b'aaaa')  # pylint: disable=no-member
+            self.fs.writepacked('b', b'bbbbbbbb')  # pylint: disable=no-member
+            self.fs.writepacked('big', b'x' * 11)  # pylint: disable=no-member
+
+            # Buffered until the pack is full, flushed or the block exits
+            self.assertEqual(FSPackedFile.objects.count(), 0)
+            self.assertTrue(self.fs.exists('a'))
+            self.assertEqual(self.fs.readpacked('a'), b'aaaa')  # pylint: disable=no-member
+            self.assertEqual(self.fs.readbytes('big'), b'x' * 11)
+
+            self.assertEqual(self.fs.flushpacks(), 2)  # pylint: disable=no-member
+            self.assertEqual(FSPackedFile.objects.count(), 2)
+            self.assertEqual(len(self.fs.listdir('.packs')), 1)
+            self.assertFalse(self.fs.isfile('a'))
+            self.assertTrue(self.fs.exists('a'))
+            self.assertEqual(self.fs.readpacked('a'), b'aaaa')  # pylint: disable=no-member
+            self.assertEqual(self.fs.readpacked('/b'), b'bbbbbbbb')  # pylint: disable=no-member
+            self.assertEqual(self.fs.readpacked('big'), b'x' * 11)  # pylint: disable=no-member
+
+            # Filling the buffer writes a pack
+            for name in 'cde':
+                self.fs.writepacked(name, name.encode('ascii') * 8)  # pylint: disable=no-member
+            self.assertEqual(len(self.fs.listdir('.packs')), 2)
+            self.fs.writepacked('f', b'ffff')  # pylint: disable=no-member
+        self.assertEqual(len(self.fs.listdir('.packs')), 3)
+        self.assertEqual(self.fs.readpacked('f'), b'ffff')  # pylint: disable=no-member
+
+    def test_durable_without_batch(self):
+        # Visible to every filesystem instance, and not left for `close`
+        self.fs.writepacked('small.txt', b'hello')  # pylint: disable=no-member
+        other = djpyfs.get_filesystem(self.namespace)
+        self.assertTrue(other.exists('small.txt'))
+        self.assertEqual(other.readpacked('small.txt'), b'hello')  # pylint: disable=no-member
+        self.assertEqual(other.flushpacks(), 0)  # pylint: disable=no-member
+
+    def test_batch_middleware(self):
+        def view(request):  # pylint: disable=unused-argument
+            self.fs.writepacked('a', b'aaaa')  # pylint: disable=no-member
+            self.fs.writepacked('b', b'bbbb')  # pylint: disable=no-member
+            self.assertEqual(FSPackedFile.objects.count(), 0)
+
+        BatchPackingMiddleware(view)(RequestFactory().get('/'))
+        self.assertEqual(FSPackedFile.objects.count(), 2)
+        self.assertEqual(len(self.fs.listdir('.packs')), 1)
+
+    def test_expire_and_compact(self):
+        with djpyfs.batch_packing():
+            for name in 'abcd':
+                self.fs.writepacked(name, name.encode('ascii') * 4)  # pylint: disable=no-member
+        for name in 'abc':
+            self.fs.expire(name, 0)  # pylint: disable=no-member
+        self.fs.expire('d', 30)  # pylint: disable=no-member
+        old_pack = self.fs.listdir('.packs')[0]
+
+        # Left alone until it is older than the grace period
+        self.assertEqual(self.fs.compactpacks(), 0)  # pylint: disable=no-member
+        self.age_packs()
+        djpyfs.expire_objects()
+
+        self.assertFalse(self.fs.exists('a'))
+        self.assertEqual(list(FSPackedFile.objects.values_list('filename', flat=True)), ['d'])
+        self.assertNotIn(old_pack, self.fs.listdir('.packs'))
+        self.assertEqual(self.fs.readpacked('d'), b'dddd')  # pylint: disable=no-member
+
+        # Packs with no live files are deleted
+        self.fs.remove('d')
+        self.age_packs()
+        self.assertEqual(self.fs.compactpacks(), 1)  # pylint: disable=no-member
+        self.assertEqual(self.fs.listdir('.packs'), [])
+
+    def test_compact_while_writing(self):
+        # Another worker compacts between the pack write and its indexing
+        other = djpyfs.get_filesystem(self.namespace)
+        add_pack = FSPackedFile.add_pack
+
+        def compact_first(*args):
+            self.assertEqual(other.compactpacks(), 0)  # pylint: disable=no-member
+            add_pack(*args)
+
+        with patch.object(FSPackedFile, 'add_pack', side_effect=compact_first):
+            self.fs.writepacked('a', b'aaaa')  # pylint: disable=no-member
+        self.assertEqual(self.fs.readpacked('a'), b'aaaa')  # pylint: disable=no-member
+
+    def age_packs(self):
+        """
+        Make every pack older than the compaction grace period.
+        """
+        old = time.time() - 2 * 60 * 60
+        for name in self.fs.listdir('.packs'):
+            os.utime(self.fs.getsyspath(f'.packs/{name}'), (old, old))
+
+    def test_reconcile(self):
+        self.fs.writepacked('a', b'aaaa')  # pylint: disable=no-member
+        self.fs.expire('a', 30)  # pylint: disable=no-member
+        result = djpyfs.reconcile_orphans(self.namespace, grace=0)
+        self.assertEqual(result, ReconcileResult(files=1, tracked=1, untracked=0, missing=0))
+
+
+class PrewarmTest(TestCase):
+    """
+    Tests for prewarming and health checks on OSFS.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, prewarm=['unittest_prewarm'])
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(os.path.join(OsfsTest.djfs_settings['directory_root'], 'unittest_prewarm'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_app_config_ready(self):
+        with patch('djpyfs.apps.os.register_at_fork') as register_at_fork:
+            apps.get_app_config('djpyfs').ready()
+        register_at_fork.assert_called_once_with(after_in_child=djpyfs.reset_after_fork)
+        fs = djpyfs.FILESYSTEMS['unittest_prewarm']
+        self.assertIs(djpyfs.get_cached_filesystem('unittest_prewarm'), fs)
+
+        # A forked child builds its own
+        djpyfs.reset_after_fork()
+        self.assertIsNot(djpyfs.get_cached_filesystem('unittest_prewarm'), fs)
+
+    def test_health_check(self):
+        self.assertEqual(djpyfs.health_check(), {
+            'storage': 'ok', 'expiration_backend': 'ok', 'storage:unittest_prewarm': 'ok',
+        })
+        djpyfs.DJFS_SETTINGS = dict(djpyfs.DJFS_SETTINGS, directory_root='/nonexistent/django-pyfs')
+        self.assertIn('is not writable', djpyfs.health_check([])['storage'])
+
+
+class ProfilingTest(TestCase):
+    """
+    Tests for `djpyfs.profile()` and the debug toolbar panel on OSFS.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = OsfsTest.djfs_settings
+        self.fs = djpyfs.get_filesystem('unittest_profile')
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(os.path.join(djpyfs.DJFS_SETTINGS['directory_root'], 'unittest_profile'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_profile(self):
+        self.fs.writebytes('foo.txt', b'foo')
+        with djpyfs.profile() as p:
+            self.fs.writetext('bar.txt', 'bar')
+            self.fs.expire('bar.txt', 60)
+            for _ in range(3):
+                self.fs.get_url('foo.txt')
+            self.assertEqual(self.fs.readbytes('foo.txt'), b'foo')
+
+        # writetext calls writebytes, but only the outer call is recorded
+        self.assertEqual(
+            [(c.method, c.filename, c.bytes) for c in p.calls],
+            [('writetext', 'bar.txt', None), ('expire', 'bar.txt', None)]
+            + [('get_url', 'foo.txt', None)] * 3
+            + [('readbytes', 'foo.txt', 3)]
+        )
+        self.assertTrue(all(c.namespace == 'unittest_profile' and c.duration >= 0 for c in p.calls))
+        self.assertEqual(p.repeated(), [(('unittest_profile', 'get_url', 'foo.txt'), 3)])
+        self.assertTrue(p.queries)
+        self.assertTrue(all('djpyfs_fsexpirations' in q.sql for q in p.queries))
+        self.assertEqual(p.s3_requests, [])
+        self.assertEqual(p.bytes_transferred, 3)
+        self.assertIn("repeated 3x: unittest_profile: get_url('foo.txt')", p.summary())
+
+        # Nothing is recorded outside of the block
+        self.fs.get_url('foo.txt')
+        self.assertEqual(len(p.calls), 6)
+
+    def test_nested_profiles(self):
+        with djpyfs.profile() as outer:
+            self.fs.writebytes('foo.txt', b'foo')
+            with djpyfs.profile() as inner:
+                self.fs.exists('foo.txt')
+                self.fs.expire('foo.txt', 60)
+        self.assertEqual([c.method for c in inner.calls], ['exists', 'expire'])
+        self.assertEqual([c.method for c in outer.calls], ['writebytes', 'exists', 'expire'])
+        # Queries are recorded once per profile, not once per wrapper
+        self.assertGreater(len(inner.queries), 0)
+        self.assertEqual(len(outer.queries), len(inner.queries))
+
+    @unittest.skipIf(debug_toolbar is None, "django-debug-toolbar is not installed")
+    def test_panel(self):
+        from .panels import \
+            DjpyfsPanel  # pylint: disable=import-outside-toplevel
+
+        toolbar = Mock(stats={})
+        panel = DjpyfsPanel(toolbar, lambda request: None)
+        panel.enable_instrumentation()
+        self.fs.writebytes('foo.txt', b'foo')
+        self.fs.get_url('foo.txt')
+        self.fs.get_url('foo.txt')
+        panel.disable_instrumentation()
+        panel.generate_stats(None, None)
+
+        self.assertEqual(panel.nav_subtitle, "3 calls, 0 S3 requests, 1 repeated")
+        self.assertIn("<td>get_url</td><td>foo.txt</td><td>2</td>", panel.content)
+
+
+class ZeroCopyTest(TestCase):
+    """
+    Tests for `open_mmap`, `copy_to_socket` and `file_response` on OSFS.
+    """
+    namespace = 'unittest_zerocopy'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(
+            OsfsTest.djfs_settings,
+            compression={'content_types': ['text/csv']},
+            packing={'max_file_size': 10, 'pack_size': 100},
+        )
+        self.fs = djpyfs.get_filesystem(self.namespace)
+        self.fs.writebytes('data.bin', b'0123456789' * 100)
+        self.fs.writetext('report.csv', 'a,b\n' * 100)
+        self.fs.writebytes('empty.bin', b'')
+        self.fs.writepacked('small.bin', b'small')  # pylint: disable=no-member
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def _copy(self, filename, **kwargs):
+        """
+        Send a file over a socket pair, and return what was received.
+        """
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            sent = self.fs.copy_to_socket(filename, sender, **kwargs)
+            sender.shutdown(socket.SHUT_WR)
+            received = b''.join(iter(lambda: receiver.recv(65536), b''))
+        self.assertEqual(sent, len(received))
+        return received
+
+    def test_open_mmap(self):
+        with self.fs.open_mmap('data.bin') as data:
+            self.assertEqual(len(data), 1000)
+            self.assertEqual(data[5:15], b'5678901234')
+        # Compressed files are mapped decompressed
+        with self.fs.open_mmap('report.csv') as data:
+            self.assertEqual(data[:], b'a,b\n' * 100)
+        self.assertEqual(bytes(self.fs.open_mmap('empty.bin')), b'')
+        self.assertEqual(bytes(self.fs.open_mmap('small.bin')), b'small')
+        with self.assertRaises(fs_errors.ResourceNotFound):
+            self.fs.open_mmap('missing.bin')
+
+    def test_copy_to_socket(self):
+        with patch('os.sendfile', wraps=os.sendfile) as sendfile:
+            self.assertEqual(self._copy('data.bin'), b'0123456789' * 100)
+            self.assertEqual(self._copy('data.bin', offset=995, count=3), b'567')
+        self.assertTrue(sendfile.called)
+        self.assertEqual(self._copy('report.csv', offset=4, count=4), b'a,b\n')
+        self.assertEqual(self._copy('report.csv', offset=1000), b'')
+        self.assertEqual(self._copy('small.bin'), b'small')
+
+    def test_file_response(self):
+        response = file_response(self.fs, 'data.bin')
+        self.assertEqual(response['Content-Length'], '1000')
+        # A real file, which WSGI servers can send with sendfile
+        self.assertEqual(os.fstat(response.file_to_stream.fileno()).st_size, 1000)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 100)
+        response.close()
+
+        response = file_response(self.fs, 'report.csv', as_attachment=True, download_name='r.csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="r.csv"')
+        self.assertEqual(b''.join(response.streaming_content), b'a,b\n' * 100)
+        response.close()
+
+
+class ExportTest(TestCase):
+    """
+    Tests for streaming zip exports on OSFS.
+    """
+    namespace = 'unittest_export'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings, packing={'max_file_size': 10})
+        self.fs = djpyfs.get_filesystem(self.namespace)
+        self.fs.makedir('dir')
+        self.fs.writetext('a.txt', 'a')
+        self.fs.writebytes('dir/big', b'0123456789' * 1000)
+        self.fs.writepacked('packed', b'packed')  # pylint: disable=no-member
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_export_zip(self):
+        chunks = list(djpyfs.export_zip(self.namespace, prefetch=2, head_size=100, chunk_size=1000))
+        self.assertGreater(len(chunks), 10)
+        with zipfile.ZipFile(BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(archive.namelist(), ['a.txt', 'dir/big', 'packed'])
+            self.assertEqual(archive.read('a.txt'), b'a')
+            self.assertEqual(archive.read('dir/big'), b'0123456789' * 1000)
+            self.assertEqual(archive.read('packed'), b'packed')
+
+        with zipfile.ZipFile(BytesIO(b''.join(djpyfs.export_zip(self.namespace, prefix='dir/')))) as archive:
+            self.assertEqual(archive.namelist(), ['dir/big'])
+
+    def test_streams_lazily(self):
+        stream = djpyfs.export_zip(self.namespace, head_size=100, chunk_size=1000)
+        self.assertTrue(next(stream).startswith(b'PK'))
+        self.fs.remove('dir/big')
+        stream.close()
+
+    def test_view(self):
+        view = NamespaceZipView.as_view(namespace=self.namespace)
+        response = view(RequestFactory().get('/'))
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{self.namespace}.zip"')
+        with zipfile.ZipFile(BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertEqual(len(archive.namelist()), 3)
+
+        with self.assertRaises(SuspiciousFileOperation):
+            NamespaceZipView.as_view(namespace=self.namespace, prefix='../')(RequestFactory().get('/'))
+
+
+class StorageTest(TestCase):
+    """
+    Tests for the Django storage adapter on OSFS.
+    """
+    namespace = 'unittest_storage'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = OsfsTest.djfs_settings
+        self.storage = PyFSStorage(self.namespace, ttl=60)
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.storage.fs.getsyspath('/'), ignore_errors=True)
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_get_cached_filesystem(self):
+        fs = djpyfs.get_cached_filesystem(self.namespace)
+        self.assertIs(djpyfs.get_cached_filesystem(self.namespace), fs)
+        other = djpyfs.get_cached_filesystem('unittest_storage_other')
+        self.addCleanup(shutil.rmtree, other.getsyspath('/'), ignore_errors=True)
+        self.assertIsNot(other, fs)
+        djpyfs.DJFS_SETTINGS = dict(OsfsTest.djfs_settings)
+        self.assertIsNot(djpyfs.get_cached_filesystem(self.namespace), fs)
+
+    def test_save_open_delete(self):
+        name = self.storage.save('dir/file.txt', ContentFile(b'contents'))
+        self.assertEqual(name, 'dir/file.txt')
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.size(name), 8)
+        with self.storage.open(name) as f:
+            self.assertEqual(f.read(), b'contents')
+        with self.storage.open(name, 'r') as f:
+            self.assertEqual(f.read(), 'contents')
+        self.assertEqual(self.storage.listdir('dir'), ([], ['file.txt']))
+        self.assertIsNotNone(self.storage.get_modified_time(name).tzinfo)
+
+        # Names are not overwritten, and saved files expire
+        self.assertNotEqual(self.storage.save('dir/file.txt', ContentFile(b'more')), name)
+        self.assertEqual(FSExpirations.objects.filter(module=self.namespace).count(), 2)
+
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+        self.storage.delete(name)
+
+    def test_url_memoized(self):
+        self.storage.save('file.txt', ContentFile(b'contents'))
+        with patch.object(self.storage.fs, 'get_url', wraps=self.storage.fs.get_url) as get_url:
+            url = self.storage.url('file.txt')
+            self.assertEqual(self.storage.url('file.txt'), url)
+            self.assertEqual(get_url.call_count, 1)
+            self.assertEqual(url, f'/static/django-pyfs-test/{self.namespace}/file.txt')
+
+            # Deleting the file forgets its URL
+            self.storage.delete('file.txt')
+            self.storage.url('file.txt')
+            self.assertEqual(get_url.call_count, 2)
+
+            # Expired URLs are signed afresh
+            with patch('djpyfs.storage.time.monotonic', return_value=time.monotonic() + 3600):
+                self.storage.url('file.txt')
+            self.assertEqual(get_url.call_count, 3)
+
+
 class S3Test(_BaseFs):
     """
     Tests the S3FS implementation, without a prefix.
@@ -322,25 +1277,219 @@ class S3Test(_BaseFs):
         self.conn = boto3.resource('s3')
         self.conn.create_bucket(Bucket=djpyfs.DJFS_SETTINGS['bucket'])
 
+    def test_usage_accounting(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, usage_accounting=True)
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writebytes('foo', b'foo')
+        fs.upload('bar', BytesIO(b'barbar'))
+        fs.writetext('baz', 'baz')
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (12, 3))
+        fs.remove('foo')
+        self.assertEqual(FSNamespaceUsage.get_usage(self.namespace), (9, 2))
+
+    def test_compression(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, compression={'content_types': ['text/csv']})
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writetext('report.csv', 'a,b\n' * 100)
+        fs.writebytes('bytes.csv', b'a,b\n' * 100)
+
+        for name in ('report.csv', 'bytes.csv'):
+            self.assertEqual(fs.readtext(name), 'a,b\n' * 100)
+            obj = self.conn.Object(djpyfs.DJFS_SETTINGS['bucket'], fs._path_to_key(name))  # pylint: disable=protected-access
+            self.assertTrue(obj.content_encoding.startswith('gzip'))
+            self.assertEqual(obj.content_type, 'text/csv')
+            self.assertLess(obj.content_length, 100)
+
+    def test_packing(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, packing={'max_file_size': 10})
+        fs = djpyfs.get_filesystem(self.namespace)
+        with djpyfs.batch_packing():
+            fs.writepacked('a', b'aaaa')
+            fs.writepacked('b', b'bbbbbbbb')
+
+        keys = [obj.key for obj in self.conn.Bucket(djpyfs.DJFS_SETTINGS['bucket']).objects.all()]
+        self.assertEqual(len([key for key in keys if key.endswith('.pack')]), 1)
+        with patch.object(fs.client, 'get_object', wraps=fs.client.get_object) as get_object:
+            self.assertEqual(fs.readpacked('b'), b'bbbbbbbb')
+        self.assertEqual(get_object.call_args.kwargs['Range'], 'bytes=4-11')
+
+    def test_export_zip(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, compression={'content_types': ['text/csv']})
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writetext('report.csv', 'a,b\n' * 100)
+        fs.writebytes('image.png', b'png')
+
+        with zipfile.ZipFile(BytesIO(b''.join(djpyfs.export_zip(self.namespace, head_size=10)))) as archive:
+            self.assertEqual(archive.namelist(), ['image.png', 'report.csv'])
+            self.assertEqual(archive.read('report.csv'), b'a,b\n' * 100)
+            self.assertEqual(archive.read('image.png'), b'png')
+
+    def test_profile(self):
+        fs = djpyfs.get_filesystem(self.namespace)
+        with djpyfs.profile() as p:
+            fs.writebytes('foo.txt', b'foo' * 100)
+            self.assertEqual(fs.readbytes('foo.txt'), b'foo' * 100)
+            fs.get_url('foo.txt')
+
+        self.assertEqual([c.method for c in p.calls], ['writebytes', 'readbytes', 'get_url'])
+        operations = [r.operation for r in p.s3_requests]
+        self.assertIn('PutObject', operations)
+        self.assertIn('GetObject', operations)
+        # Presigning a URL makes no request
+        self.assertEqual(sum(r.bytes_sent for r in p.s3_requests), 300)
+        self.assertEqual(sum(r.bytes_received for r in p.s3_requests if r.operation == 'GetObject'), 300)
+
+    def test_zerocopy(self):
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writebytes('data.bin', b'0123456789' * 100)
+
+        with fs.open_mmap('data.bin') as data:
+            self.assertEqual(data[995:], b'56789')
+        sender, receiver = socket.socketpair()
+        with sender, receiver:
+            self.assertEqual(fs.copy_to_socket('data.bin', sender, offset=10, count=5), 5)
+            self.assertEqual(receiver.recv(10), b'01234')
+        response = file_response(fs, 'data.bin')
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789' * 100)
+        response.close()
+
+    def test_prewarm_and_health_check(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, prewarm=[self.namespace])
+        djpyfs.prewarm()
+        self.assertIsNotNone(djpyfs.S3CONN)
+        self.assertIn(self.namespace, djpyfs.FILESYSTEMS)
+        self.assertEqual(set(djpyfs.health_check().values()), {'ok'})
+
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, bucket='missing_bucket')
+        self.assertIn('ClientError', djpyfs.health_check()['storage'])
+
+    def test_write_behind(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, write_behind={
+            'directory_root': 'django-pyfs/static/django-pyfs-test-pending',
+            'url_root': '/static/django-pyfs-test-pending',
+            'workers': 0,
+        })
+        self.addCleanup(shutil.rmtree, 'django-pyfs/static/django-pyfs-test-pending', ignore_errors=True)
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writetext('foo.txt', 'foo')
+        fs.writebytes('bar.txt', b'bar')
+
+        # Staged locally, not yet on S3
+        self.assertEqual(FSPendingUpload.objects.count(), 2)
+        self.assertTrue(fs.exists('foo.txt'))
+        self.assertEqual(fs.readtext('foo.txt'), 'foo')
+        self.assertEqual(fs.getsize('bar.txt'), 3)
+        self.assertEqual(fs.get_url('foo.txt'), f'/static/django-pyfs-test-pending/{self.namespace}/foo.txt')
+        self.assertEqual(len(list(self.conn.Bucket(djpyfs.DJFS_SETTINGS['bucket']).objects.all())), 0)
+
+        fs.remove('bar.txt')
+        self.assertFalse(fs.exists('bar.txt'))
+
+        out = StringIO()
+        call_command('djpyfs_upload_worker', '--once', stdout=out)
+        self.assertIn('Uploaded 1 files', out.getvalue())
+        self.assertEqual(FSPendingUpload.objects.count(), 0)
+        self.assertTrue(fs.get_url('foo.txt').startswith('https://'))
+        self.assertEqual(fs.readtext('foo.txt'), 'foo')
+
+        # Appending writes through to S3
+        with fs.open('foo.txt', 'a') as f:
+            f.write('bar')
+        self.assertEqual(fs.readtext('foo.txt'), 'foobar')
+        self.assertEqual(FSPendingUpload.objects.count(), 0)
+
+    def test_write_behind_failures(self):
+        staging_root = 'django-pyfs/static/django-pyfs-test-pending'
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, write_behind={
+            'directory_root': staging_root,
+            'url_root': '/static/django-pyfs-test-pending',
+            'workers': 0,
+            'max_attempts': 2,
+        })
+        self.addCleanup(shutil.rmtree, staging_root, ignore_errors=True)
+        fs = djpyfs.get_filesystem(self.namespace)
+        for name in ('gone.txt', 'broken.txt', 'good.txt'):
+            fs.writetext(name, name)
+        staged = os.path.join(staging_root, self.namespace)
+        os.remove(os.path.join(staged, 'gone.txt'))
+        # Uploading a directory fails
+        os.remove(os.path.join(staged, 'broken.txt'))
+        os.mkdir(os.path.join(staged, 'broken.txt'))
+
+        # Failures don't hold up the rest of the queue
+        self.assertEqual(djpyfs.upload_write_behind(limit=1), 0)
+        self.assertEqual(djpyfs.upload_write_behind(limit=1), 0)
+        self.assertEqual(djpyfs.upload_write_behind(limit=1), 1)
+        self.assertEqual(djpyfs.upload_write_behind(), 0)
+
+        gone = FSPendingUpload.objects.get(filename='gone.txt')
+        self.assertTrue(gone.dead_letter)
+        self.assertEqual(gone.last_error, 'Staged file is missing')
+        broken = FSPendingUpload.objects.get(filename='broken.txt')
+        self.assertFalse(broken.dead_letter)
+        self.assertEqual(broken.attempts, 1)
+        self.assertGreater(broken.next_attempt, timezone.now())
+        self.assertFalse(FSPendingUpload.objects.filter(filename='good.txt').exists())
+
+        # Given up on after `max_attempts`
+        FSPendingUpload.objects.filter(filename='broken.txt').update(next_attempt=None)
+        self.assertEqual(djpyfs.upload_write_behind(), 0)
+        broken.refresh_from_db()
+        self.assertTrue(broken.dead_letter)
+        self.assertEqual(broken.attempts, 2)
+
+        # Rewriting a file queues it afresh
+        fs.writetext('gone.txt', 'back')
+        self.assertEqual(djpyfs.upload_write_behind(), 1)
+        self.assertEqual(fs.readtext('gone.txt'), 'back')
+
+    def test_write_behind_background(self):
+        djpyfs.DJFS_SETTINGS = dict(self.djfs_settings, write_behind={
+            'directory_root': 'django-pyfs/static/django-pyfs-test-pending',
+            'url_root': '/static/django-pyfs-test-pending',
+            'workers': 1,
+            'max_pending': 1,
+        })
+        self.addCleanup(shutil.rmtree, 'django-pyfs/static/django-pyfs-test-pending', ignore_errors=True)
+        fs = djpyfs.get_filesystem(self.namespace)
+        with patch('djpyfs.write_behind._get_executor') as mock_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                fs.writetext('foo.txt', 'foo')
+            submit = mock_executor.return_value.submit
+            submit.call_args[0][0](*submit.call_args[0][1:])
+
+            self.assertEqual(FSPendingUpload.objects.count(), 0)
+            self.assertTrue(fs.get_url('foo.txt').startswith('https://'))
+            self.assertEqual(fs.readtext('foo.txt'), 'foo')
+
+            # Once the queue is full, writes go straight to S3
+            fs.writetext('bar.txt', 'bar')
+            fs.writetext('baz.txt', 'baz')
+            self.assertTrue(fs.get_url('bar.txt').startswith('/static/'))
+            self.assertTrue(fs.get_url('baz.txt').startswith('https://'))
+            self.assertEqual(fs.readtext('baz.txt'), 'baz')
+
     def test_aws_options(self):
         fs = djpyfs.get_filesystem(self.namespace)
         self.assertEqual(fs.aws_access_key_id, 'foo')
         self.assertEqual(fs.aws_secret_access_key, 'bar')
         self.assertEqual(fs.region, djpyfs.DJFS_SETTINGS.get('region', None))
 
-    # This test is only relevant for S3. Generate some fake errors to make
-    # sure we cover the retry code.
+    # This test is only relevant for S3. Presigning happens locally, so
+    # errors are raised straight away rather than retried with a new client.
     def test_get_url_retry(self):
         fs = djpyfs.get_filesystem(self.namespace)
         # Call get_url() once to initialise global S3CONN so we can patch its
         # generate_presigned_url() method below.
         fs.get_url(self.relative_path_to_test_file)
-        with patch('boto3.client') as mock_client:
-            mock_client.side_effect = AttributeError("Some attribute error occurred")
+        with patch('boto3.client') as mock_boto3_client:
+            mock_boto3_client.side_effect = AttributeError("Some attribute error occurred")
             with patch.object(djpyfs.S3CONN, "generate_presigned_url") as mock_client:
-                    mock_client.side_effect = AttributeError("Some attribute error occurred")
-                    with self.assertRaises(AttributeError):
-                        fs.get_url(self.relative_path_to_test_file).startswith(self.expected_url_prefix)
+                mock_client.side_effect = AttributeError("Some attribute error occurred")
+                with self.assertRaises(AttributeError):
+                    fs.get_url(self.relative_path_to_test_file).startswith(self.expected_url_prefix)
+                self.assertEqual(mock_client.call_count, 1)
+            mock_boto3_client.assert_not_called()
 
     def tearDown(self):
         self.mock_s3.stop()
@@ -395,3 +1544,269 @@ class S3TestRegion(S3Test):
                                     f"{djpyfs.DJFS_SETTINGS['bucket']}/{self.namespace}/"
                                     f"{self.relative_path_to_test_file}")
         self._setUpS3()
+
+
+SIGNED_POLICIES = []
+
+
+def fake_cloudfront_signer(message):
+    """
+    Stand-in for an RSA signer which records what it signed.
+    """
+    SIGNED_POLICIES.append(message)
+    return b'signature'
+
+
+class ResilienceTest(TestCase):
+    """
+    Tests for retries, timeouts and the circuit breaker around S3, with
+    faults injected in front of moto.
+    """
+    namespace = 'unittest_resilience'
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        self.mock_s3 = mock_s3()
+        self.mock_s3.start()
+        boto3.resource('s3').create_bucket(Bucket=S3Test.djfs_settings['bucket'])
+        resilience.reset()
+        self.injector = FaultInjector(error_rate=1.0, fault='error')
+        self.metrics = []
+
+    def tearDown(self):
+        self.mock_s3.stop()
+        resilience.reset()
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+        super().tearDown()
+
+    def get_filesystem(self, **config):
+        """
+        Returns a filesystem with the resilience layer, faults injected and
+        metrics recorded, configured with `config`.
+        """
+        djpyfs.DJFS_SETTINGS = dict(S3Test.djfs_settings, resilience=dict({
+            'retry_mode': 'standard',
+            'max_attempts': 3,
+            'fault_injection': self.injector,
+            'metrics_hook': lambda name, value, tags: self.metrics.append((name, value, tags['operation'])),
+        }, **config))
+        return djpyfs.get_filesystem(self.namespace)
+
+    def get_object(self, fs):
+        return fs.client.get_object(Bucket=S3Test.djfs_settings['bucket'], Key='missing')
+
+    def test_retries(self):
+        fs = self.get_filesystem()
+        with self.assertRaises(ClientError):
+            self.get_object(fs)
+        self.assertEqual(self.injector.requests, 3)
+        self.assertEqual(resilience.METRICS['GetObject.failure'], 1)
+        self.assertEqual(resilience.METRICS['GetObject.retry'], 2)
+
+        # Two injected failures, then success on the third attempt
+        self.injector.error_rate = 0.0
+        failures = FaultInjector(error_rate=1.0, fault='error')
+
+        def flaky(request, **kwargs):
+            return failures(request, **kwargs) if failures.requests < 2 else None
+
+        fs.client.meta.events.register_first('before-send.s3', flaky)
+        fs.writebytes('foo', b'foo')
+        self.assertEqual(fs.readbytes('foo'), b'foo')
+        self.assertEqual(resilience.METRICS['PutObject.retry'], 2)
+        self.assertEqual(resilience.METRICS['PutObject.success'], 1)
+        self.assertIn(('djpyfs.s3.retry', 2, 'PutObject'), self.metrics)
+
+    def test_timeout(self):
+        self.injector.fault = 'timeout'
+        fs = self.get_filesystem(max_attempts=2)
+        with self.assertRaises(ReadTimeoutError):
+            self.get_object(fs)
+        self.assertEqual(self.injector.requests, 2)
+        self.assertEqual(resilience.METRICS['GetObject.failure'], 1)
+
+    def test_operation_timeouts(self):
+        self.injector.error_rate = 0.0
+        fs = self.get_filesystem(read_timeout=10, timeouts={'PutObject': 120})
+        sent = {}
+
+        def record(request, event_name, **kwargs):
+            sent[event_name.rsplit('.', 1)[-1]] = request.context.get('read_timeout')
+
+        fs.client.meta.events.register_first('before-send.s3', record)
+        fs.writebytes('foo', b'foo')
+        self.assertEqual(fs.readbytes('foo'), b'foo')
+        # Only PutObject is overridden; the rest use the client's read_timeout
+        self.assertEqual(sent['PutObject'], 120)
+        self.assertIsNone(sent['GetObject'])
+
+    def test_circuit_breaker(self):
+        fs = self.get_filesystem(max_attempts=1, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with self.assertRaises(ClientError):
+                self.get_object(fs)
+
+        # Open: fails fast, without a request
+        with self.assertRaises(CircuitOpenError):
+            fs.exists('foo')
+        self.assertEqual(self.injector.requests, 2)
+        self.assertEqual(resilience.METRICS['HeadObject.short_circuit'], 1)
+
+        # Shared by new filesystems for the same bucket
+        with self.assertRaises(CircuitOpenError):
+            self.get_object(self.get_filesystem(max_attempts=1, failure_threshold=2, reset_timeout=60))
+
+        # After the reset timeout a trial call goes through, and closes it
+        self.injector.error_rate = 0.0
+        with patch('djpyfs.resilience.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertFalse(fs.exists('foo'))
+        fs.writebytes('foo', b'foo')
+        self.assertTrue(fs.exists('foo'))
+
+    def test_not_configured(self):
+        djpyfs.DJFS_SETTINGS = S3Test.djfs_settings
+        fs = djpyfs.get_filesystem(self.namespace)
+        fs.writebytes('foo', b'foo')
+        self.assertEqual(fs.readbytes('foo'), b'foo')
+        self.assertEqual(self.injector.requests, 0)
+        self.assertEqual(len(resilience.METRICS), 0)
+
+
+class LoadTestTest(TransactionTestCase):
+    """
+    Tests for the load testing harness, with the in-process S3 stand-in.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = dict(S3Test.djfs_settings, resilience={'max_attempts': 2})
+
+    def tearDown(self):
+        super().tearDown()
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_command(self):
+        out = StringIO()
+        call_command(
+            'djpyfs_loadtest', '--stand-in', 'inprocess', '--threads', '2', '--operations', '15',
+            '--latency', '0.001', '--error-rate', '0.2', '--fault', 'error', stdout=out
+        )
+        output = out.getvalue()
+        self.assertIn('operations/second', output)
+        self.assertIn('write', output)
+        # Expirations are cleaned up
+        self.assertEqual(FSExpirations.objects.count(), 0)
+
+    def test_report(self):
+        report = run_load_test(threads=2, duration=None, operations=10, mix={'write': 1},
+                               stand_in='inprocess', error_rate=1.0, fault='error')
+        self.assertEqual(report['operations']['write'], {
+            'count': 0, 'errors': 20, 'p50': None, 'p95': None, 'p99': None, 'max': None,
+        })
+        self.assertGreater(report['throughput'], 0)
+        self.assertNotIn('fault_injection', djpyfs.DJFS_SETTINGS['resilience'])
+
+    @mock_s3
+    def test_endpoint_cleanup(self):
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=LOADTEST_BUCKET)
+        client.put_object(Bucket=LOADTEST_BUCKET, Key='keep', Body=b'foo')
+        run_load_test(threads=2, duration=None, operations=10, mix={'write': 1}, stand_in='endpoint')
+        # The objects written are removed, and nothing else
+        keys = [item['Key'] for item in client.list_objects_v2(Bucket=LOADTEST_BUCKET)['Contents']]
+        self.assertEqual(keys, ['keep'])
+
+    def test_refuses(self):
+        with self.assertRaises(ValueError):
+            run_load_test(processes=2, stand_in='inprocess')
+        FSExpirations.create_expiration('other', 'file', 0)
+        with self.assertRaises(ValueError):
+            run_load_test(stand_in='inprocess')
+
+    def test_helpers(self):
+        self.assertEqual(parse_mix('write=2,sweep'), {'write': 2.0, 'sweep': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix('delete=1')
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertIsNone(percentile([], 0.5))
+
+
+class S3UrlPolicyTest(TestCase):
+    """
+    Tests the non-presigning URL policies for S3 namespaces.
+    """
+    djfs_settings = dict(S3TestPrefix.djfs_settings, url_policies={
+        'public': {'type': 'public'},
+        'cdn': {'type': 'cdn', 'base_url': 'https://cdn.example.com/'},
+        'cloudfront': {
+            'type': 'cloudfront',
+            'base_url': 'https://abc.cloudfront.net',
+            'key_pair_id': 'KEYPAIR',
+            'signer': 'djpyfs.tests.fake_cloudfront_signer',
+        },
+        'cookies': {
+            'type': 'cloudfront',
+            'base_url': 'https://abc.cloudfront.net',
+            'key_pair_id': 'KEYPAIR',
+            'signer': fake_cloudfront_signer,
+            'cookies': True,
+        },
+    })
+
+    def setUp(self):
+        super().setUp()
+        self.orig_djpyfs_settings = djpyfs.DJFS_SETTINGS
+        djpyfs.DJFS_SETTINGS = self.djfs_settings
+        del SIGNED_POLICIES[:]
+
+    def tearDown(self):
+        super().tearDown()
+        djpyfs.DJFS_SETTINGS = self.orig_djpyfs_settings
+
+    def test_presigned_default(self):
+        with patch('boto3.client') as mock_client:
+            mock_client.return_value.generate_presigned_url.return_value = 'signed'
+            djpyfs.S3CONN = None
+            self.assertEqual(djpyfs.get_filesystem('other').get_url('foo.png'), 'signed')
+        djpyfs.S3CONN = None
+
+    def test_public(self):
+        url = djpyfs.get_filesystem('public').get_url('dir/foo.png')
+        self.assertEqual(url, 'https://s3.amazonaws.com/test_bucket/prefix/public/dir/foo.png')
+
+    def test_cdn(self):
+        url = djpyfs.get_filesystem('cdn').get_url('/foo.png')
+        self.assertEqual(url, 'https://cdn.example.com/prefix/cdn/foo.png')
+
+    def test_keys_quoted(self):
+        url = djpyfs.get_filesystem('cdn').get_url('dir/my file#1?%~é.png')
+        self.assertEqual(url, 'https://cdn.example.com/prefix/cdn/dir/my%20file%231%3F%25~%C3%A9.png')
+        url = djpyfs.get_filesystem('cloudfront').get_url('my file.png')
+        self.assertTrue(url.startswith('https://abc.cloudfront.net/prefix/cloudfront/my%20file.png?Policy='))
+
+    def test_cloudfront_signs_once(self):
+        for _ in range(3):
+            url = djpyfs.get_filesystem('cloudfront').get_url('foo.png', timeout=60)
+            self.assertTrue(url.startswith('https://abc.cloudfront.net/prefix/cloudfront/foo.png?Policy='))
+            self.assertTrue(url.endswith('&Signature=c2lnbmF0dXJl&Key-Pair-Id=KEYPAIR'))
+        self.assertEqual(len(SIGNED_POLICIES), 1)
+        self.assertIn(b'"Resource":"https://abc.cloudfront.net/prefix/cloudfront/*"', SIGNED_POLICIES[0])
+
+        # Asking for a URL which outlives the signed policy re-signs it
+        djpyfs.get_filesystem('cloudfront').get_url('foo.png', timeout=7 * 24 * 60 * 60)
+        self.assertEqual(len(SIGNED_POLICIES), 2)
+
+    def test_cloudfront_cookies(self):
+        self.assertEqual(
+            djpyfs.get_filesystem('cookies').get_url('foo.png'), 'https://abc.cloudfront.net/prefix/cookies/foo.png'
+        )
+        cookies = djpyfs.get_signed_cookies('cookies')
+        self.assertEqual(
+            sorted(cookies), ['CloudFront-Key-Pair-Id', 'CloudFront-Policy', 'CloudFront-Signature']
+        )
+        with self.assertRaises(AttributeError):
+            djpyfs.get_signed_cookies('public')
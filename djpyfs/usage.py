@@ -0,0 +1,197 @@
+"""
+Namespace usage accounting and quotas.
+
+When enabled, writes and removes made through a patched filesystem adjust
+running totals in `FSNamespaceUsage`, so the size of a namespace can be read
+without walking the filesystem or listing a bucket. Optional soft and hard
+quotas evict the files which are due to expire soonest when a namespace
+grows past them.
+"""
+import os
+import types
+
+from django.utils import timezone
+from fs import errors
+from fs.base import FS
+from fs.iotools import RawWrapper
+from fs.mode import Mode
+
+from .models import FSNamespaceUsage
+
+# Number of expirations to fetch at a time when evicting.
+EVICTION_BATCH_SIZE = 100
+
+
+class QuotaExceeded(errors.InsufficientStorage):
+    """
+    Raised when a write would take a namespace past its hard quota, and
+    evicting expiring files did not free enough space.
+    """
+    default_message = "namespace is over its hard quota: '{path}'"
+
+
+class _AccountingFile(RawWrapper):
+    """
+    Binary file which reports its final size when it is closed.
+    """
+
+    def __init__(self, f, mode, name, on_close):
+        super().__init__(f, mode=mode, name=name)
+        self._on_close = on_close
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            self._f.seek(0, os.SEEK_END)
+            size = self._f.tell()
+            super().close()
+            self._on_close(size)
+
+
+def _getsize(fs, path):
+    """
+    Returns the size of a file, or None if it does not exist.
+    """
+    try:
+        return fs.getsize(path)
+    except errors.ResourceNotFound:
+        return None
+
+
+def patch_usage(fs, namespace, get_backend, quota=None):
+    """
+    Patch a filesystem instance to keep the usage totals of its namespace.
+
+    All writes are routed through `openbin` (plus `writebytes` and `upload`
+    where the filesystem implements those directly, as S3FS does), and
+    `remove` is wrapped, so each write or remove costs one extra `getsize`.
+
+    Arguments:
+        fs (obj): The pyfilesystem subclass instance to be patched.
+        namespace (str): Namespace of the filesystem
+        get_backend (func): Returns the active expiration backend, used to
+            pick files to evict.
+        quota (dict): (optional) `soft_bytes`, `hard_bytes`, `soft_files` and
+            `hard_files` limits. Going past a soft limit evicts the files
+            which are due to expire soonest until the namespace is back under
+            it. A write which starts while the namespace is past a hard limit
+            evicts first, and raises `QuotaExceeded` if that is not enough.
+    Returns:
+        obj: Patched filesystem instance
+    """
+    quota = quota or {}
+    openbin = fs.openbin
+    remove = fs.remove
+
+    def record(old_size, new_size):
+        FSNamespaceUsage.adjust(namespace, new_size - (old_size or 0), 0 if old_size is not None else 1)
+        if _over(namespace, quota, 'soft'):
+            evict(fs, namespace, get_backend(), quota, 'soft')
+
+    def check_hard_quota(path):
+        if _over(namespace, quota, 'hard'):
+            evict(fs, namespace, get_backend(), quota, 'hard')
+            if _over(namespace, quota, 'hard'):
+                raise QuotaExceeded(path)
+
+    def accounting_openbin(self, path, mode="r", buffering=-1, **options):
+        if not Mode(mode).writing:
+            return openbin(path, mode, buffering, **options)
+        check_hard_quota(path)
+        old_size = _getsize(self, path)
+        return _AccountingFile(
+            openbin(path, mode, buffering, **options), mode, path,
+            lambda new_size: record(old_size, new_size)
+        )
+
+    def accounting_remove(self, path):
+        size = _getsize(self, path)
+        remove(path)
+        if size is not None:
+            FSNamespaceUsage.adjust(namespace, -size, -1)
+
+    # Text mode writes on OSFS skip `openbin`, so use the generic `open`,
+    # which is built on it.
+    if type(fs).open is not FS.open:
+        fs.open = types.MethodType(FS.open, fs)
+    fs.openbin = types.MethodType(accounting_openbin, fs)
+    fs.remove = types.MethodType(accounting_remove, fs)
+
+    if type(fs).writebytes is not FS.writebytes:
+        writebytes = fs.writebytes
+
+        def accounting_writebytes(self, path, contents):
+            check_hard_quota(path)
+            old_size = _getsize(self, path)
+            writebytes(path, contents)
+            record(old_size, len(contents))
+
+        fs.writebytes = types.MethodType(accounting_writebytes, fs)
+
+    if type(fs).upload is not FS.upload:
+        upload = fs.upload
+
+        def accounting_upload(self, path, file, chunk_size=None, **options):
+            check_hard_quota(path)
+            old_size = _getsize(self, path)
+            upload(path, file, chunk_size=chunk_size, **options)
+            record(old_size, _getsize(self, path) or 0)
+
+        fs.upload = types.MethodType(accounting_upload, fs)
+
+    return fs
+
+
+def _over(namespace, quota, level):
+    """
+    Returns True if the namespace is over its `level` ("soft" or "hard")
+    quota.
+    """
+    max_bytes = quota.get(f'{level}_bytes')
+    max_files = quota.get(f'{level}_files')
+    if max_bytes is None and max_files is None:
+        return False
+    size, files = FSNamespaceUsage.get_usage(namespace)
+    return (max_bytes is not None and size > max_bytes) or (max_files is not None and files > max_files)
+
+
+def evict(fs, namespace, backend, quota, level='soft'):
+    """
+    Remove the files of a namespace which are due to expire soonest, until it
+    is back under its `level` quota or there is nothing left to evict.
+
+    Returns:
+        int: Number of files evicted
+    """
+    evicted = 0
+    while _over(namespace, quota, level):
+        entries = backend.soonest(namespace, EVICTION_BATCH_SIZE)
+        if not entries:
+            break
+        for entry in entries:
+            if fs.exists(entry.filename):
+                fs.remove(entry.filename)
+            backend.remove(entry)
+            evicted += 1
+            if not _over(namespace, quota, level):
+                break
+    return evicted
+
+
+def reconcile_usage(fs, namespace):
+    """
+    Recompute the usage totals of a namespace by walking its filesystem.
+
+    Returns:
+        tuple: The `(bytes, files)` totals
+    """
+    size = 0
+    files = 0
+    for _path, info in fs.walk.info(namespaces=['details']):
+        if info.is_file:
+            size += info.size
+            files += 1
+    FSNamespaceUsage.objects.update_or_create(
+        module=namespace, defaults={'bytes': size, 'files': files, 'reconciled': timezone.now()}
+    )
+    return size, files
@@ -0,0 +1,83 @@
+"""
+Django views for django-pyfs.
+"""
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, StreamingHttpResponse
+from django.views import View
+from fs.errors import IllegalBackReference
+from fs.path import basename
+
+from . import djpyfs
+from .zerocopy import open_readable
+
+
+def zip_response(namespace, prefix='', filename=None, **kwargs):
+    """
+    Returns a `StreamingHttpResponse` which downloads the files of a
+    namespace as a zip archive built on the fly. See `djpyfs.export_zip`.
+
+    Arguments:
+        namespace (str): Namespace to export
+        prefix (str): Only export files whose names start with this string
+        filename (str): (optional) Name of the download; defaults to
+            `<namespace>.zip`
+    """
+    try:
+        archive = djpyfs.export_zip(namespace, prefix, **kwargs)
+    except IllegalBackReference as e:
+        # Answered with a 400 by Django
+        raise SuspiciousFileOperation(f"Prefix outside of the namespace: {prefix}") from e
+    response = StreamingHttpResponse(archive, content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{filename or namespace + ".zip"}"'
+    return response
+
+
+def file_response(fs, filename, as_attachment=False, download_name=None):
+    """
+    Returns a `FileResponse` which sends a stored file.
+
+    On OSFS the response wraps the file itself, so WSGI servers supporting
+    `wsgi.file_wrapper` send it with `sendfile`. Other files, such as on S3,
+    are streamed. Files stored compressed are sent decompressed.
+
+    Arguments:
+        fs (obj): Filesystem from `get_filesystem`
+        filename (str): Name of the file
+        as_attachment (bool): Whether to ask the browser to download it
+        download_name (str): (optional) Name to download it as; defaults to
+            the last part of `filename`
+    """
+    return FileResponse(
+        open_readable(fs, filename), as_attachment=as_attachment, filename=download_name or basename(filename)
+    )
+
+
+class NamespaceZipView(View):
+    """
+    Downloads a namespace as a zip archive.
+
+    This view does no access control of its own. Set `namespace`, e.g. with
+    `NamespaceZipView.as_view(namespace='reports')`, or override
+    `get_namespace` to pick one per request, and wrap it in whatever
+    permission checks the content needs.
+    """
+    namespace = None
+    prefix = ''
+
+    def get_namespace(self, request, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Returns the namespace to export.
+        """
+        return self.namespace
+
+    def get_prefix(self, request, *args, **kwargs):  # pylint: disable=unused-argument
+        """
+        Returns the prefix of the files to export.
+        """
+        return self.prefix
+
+    def get(self, request, *args, **kwargs):
+        return zip_response(
+            self.get_namespace(request, *args, **kwargs),
+            self.get_prefix(request, *args, **kwargs),
+        )
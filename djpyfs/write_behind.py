@@ -0,0 +1,269 @@
+"""
+Write-behind mode for S3 namespaces.
+
+Closing a file written to S3 blocks until the upload has finished. In
+write-behind mode, writes land on local disk instead and are queued in
+`FSPendingUpload` to be uploaded later, by a pool of background threads
+and/or the `djpyfs_upload_worker` management command. Until a file has been
+uploaded, reads and `get_url` are served from the local copy.
+
+    DJFS = {'type': 's3fs',
+            ...,
+            'write_behind': {'directory_root': '/var/cache/djpyfs',
+                             'url_root': '/static/djpyfs-pending',
+                             'workers': 4,
+                             'max_pending': 10000}}
+
+`url_root` must serve `directory_root`, like `url_root` does for `osfs`.
+`workers` is the number of upload threads per process; with 0, only the
+management command uploads. Once `max_pending` uploads are queued, writes
+go straight to S3 again until the queue drains. Failed uploads are retried
+with exponential backoff, after uploads which have failed less often, up to
+`max_attempts` times; then, or straight away if the staged file is gone,
+they are marked as dead letters in `FSPendingUpload` and left alone. The queue lives in the
+database and the files on local disk, so pending uploads survive restarts;
+run the management command as a daemon so they are picked up.
+"""
+import io
+import logging
+import os
+import types
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from fs import errors
+from fs.base import FS
+from fs.iotools import RawWrapper
+from fs.mode import Mode
+from fs.osfs import OSFS
+from fs.path import dirname, normpath, relpath
+
+from .models import FSPendingUpload
+
+log = logging.getLogger(__name__)
+
+# Seconds a worker may spend on one upload before another may retry it.
+CLAIM_TIMEOUT = 300
+
+# Seconds before the first retry of a failed upload, doubling with each
+# further attempt up to `MAX_RETRY_DELAY`.
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+
+# Background upload threads, shared by all namespaces. Created on first use.
+_EXECUTOR = None
+
+
+class _StagedFile(RawWrapper):
+    """
+    Local file which is moved into place and queued for upload when it is
+    closed.
+    """
+
+    def __init__(self, f, mode, name, on_close):
+        super().__init__(f, mode=mode, name=name)
+        self._on_close = on_close
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._on_close()
+
+
+def _get_executor(workers):
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='djpyfs-upload')
+    return _EXECUTOR
+
+
+def reset_after_fork():
+    """
+    Forget the upload threads of the parent process, which do not exist in
+    a forked child.
+    """
+    global _EXECUTOR
+    _EXECUTOR = None
+
+
+def patch_write_behind(fs, namespace, config, url_method):  # pylint: disable=too-many-statements
+    """
+    Patch an S3FS instance to stage writes on local disk.
+
+    Arguments:
+        fs (obj): The S3FS instance to be patched.
+        namespace (str): Namespace of the filesystem
+        config (dict): The `write_behind` settings; see the module
+            documentation.
+        url_method (func): `get_url` implementation for uploaded files
+    Returns:
+        tuple: The patched filesystem instance, and its `get_url` method,
+            which serves staged files from local disk.
+    """
+    staging = OSFS(os.path.join(config['directory_root'], namespace), create=True)
+    url_root = config['url_root']
+    workers = config.get('workers', 2)
+    max_pending = config.get('max_pending', 10000)
+    max_attempts = config.get('max_attempts', 10)
+
+    openbin = fs.openbin
+    exists = fs.exists
+    getinfo = fs.getinfo
+    remove = fs.remove
+
+    def is_staged(path):
+        return os.path.isfile(staging.getsyspath(path))
+
+    def queue_full():
+        # Bounded, so this stays cheap however long the queue gets
+        return FSPendingUpload.objects.filter(dead_letter=False)[:max_pending].count() >= max_pending
+
+    def enqueue(path):
+        path = relpath(normpath(path))
+        FSPendingUpload.enqueue(namespace, path)
+        if workers:
+            transaction.on_commit(lambda: _get_executor(workers).submit(_upload_in_background, fs, path))
+
+    def staging_openbin(self, path, mode="r", buffering=-1, **options):
+        _mode = Mode(mode)
+        if not _mode.writing:
+            if is_staged(path):
+                return staging.openbin(path, mode, buffering, **options)
+            return openbin(path, mode, buffering, **options)
+
+        if _mode.appending or _mode.reading or queue_full():
+            # Updating in place needs the current contents on S3, and a full
+            # queue means we write through until it drains.
+            if is_staged(path):
+                self.upload_staged(path)
+            return openbin(path, mode, buffering, **options)
+
+        if _mode.exclusive and self.exists(path):
+            raise errors.FileExists(path)
+        staging.makedirs(dirname(path), recreate=True)
+        sys_path = staging.getsyspath(path)
+        tmp_path = f"{sys_path}.{uuid.uuid4().hex}.tmp"
+
+        def on_close():
+            os.replace(tmp_path, sys_path)
+            enqueue(path)
+
+        return _StagedFile(io.open(tmp_path, 'wb'), mode, path, on_close)
+
+    def staging_exists(self, path):  # pylint: disable=unused-argument
+        return is_staged(path) or exists(path)
+
+    def staging_getinfo(self, path, namespaces=None):  # pylint: disable=unused-argument
+        if is_staged(path):
+            return staging.getinfo(path, namespaces)
+        return getinfo(path, namespaces)
+
+    def staging_remove(self, path):  # pylint: disable=unused-argument
+        staged = is_staged(path)
+        if staged:
+            staging.remove(path)
+            FSPendingUpload.objects.filter(module=namespace, filename=relpath(normpath(path))).delete()
+        try:
+            remove(path)
+        except errors.ResourceNotFound:
+            if not staged:
+                raise
+
+    def staging_get_url(self, filename, timeout=60):
+        if is_staged(filename):
+            return os.path.join(url_root, namespace, filename.lstrip('/'))
+        return url_method(self, filename, timeout)
+
+    def upload_staged(self, path):
+        """
+        Upload a staged file to S3 now, and dequeue it unless it was
+        rewritten in the meantime.
+
+        Returns:
+            bool: True if the file was uploaded
+        """
+        pending = FSPendingUpload.objects.filter(module=namespace, filename=relpath(normpath(path))).first()
+        if pending is None or not pending.claim(CLAIM_TIMEOUT):
+            return False
+        sys_path = staging.getsyspath(path)
+        try:
+            mtime = os.stat(sys_path).st_mtime_ns
+        except FileNotFoundError:
+            pending.record_failure("Staged file is missing")
+            log.error("Staged file of %s/%s is missing; giving up on its upload", namespace, path)
+            return False
+        try:
+            key = self._path_to_key(path)  # pylint: disable=protected-access
+            self.client.upload_file(
+                sys_path, self._bucket_name, key,  # pylint: disable=protected-access
+                ExtraArgs=self._get_upload_args(key)  # pylint: disable=protected-access
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            if pending.attempts >= max_attempts:
+                pending.record_failure(e)
+                log.error("Upload of %s/%s failed %d times, giving up: %s", namespace, path, pending.attempts, e)
+            else:
+                pending.record_failure(e, min(RETRY_DELAY * 2 ** (pending.attempts - 1), MAX_RETRY_DELAY))
+                log.warning("Upload of %s/%s failed: %s", namespace, path, e)
+            return False
+
+        if FSPendingUpload.objects.filter(pk=pending.pk, created=pending.created).delete()[0]:
+            try:
+                if os.stat(sys_path).st_mtime_ns == mtime:
+                    os.remove(sys_path)
+            except FileNotFoundError:
+                pass
+        else:
+            FSPendingUpload.objects.filter(pk=pending.pk).update(claimed_until=None)
+        return True
+
+    # Route every read and write through `openbin`; S3FS implements
+    # `writebytes`, `upload`, `readbytes` and `download` directly.
+    for name in ('writebytes', 'upload', 'readbytes', 'download'):
+        setattr(fs, name, types.MethodType(getattr(FS, name), fs))
+    fs.openbin = types.MethodType(staging_openbin, fs)
+    fs.exists = types.MethodType(staging_exists, fs)
+    fs.getinfo = types.MethodType(staging_getinfo, fs)
+    fs.remove = types.MethodType(staging_remove, fs)
+    fs.upload_staged = types.MethodType(upload_staged, fs)
+    return fs, staging_get_url
+
+
+def _upload_in_background(fs, path):
+    """
+    Upload a staged file from a background thread.
+    """
+    try:
+        fs.upload_staged(path)
+    finally:
+        close_old_connections()
+
+
+def upload_pending(get_filesystem, limit=None):
+    """
+    Upload queued files which are due, those which have failed least often
+    first, then oldest first. Dead letters are skipped.
+
+    Arguments:
+        get_filesystem (func): Returns the filesystem of a namespace
+        limit (int): (optional) Maximum number of files to attempt
+
+    Returns:
+        int: Number of files uploaded
+    """
+    filesystems = {}
+    uploaded = 0
+    pending = FSPendingUpload.objects.filter(
+        Q(next_attempt__isnull=True) | Q(next_attempt__lte=timezone.now()), dead_letter=False,
+    ).order_by('attempts', 'created').values_list('module', 'filename')
+    if limit is not None:
+        pending = pending[:limit]
+    for module, filename in pending:
+        if module not in filesystems:
+            filesystems[module] = get_filesystem(module)
+        if filesystems[module].upload_staged(filename):
+            uploaded += 1
+    return uploaded
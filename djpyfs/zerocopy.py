@@ -0,0 +1,142 @@
+"""
+Zero-copy reads of stored files.
+
+Every filesystem from `get_filesystem` has two extra methods for large
+files:
+
+    with fs.open_mmap('events.log') as data:
+        header = data[:64]            # Only touches the pages it reads
+        count = data.count(b'\n')
+
+    sent = fs.copy_to_socket('events.log', sock)
+
+On OSFS, `open_mmap` maps the file itself, so reads are served from the page
+cache without copying into Python objects, and `copy_to_socket` hands the
+copy to the kernel with `os.sendfile`. For files without a local path to
+map or send, such as on S3, or files stored compressed, `open_mmap` maps a
+temporary copy and `copy_to_socket` streams the file through `send`. Packed
+files are read into memory.
+
+`djpyfs.views.file_response` builds a Django `FileResponse` the same way,
+which WSGI servers supporting `wsgi.file_wrapper` send with `sendfile`.
+"""
+import io
+import mmap
+import shutil
+import tempfile
+import types
+
+from fs import errors
+
+from .export import open_stream
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _map(f):
+    """
+    Map an open file read-only. Mapping an empty file is not allowed, so
+    that gives an empty memoryview.
+    """
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        if f.seek(0, io.SEEK_END) == 0:
+            return memoryview(b'')
+        raise
+
+
+def _has_fileno(f):
+    """
+    Returns whether a file object has a file descriptor to map or send.
+    """
+    try:
+        f.fileno()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+def open_readable(fs, filename):
+    """
+    Open a file for sending, as cheaply as the backend allows. Files on
+    OSFS, and S3 files staged in write-behind mode, have a file descriptor.
+    """
+    try:
+        return open_stream(fs, filename)
+    except errors.ResourceNotFound:
+        if not hasattr(fs, 'readpacked'):
+            raise
+        return io.BytesIO(fs.readpacked(filename))
+
+
+def patch_zerocopy(fs):
+    """
+    Patch a filesystem instance with `open_mmap` and `copy_to_socket`.
+
+    Arguments:
+        fs (obj): The pyfilesystem subclass instance to be patched.
+    Returns:
+        obj: Patched filesystem instance
+    """
+
+    def open_mmap(self, filename):
+        """
+        Map a file into memory, read-only.
+
+        Arguments:
+            filename (str): Name of the file
+        Returns:
+            mmap.mmap: The mapped file, to be closed after use; or a
+                memoryview, for empty and packed files
+        """
+        try:
+            f = self.openbin(filename)
+        except errors.ResourceNotFound:
+            if hasattr(self, 'readpacked'):
+                return memoryview(self.readpacked(filename))
+            raise
+        with f:
+            if _has_fileno(f):
+                return _map(f)
+            # Compressed: map a decompressed copy instead
+            with tempfile.TemporaryFile() as copy:
+                shutil.copyfileobj(f, copy, CHUNK_SIZE)
+                copy.flush()
+                return _map(copy)
+
+    def copy_to_socket(self, filename, sock, offset=0, count=None):
+        """
+        Send a file, or part of it, over a connected blocking socket.
+
+        Arguments:
+            filename (str): Name of the file
+            sock (socket.socket): Socket to send to
+            offset (int): Where in the file to start
+            count (int): (optional) Most bytes to send; by default, up to the
+                end of the file
+        Returns:
+            int: Bytes sent
+        """
+        with open_readable(self, filename) as f:
+            if _has_fileno(f):
+                # Uses os.sendfile, falling back to send where unsupported
+                return sock.sendfile(f, offset, count)
+            # Not seekable, e.g. an S3 or decompressing stream
+            while offset:
+                skipped = len(f.read(min(offset, CHUNK_SIZE)))
+                if not skipped:
+                    return 0
+                offset -= skipped
+            sent = 0
+            while count is None or sent < count:
+                chunk = f.read(CHUNK_SIZE if count is None else min(CHUNK_SIZE, count - sent))
+                if not chunk:
+                    break
+                sock.sendall(chunk)
+                sent += len(chunk)
+            return sent
+
+    fs.open_mmap = types.MethodType(open_mmap, fs)
+    fs.copy_to_socket = types.MethodType(copy_to_socket, fs)
+    return fs
@@ -103,7 +103,7 @@ setup(
     description='Django pyfilesystem integration',
     author='Open edX',
     author_email='oscm@tcril.org',
-    packages=['djpyfs'],
+    packages=['djpyfs', 'djpyfs.management', 'djpyfs.management.commands'],
     license="Apache 2.0",
     url="https://github.com/openedx/django-pyfs",
     long_description=ld,